@@ -54,6 +54,7 @@ parser.add_argument('--max_long_term_elements', help='LT_max in paper, increase
 parser.add_argument('--num_prototypes', help='P in paper', type=int, default=128)
 
 parser.add_argument('--top_k', type=int, default=30)
+parser.add_argument('--memory_readout_budget_mb', help='Peak memory of a memory read, decrease to save memory at high resolution', type=int, default=256)
 parser.add_argument('--mem_every', help='r in paper. Increase to improve running speed.', type=int, default=5)
 parser.add_argument('--deep_update_every', help='Leave -1 normally to synchronize with mem_every', type=int, default=-1)
 
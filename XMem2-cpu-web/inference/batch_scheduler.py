@@ -0,0 +1,204 @@
+"""
+Propagation of many videos at once on a multi-core CPU.
+
+A single `run_on_video` does not scale well past a few cores with torch intra-op threads alone,
+so the jobs are run side by side in a pool of worker processes instead. Every worker is pinned to its own slice
+of the cores (with as many torch threads), and all of them use the same copy of the model weights,
+put in shared memory by the scheduler.
+"""
+import os
+import re
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+import torch
+import torch.multiprocessing as mp
+
+from inference.run_on_video import _load_network, run_on_video
+from util.configuration import VIDEO_INFERENCE_CONFIG
+
+
+@dataclass
+class PropagationJob:
+    video: str  # video file or directory with the frames
+    masks: str  # directory with the masks
+    output: str  # output directory, created if it does not exist
+    frames_with_masks: Optional[List[int]] = None  # None to use all the masks in `masks`
+    overwrite_config: dict = field(default_factory=dict)  # on top of the scheduler's config, except 'model'
+
+
+def find_frames_with_masks(masks_path) -> List[int]:
+    """Frame numbers of the masks in `masks_path` (the first integer in every file name)"""
+    frames_with_masks = []
+    for file_path in (p for p in Path(masks_path).iterdir() if p.is_file()):
+        frame_number_match = re.search(r'\d+', file_path.stem)
+        if frame_number_match is None:
+            raise ValueError(f"File {file_path} does not contain a frame number. Cannot load it as a mask.")
+        frames_with_masks.append(int(frame_number_match.group()))
+    return sorted(frames_with_masks)
+
+
+def _available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
+
+# State of a worker process, set by `_init_worker`
+_worker_network = None
+_worker_progress_queue = None
+
+
+def _init_worker(network, core_slices, progress_queue):
+    global _worker_network, _worker_progress_queue
+
+    cores = core_slices.get()
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    torch.set_grad_enabled(False)
+
+    _worker_network = network
+    _worker_progress_queue = progress_queue
+
+
+def _run_job(job_id: int, job: PropagationJob, config: dict):
+    def report(frames_done, num_frames):
+        _worker_progress_queue.put((job_id, frames_done, num_frames))
+
+    frames_with_masks = job.frames_with_masks
+    if frames_with_masks is None:
+        frames_with_masks = find_frames_with_masks(job.masks)
+
+    Path(job.output).mkdir(parents=True, exist_ok=True)
+    return run_on_video(job.video, job.masks, job.output, frames_with_masks, print_progress=False,
+                        overwrite_config={**config, **job.overwrite_config}, network=_worker_network, progress_callback=report)
+
+
+class PropagationScheduler:
+    """
+    Runs propagation jobs in a pool of worker processes, each pinned to its own slice of the CPU cores.
+
+    Parameters
+    ----------
+    num_workers : int, optional
+        Number of jobs running at once. Default: as many as fit in the available cores with `threads_per_worker` each.
+    threads_per_worker : int, optional
+        Cores (and torch threads) of every worker. Default: the available cores split between `num_workers`, or 4 if neither is given.
+    overwrite_config : dict, optional
+        Changes to `VIDEO_INFERENCE_CONFIG` for all the jobs. The model is loaded once, from its 'model'.
+    progress_callback : callable, optional
+        Called with (job_id, frames done, number of frames) after every propagated frame, from a thread of the scheduler.
+
+    Examples
+    --------
+    with PropagationScheduler(threads_per_worker=8) as scheduler:
+        job_ids = [scheduler.submit(PropagationJob(video, masks, output)) for video, masks, output in videos]
+        ...
+        print(scheduler.progress(job_ids[0]))  # {'status': 'running', 'frames_done': 120, 'num_frames': 800}
+        results = scheduler.wait()  # job_id -> pd.DataFrame with the stats of `run_on_video` (or the exception)
+    """
+
+    def __init__(self, num_workers: Optional[int] = None, threads_per_worker: Optional[int] = None,
+                 overwrite_config: Optional[dict] = None, progress_callback: Optional[Callable[[int, int, int], None]] = None):
+        cores = _available_cores()
+        if threads_per_worker is None:
+            threads_per_worker = max(1, len(cores) // num_workers) if num_workers is not None else min(4, len(cores))
+        if num_workers is None:
+            num_workers = max(1, len(cores) // threads_per_worker)
+
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker
+        self.progress_callback = progress_callback
+
+        self.config = VIDEO_INFERENCE_CONFIG.copy()
+        self.config.update(overwrite_config or {})
+
+        # loaded once, the workers get the shared memory of its weights instead of their own copies
+        network = _load_network(self.config)
+        network.share_memory()
+
+        context = mp.get_context('spawn')
+        core_slices = context.Queue()
+        for i in range(num_workers):
+            # with more workers than cores, the slices wrap around
+            core_slices.put([cores[(i*threads_per_worker + j) % len(cores)] for j in range(threads_per_worker)])
+        self._progress_queue = context.Queue()
+
+        self._executor = ProcessPoolExecutor(max_workers=num_workers, mp_context=context, initializer=_init_worker,
+                                             initargs=(network, core_slices, self._progress_queue))
+
+        self._jobs: Dict[int, Future] = {}
+        self._progress: Dict[int, dict] = {}
+        self._lock = threading.Lock()
+
+        self._progress_thread = threading.Thread(target=self._collect_progress, daemon=True)
+        self._progress_thread.start()
+
+    def submit(self, job: PropagationJob) -> int:
+        """Queue `job`, returns its id"""
+        with self._lock:
+            job_id = len(self._jobs)
+            self._progress[job_id] = {'status': 'queued', 'frames_done': 0, 'num_frames': None}
+            future = self._executor.submit(_run_job, job_id, job, self.config)
+            self._jobs[job_id] = future
+        future.add_done_callback(lambda f, job_id=job_id: self._set_finished(job_id, f))
+        return job_id
+
+    def progress(self, job_id: Optional[int] = None):
+        """Status ('queued', 'running', 'done' or 'failed') and frames done of a job, of all the jobs (by id) if None"""
+        with self._lock:
+            if job_id is not None:
+                return dict(self._progress[job_id])
+            return {i: dict(p) for i, p in self._progress.items()}
+
+    def result(self, job_id: int, timeout: Optional[float] = None):
+        """Stats of the job (see `run_on_video`), raises its exception if it failed"""
+        return self._jobs[job_id].result(timeout=timeout)
+
+    def wait(self) -> dict:
+        """Wait for all the submitted jobs, returns job_id -> stats or the exception of the job"""
+        results = {}
+        for job_id, future in list(self._jobs.items()):
+            error = future.exception()
+            results[job_id] = error if error is not None else future.result()
+        return results
+
+    def close(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+        self._progress_queue.put(None)
+        self._progress_thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close(wait=exc_type is None)
+
+    def _set_finished(self, job_id, future):
+        with self._lock:
+            progress = self._progress[job_id]
+            progress['status'] = 'failed' if future.cancelled() or future.exception() is not None else 'done'
+
+    def _collect_progress(self):
+        while True:
+            event = self._progress_queue.get()
+            if event is None:
+                return
+
+            job_id, frames_done, num_frames = event
+            with self._lock:
+                progress = self._progress[job_id]
+                if progress['status'] == 'queued':
+                    progress['status'] = 'running'
+                progress['frames_done'] = frames_done
+                progress['num_frames'] = num_frames
+
+            if self.progress_callback is not None:
+                try:
+                    self.progress_callback(job_id, frames_done, num_frames)
+                except Exception as e:
+                    print(f"Error in the progress callback: {e}")
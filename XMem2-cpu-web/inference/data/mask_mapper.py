@@ -53,12 +53,19 @@ class MaskMapper:
         return mask, new_mapped_labels
 
 
+    def remapping_lut(self):
+        # continuous index -> original label, for all 256 possible indices (unknown ones go to 0)
+        lut = np.zeros(256, dtype=np.uint8)
+        if self.coherent:
+            lut[:] = np.arange(256)
+        else:
+            for l, i in self.remappings.items():
+                lut[i] = l
+        return lut
+
     def remap_index_mask(self, mask):
         # mask is in index representation, H*W numpy array
         if self.coherent:
             return mask
 
-        new_mask = np.zeros_like(mask)
-        for l, i in self.remappings.items():
-            new_mask[mask==i] = l
-        return new_mask
\ No newline at end of file
+        return self.remapping_lut()[mask]
\ No newline at end of file
@@ -1,10 +1,7 @@
 from dataclasses import dataclass, replace
 import os
 from os import path
-from tempfile import TemporaryDirectory
-from typing import Optional
-import cv2
-import progressbar
+from typing import Optional, Tuple
 
 import torch
 from torch.utils.data.dataset import Dataset
@@ -16,6 +13,7 @@ from PIL import Image
 import numpy as np
 
 from dataset.range_transform import im_normalization
+from inference.data.video_stream import VideoStream
 
 
 @dataclass
@@ -29,19 +27,47 @@ class Sample:
     mask: Optional[torch.Tensor] = None
 
 
+def get_im_transform(size=-1):
+    """
+    size - resize min. side to size. Does nothing if <0.
+    """
+    if size < 0:
+        return transforms.Compose([
+            transforms.ToTensor(),
+            im_normalization,
+        ])
+    else:
+        return transforms.Compose([
+            transforms.ToTensor(),
+            im_normalization,
+            transforms.Resize(size, interpolation=InterpolationMode.BILINEAR),
+        ])
+
+
+def resize_mask(mask, size):
+    # mask transform is applied AFTER mapper, so we need to post-process it in eval.py
+    h, w = mask.shape[-2:]
+    min_hw = min(h, w)
+    return F.interpolate(mask, (int(h/min_hw*size), int(w/min_hw*size)), 
+                mode='nearest')
+
+
 class VideoReader(Dataset):
     """
     This class is used to read a video, one frame at a time
     """
-    def __init__(self, vid_name, video_path, mask_dir, size=-1, to_save=None, use_all_masks=False, size_dir=None):
+    def __init__(self, vid_name, video_path, mask_dir, size=-1, to_save=None, use_all_masks=False, size_dir=None,
+                 frame_range: Optional[Tuple[int, Optional[int]]] = None, read_ahead=16):
         """
-        image_dir - points to a directory of jpg images
+        image_dir - points to a directory of jpg images, or a video file
         mask_dir - points to a directory of png masks
         size - resize min. side to size. Does nothing if <0.
         to_save - optionally contains a list of file names without extensions 
             where the segmentation mask is required
         use_all_mask - when true, read all available mask in mask_dir.
             Default false. Set to true for YouTubeVOS validation.
+        frame_range - (start, end) frames of a video file to read, all by default
+        read_ahead - how many frames of a video file are decoded ahead
         """
         self.vid_name = vid_name
         self.video_path = video_path
@@ -52,24 +78,15 @@ class VideoReader(Dataset):
         self.reference_mask = Image.open(path.join(mask_dir, sorted(os.listdir(mask_dir))[0])).convert('P')
         self.first_gt_path = path.join(self.mask_dir, sorted(os.listdir(self.mask_dir))[0])
 
-        if size < 0:
-            self.im_transform = transforms.Compose([
-                transforms.ToTensor(),
-                im_normalization,
-            ])
-        else:
-            self.im_transform = transforms.Compose([
-                transforms.ToTensor(),
-                im_normalization,
-                transforms.Resize(size, interpolation=InterpolationMode.BILINEAR),
-            ])
+        self.im_transform = get_im_transform(size)
         self.size = size
 
         if os.path.isfile(self.video_path):
-            self.tmp_dir = TemporaryDirectory()
-            self.image_dir = self.tmp_dir.name
-            self._extract_frames()
+            # frames are decoded straight from the video, never written to the disk
+            self.stream = VideoStream(self.video_path, size=size, frame_range=frame_range, read_ahead=read_ahead)
+            self.image_dir = None
         else:
+            self.stream = None
             self.image_dir = video_path
 
         if size_dir is None:
@@ -77,13 +94,19 @@ class VideoReader(Dataset):
         else:
             self.size_dir = size_dir
         
-        self.frames = sorted(os.listdir(self.image_dir))
+        if self.stream is not None:
+            self.frames = self.stream.frame_names
+        else:
+            self.frames = sorted(os.listdir(self.image_dir))
 
     def __getitem__(self, idx) -> Sample:
         data = {}
         frame_name = self.frames[idx]
-        im_path = path.join(self.image_dir, frame_name)
-        img = Image.open(im_path).convert('RGB')
+        if self.stream is not None:
+            img = Image.fromarray(self.stream.get_frame(idx))
+        else:
+            im_path = path.join(self.image_dir, frame_name)
+            img = Image.open(im_path).convert('RGB')
 
         if self.image_dir == self.size_dir:
             shape = np.array(img).shape[:2]
@@ -121,37 +144,11 @@ class VideoReader(Dataset):
         return len(self.frames)
     
     def __del__(self):
-        if hasattr(self, 'tmp_dir'):
-            self.tmp_dir.cleanup()
-
-    def _extract_frames(self):
-        cap = cv2.VideoCapture(self.video_path)
-        frame_index = 0
-        print(f'Extracting frames from {self.video_path} into a temporary dir...')
-        bar = progressbar.ProgressBar(max_value=int(cap.get(cv2.CAP_PROP_FRAME_COUNT)))
-        while(cap.isOpened()):
-            _, frame = cap.read()
-            if frame is None:
-                break
-            if self.size > 0:
-                h, w = frame.shape[:2]
-                new_w = (w*self.size//min(w, h))
-                new_h = (h*self.size//min(w, h))
-                if new_w != w or new_h != h:
-                    frame = cv2.resize(frame,dsize=(new_w,new_h),interpolation=cv2.INTER_AREA)
-            cv2.imwrite(path.join(self.image_dir, f'frame_{frame_index:06d}.jpg'), frame)
-            frame_index += 1
-            bar.update(frame_index)
-        bar.finish()
-        print('Done!')
-    
+        if getattr(self, 'stream', None) is not None:
+            self.stream.close()
 
     def resize_mask(self, mask):
-        # mask transform is applied AFTER mapper, so we need to post-process it in eval.py
-        h, w = mask.shape[-2:]
-        min_hw = min(h, w)
-        return F.interpolate(mask, (int(h/min_hw*self.size), int(w/min_hw*self.size)), 
-                    mode='nearest')
+        return resize_mask(mask, self.size)
 
     def map_the_colors_back(self, pred_mask: Image.Image):
         # https://stackoverflow.com/questions/29433243/convert-image-to-specific-palette-using-pil-without-dithering
@@ -0,0 +1,182 @@
+import atexit
+import os
+import queue
+import threading
+import weakref
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+
+# Streams with a running decoding thread; it must not be left decoding while the interpreter shuts down
+_open_streams = weakref.WeakSet()
+
+
+@atexit.register
+def _close_open_streams():
+    for stream in list(_open_streams):
+        stream.close()
+
+
+class VideoStream:
+    """
+    Decodes the frames of a video file on demand, without extracting them to the disk.
+
+    Sequential reads (the inference loop) are served from a bounded read-ahead queue filled by a decoding thread,
+    any other frame index seeks the video there and restarts the read-ahead from it.
+
+    The video is opened lazily in the process that reads it, so the object can be handed to DataLoader workers.
+
+    Parameters
+    ----------
+    video_path : str
+        Path to the video file.
+    size : int
+        Resize the frames so that their shorter side is `size` (same as the frames extracted by `VideoReader` before). Does nothing if <0.
+    frame_range : (int, int), optional
+        Only read the frames [start, end) of the video. `end` can be None for "until the end".
+    read_ahead : int
+        Maximum number of decoded frames waiting in the queue.
+    """
+
+    def __init__(self, video_path: str, size: int = -1, frame_range: Optional[Tuple[int, Optional[int]]] = None, read_ahead: int = 16):
+        self.video_path = video_path
+        self.size = size
+        self.read_ahead = read_ahead
+
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise IOError(f'Could not open video {video_path}')
+        num_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if num_frames <= 0:
+            # the container does not know, count them
+            num_frames = 0
+            while cap.grab():
+                num_frames += 1
+        cap.release()
+
+        start, end = (0, None) if frame_range is None else frame_range
+        end = num_frames if end is None else min(end, num_frames)
+        if not 0 <= start < end:
+            raise ValueError(f'Invalid frame range {frame_range} for a video with {num_frames} frames')
+        self.start, self.end = start, end
+
+        self._reset_state()
+
+    def _reset_state(self):
+        self._pid = None
+        self._cap = None
+        self._queue = None
+        self._thread = None
+        self._stop = None
+        self._next_index = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # only the description of the stream goes to other processes, they open the video themselves
+        state = self.__dict__.copy()
+        for key in ('_pid', '_cap', '_queue', '_thread', '_stop', '_next_index', '_lock'):
+            state.pop(key)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset_state()
+
+    def __len__(self):
+        return self.end - self.start
+
+    @property
+    def frame_names(self):
+        """Names of the frames, the same as the ones `VideoReader` used to extract them with"""
+        return [f'frame_{i:06d}.jpg' for i in range(self.start, self.end)]
+
+    def get_frame(self, idx: int) -> np.ndarray:
+        """RGB frame `idx` (counted from the start of the frame range)"""
+        if not 0 <= idx < len(self):
+            raise IndexError(f'Frame {idx} is out of range [0, {len(self)})')
+
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset_state_for_process()
+            if idx != self._next_index:
+                self._restart(idx)
+
+            frame_idx, frame = self._queue.get()
+            if frame is None:
+                raise IOError(f'Could not decode frame {self.start + idx} of {self.video_path}')
+            assert frame_idx == idx
+            self._next_index = idx + 1
+
+        return frame
+
+    def close(self):
+        with self._lock:
+            self._stop_reader()
+            if self._cap is not None:
+                self._cap.release()
+                self._cap = None
+        _open_streams.discard(self)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def _reset_state_for_process(self):
+        # after a fork, the thread and the capture of the parent process are not usable here
+        self._pid = os.getpid()
+        self._cap = cv2.VideoCapture(self.video_path)
+        self._queue = None
+        self._thread = None
+        self._stop = None
+        self._next_index = None
+
+    def _restart(self, idx):
+        self._stop_reader()
+        self._cap.set(cv2.CAP_PROP_POS_FRAMES, self.start + idx)
+
+        self._queue = queue.Queue(maxsize=self.read_ahead)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._read_frames, args=(idx, self._queue, self._stop), daemon=True)
+        self._thread.start()
+        _open_streams.add(self)
+
+    def _stop_reader(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        # unblock the thread if it waits for free space in the queue
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        self._thread.join()
+        self._thread = None
+        self._next_index = None  # the capture position is unknown now
+
+    def _read_frames(self, idx, frames_queue, stop):
+        while idx < len(self) and not stop.is_set():
+            ok, frame = self._cap.read()
+            frame = self._prepare_frame(frame) if ok else None
+            while not stop.is_set():
+                try:
+                    frames_queue.put((idx, frame), timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+            if frame is None:
+                return
+            idx += 1
+
+    def _prepare_frame(self, frame):
+        if self.size > 0:
+            h, w = frame.shape[:2]
+            new_w = (w*self.size//min(w, h))
+            new_h = (h*self.size//min(w, h))
+            if new_w != w or new_h != h:
+                frame = cv2.resize(frame, dsize=(new_w, new_h), interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
@@ -9,7 +9,7 @@ from util.tensor_util import pad_divide_by, unpad
 
 
 class InferenceCore:
-    def __init__(self, network:XMem, config):
+    def __init__(self, network:XMem, config, warmup=True):
         self.config = config
         self.network = network
         self.mem_every = config['mem_every']
@@ -21,9 +21,12 @@ class InferenceCore:
 
         self.clear_memory()
         self.all_labels = None
+        # features of the last frame that went through `step`, re-used by `commit_mask`
+        self.last_encoded_frame = None
 
         # warmup
-        self.network.encode_key(torch.zeros((1, 3, 480, 854), device='cpu'))
+        if warmup:
+            self.network.encode_key(torch.zeros((1, 3, 480, 854), device='cpu'))
 
     def clear_memory(self, keep_permanent=False):
         self.curr_ti = -1
@@ -59,7 +62,19 @@ class InferenceCore:
                                                                          need_sk=True)
 
         return key, shrinkage, selection
-    def step(self, image, mask=None, valid_labels=None, end=False, manually_curated_masks=False, disable_memory_updates=False, do_not_add_mask_to_memory=False, return_key_and_stuff=False):
+
+    def encode_frames_batch(self, images):
+        """
+        Encode the keys and the multi-scale features of several upcoming frames (3*H*W each, all of the same size) in one forward pass.
+        Returns one `(key, shrinkage, selection, f16, f8, f4)` tuple per frame, to be given to `step` as `encoded_key`.
+        """
+        images = torch.stack([pad_divide_by(image, 16)[0] for image in images])
+
+        encoded = self.network.encode_key(images, need_ek=True, need_sk=True)
+
+        return [tuple(x[i:i+1] for x in encoded) for i in range(len(images))]
+
+    def step(self, image, mask=None, valid_labels=None, end=False, manually_curated_masks=False, disable_memory_updates=False, do_not_add_mask_to_memory=False, return_key_and_stuff=False, encoded_key=None):
         # For feedback:
         #   1. We run the model as usual
         #   2. We get feedback: 2 lists, one with good prediction indices, one with bad
@@ -68,6 +83,7 @@ class InferenceCore:
         #   5. Rerun with these settings 
         # image: 3*H*W
         # mask: num_objects*H*W or None
+        # encoded_key: the output of `encode_frames_batch` for this frame, or None to encode it here
         self.curr_ti += 1
             
         image, self.pad = pad_divide_by(image, 16)
@@ -86,10 +102,14 @@ class InferenceCore:
         ) and (not end)
         is_normal_update = (not self.deep_update_sync or not is_deep_update) and (not end)
 
-        key, shrinkage, selection, f16, f8, f4 = self.network.encode_key(image, 
-                                                    need_ek=(self.enable_long_term or need_segment), 
-                                                    need_sk=True)
+        if encoded_key is None:
+            key, shrinkage, selection, f16, f8, f4 = self.network.encode_key(image, 
+                                                        need_ek=(self.enable_long_term or need_segment), 
+                                                        need_sk=True)
+        else:
+            key, shrinkage, selection, f16, f8, f4 = encoded_key
         multi_scale_features = (f16, f8, f4)
+        self.last_encoded_frame = (image, key, shrinkage, selection, f16)
 
         if disable_memory_updates:
             is_normal_update = False
@@ -151,6 +171,35 @@ class InferenceCore:
         else:
             return res
 
+    def commit_mask(self, mask):
+        """
+        Add a (possibly corrected) mask for the last frame that went through `step` to the working memory.
+        Re-uses the key and image features computed in `step`, so the frame is not encoded again.
+        mask: num_objects*H*W, all objects in `self.all_labels`
+        """
+        if self.last_encoded_frame is None:
+            raise RuntimeError('No frame to commit the mask to, call `step` first!')
+        image, key, shrinkage, selection, f16 = self.last_encoded_frame
+
+        mask, _ = pad_divide_by(mask, 16)
+        pred_prob_with_bg = aggregate(mask.type_as(f16), dim=0)
+        self.memory.create_hidden_state(len(self.all_labels), key)
+
+        is_deep_update = (
+            self.deep_update_sync or
+            self.curr_ti-self.last_deep_update_ti >= self.deep_update_every
+        )
+        value, hidden = self.network.encode_value(image, f16, self.memory.get_hidden(), 
+                                pred_prob_with_bg[1:].unsqueeze(0), is_deep_update=is_deep_update)
+        self.memory.add_memory(key, shrinkage, value, self.all_labels, 
+                                selection=selection if self.enable_long_term else None)
+
+        self.last_mem_ti = self.curr_ti
+
+        if is_deep_update:
+            self.memory.set_hidden(hidden)
+            self.last_deep_update_ti = self.curr_ti
+
     def put_to_permanent_memory(self, image, mask, ti=None):
         image, self.pad = pad_divide_by(image, 16)
         image = image.unsqueeze(0) # add the batch dimension
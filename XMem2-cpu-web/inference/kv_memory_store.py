@@ -1,5 +1,5 @@
 import torch
-from typing import List
+from typing import List, Optional
 
 class KeyValueMemoryStore:
     """
@@ -15,45 +15,99 @@ class KeyValueMemoryStore:
     For YouTubeVOS, there can be multiple object groups
     """
 
-    def __init__(self, count_usage: bool):
-        self.count_usage = count_usage
+    """
+    The elements live in preallocated buffers with room for `capacity` elements (N is the last dimension),
+    new frames are written into the free slots instead of concatenating the whole memory every time.
+    `k`, `s`, `e`, `v`, `use_count` and `life_count` are views of the filled part of the buffers.
+    Removed ranges are compacted in place, the buffers only grow (doubling) if the capacity is exceeded.
+    `version` changes every time the keys, shrinkage, selection or values are modified (but not the usage).
+    """
 
-        # keys are stored in a single tensor and are shared between groups/objects
-        # values are stored as a list indexed by object groups
-        self.k = None
-        self.v = []
+    def __init__(self, count_usage: bool, capacity: Optional[int] = None):
+        self.count_usage = count_usage
+        # number of elements to preallocate room for, set when the memory size is known (see `reserve`)
+        self.capacity = capacity
+
+        # keys are stored in a single buffer and are shared between groups/objects
+        # values are stored as a list of buffers indexed by object groups
+        # the values of a group are the last `_v_size[gi]` elements (the group may have been added later)
+        self._k = None
+        self._v = []
+        self._v_size = []
+        self._size = 0
         self.obj_groups = []
         # for debugging only
         self.all_objects = []
 
-        # shrinkage and selection are also single tensors
-        self.s = self.e = None
+        # shrinkage and selection are also single buffers
+        self._s = self._e = None
 
         # usage
-        if self.count_usage:
-            self.use_count = self.life_count = None
+        self._use_count = self._life_count = None
+
+        self.version = 0
+
+    def reserve(self, capacity: int):
+        """Make room for at least `capacity` elements, so that adding them does not reallocate"""
+        self.capacity = max(capacity, self.capacity or 0)
+        if self._k is not None and self._k.shape[-1] < self.capacity:
+            self._grow(self.capacity)
+
+    @staticmethod
+    def _new_buffer(like, capacity):
+        return torch.empty((*like.shape[:-1], capacity), device=like.device, dtype=like.dtype)
+
+    @staticmethod
+    def _resized(buffer, size, capacity):
+        if buffer is None:
+            return None
+        new_buffer = KeyValueMemoryStore._new_buffer(buffer, capacity)
+        new_buffer[..., :size] = buffer[..., :size]
+        return new_buffer
+
+    def _grow(self, capacity):
+        self._k = self._resized(self._k, self._size, capacity)
+        self._s = self._resized(self._s, self._size, capacity)
+        self._e = self._resized(self._e, self._size, capacity)
+        self._use_count = self._resized(self._use_count, self._size, capacity)
+        self._life_count = self._resized(self._life_count, self._size, capacity)
+        self._v = [self._resized(gv, gs, capacity) for gv, gs in zip(self._v, self._v_size)]
+
+    def _ensure_capacity(self, needed: int):
+        current = self._k.shape[-1]
+        if needed > current:
+            self._grow(max(needed, 2*current))
+
+    @staticmethod
+    def _write(buffer, start, data):
+        buffer[..., start:start+data.shape[-1]] = data
 
     def add(self, key, value, shrinkage, selection, objects: List[int]):
-        new_count = torch.zeros((key.shape[0], 1, key.shape[2]), device=key.device, dtype=torch.float32)
-        new_life = torch.zeros((key.shape[0], 1, key.shape[2]), device=key.device, dtype=torch.float32) + 1e-7
+        self.version += 1
+        n = key.shape[-1]
 
         # add the key
-        if self.k is None:
-            self.k = key
-            self.s = shrinkage
-            self.e = selection
+        if self._k is None:
+            capacity = max(n, self.capacity or 0)
+            self._k = self._new_buffer(key, capacity)
+            self._s = self._new_buffer(shrinkage, capacity) if shrinkage is not None else None
+            self._e = self._new_buffer(selection, capacity) if selection is not None else None
             if self.count_usage:
-                self.use_count = new_count
-                self.life_count = new_life
+                self._use_count = torch.empty((key.shape[0], 1, capacity), device=key.device, dtype=torch.float32)
+                self._life_count = torch.empty((key.shape[0], 1, capacity), device=key.device, dtype=torch.float32)
         else:
-            self.k = torch.cat([self.k, key], -1)
-            if shrinkage is not None:
-                self.s = torch.cat([self.s, shrinkage], -1)
-            if selection is not None:
-                self.e = torch.cat([self.e, selection], -1)
-            if self.count_usage:
-                self.use_count = torch.cat([self.use_count, new_count], -1)
-                self.life_count = torch.cat([self.life_count, new_life], -1)
+            self._ensure_capacity(self._size + n)
+
+        start = self._size
+        self._write(self._k, start, key)
+        if shrinkage is not None and self._s is not None:
+            self._write(self._s, start, shrinkage)
+        if selection is not None and self._e is not None:
+            self._write(self._e, start, selection)
+        if self.count_usage:
+            self._use_count[..., start:start+n] = 0
+            self._life_count[..., start:start+n] = 1e-7
+        self._size += n
 
         # add the value
         if objects is not None:
@@ -67,12 +121,12 @@ class KeyValueMemoryStore:
                 for obj in group:
                     # should properly raise an error if there are overlaps in obj_groups
                     remaining_objects.remove(obj)
-                self.v[gi] = torch.cat([self.v[gi], value[group]], -1)
+                self._add_group_value(gi, value[group])
 
             # If there are remaining objects, add them as a new group
             if len(remaining_objects) > 0:
                 new_group = list(remaining_objects)
-                self.v.append(value[new_group])
+                self._add_group_value(self.num_groups, value[new_group])
                 self.obj_groups.append(new_group)
                 self.all_objects.extend(new_group)
                 
@@ -84,25 +138,34 @@ class KeyValueMemoryStore:
             for gi, gv in enumerate(value):
                 if gv is None:
                     continue
-                if gi < self.num_groups:
-                    self.v[gi] = torch.cat([self.v[gi], gv], -1)
-                else:
-                    self.v.append(gv)
+                self._add_group_value(gi, gv)
 
-        pos = int((self.k.shape[-1] + 1e-9) // (key.shape[-1] + 1e-9)) - 1  # index of newly added frame
+        pos = int((self.size + 1e-9) // (n + 1e-9)) - 1  # index of newly added frame
 
         return pos
 
+    def _add_group_value(self, gi, gv):
+        if gi < self.num_groups:
+            self._write(self._v[gi], self._v_size[gi], gv)
+            self._v_size[gi] += gv.shape[-1]
+        else:
+            # the buffer of a new group has the same capacity as the keys
+            buffer = self._new_buffer(gv, self._k.shape[-1])
+            self._write(buffer, 0, gv)
+            self._v.append(buffer)
+            self._v_size.append(gv.shape[-1])
+
     def update_usage(self, usage):
         # increase all life count by 1
         # increase use of indexed elements
         if not self.count_usage:
             return
         
-        self.use_count += usage.view_as(self.use_count)
-        self.life_count += 1
+        self._use_count[..., :self._size] += usage.view_as(self.use_count)
+        self._life_count[..., :self._size] += 1
 
     def replace_at(self, start_pos: int, key, value, shrinkage=None, selection=None):
+        self.version += 1
         start = start_pos * key.shape[-1]
         end = (start_pos + 1) * key.shape[-1]
 
@@ -122,63 +185,65 @@ class KeyValueMemoryStore:
 
         self.sieve_by_range(start, end, min_size=0)  # remove the value irrespective of its size 
 
+    @staticmethod
+    def _remove_range(buffer, size, start, end):
+        # removes buffer[..., start:end] of the filled part, moving the rest to the left in place
+        # returns the new size
+        start, end, _ = slice(start, end).indices(size)
+        if end <= start:
+            return size
+        tail = size - end
+        if tail > 0:
+            # the source and the destination may overlap
+            buffer[..., start:start+tail] = buffer[..., end:size].clone()
+        return start + tail
+
     def sieve_by_range(self, start: int, end: int, min_size: int):
         # keep only the elements *outside* of this range (with some boundary conditions)
         # i.e., concat (a[:start], a[end:])
         # min_size is only used for values, we do not sieve values under this size
         # (because they are not consolidated)
+        self.version += 1
 
         if end == 0:
             # just sieves till the `start`
             # negative 0 would not work as the end index!
-            self.k = self.k[:,:,:start]
-            if self.count_usage:
-                self.use_count = self.use_count[:,:,:start]
-                self.life_count = self.life_count[:,:,:start]
-            if self.s is not None:
-                self.s = self.s[:,:,:start]
-            if self.e is not None:
-                self.e = self.e[:,:,:start]
-            
-            for gi in range(self.num_groups):
-                if self.v[gi].shape[-1] >= min_size:
-                    self.v[gi] = self.v[gi][:,:,:start]
-        else:
-            self.k = torch.cat([self.k[:,:,:start], self.k[:,:,end:]], -1)
-            if self.count_usage:
-                self.use_count = torch.cat([self.use_count[:,:,:start], self.use_count[:,:,end:]], -1)
-                self.life_count = torch.cat([self.life_count[:,:,:start], self.life_count[:,:,end:]], -1)
-            if self.s is not None:
-                self.s = torch.cat([self.s[:,:,:start], self.s[:,:,end:]], -1)
-            if self.e is not None:
-                self.e = torch.cat([self.e[:,:,:start], self.e[:,:,end:]], -1)
-            
-            for gi in range(self.num_groups):
-                if self.v[gi].shape[-1] >= min_size:
-                    self.v[gi] = torch.cat([self.v[gi][:,:,:start], self.v[gi][:,:,end:]], -1)
+            end = None
+
+        size = self._size
+        for buffer in (self._k, self._s, self._e, self._use_count, self._life_count):
+            if buffer is not None:
+                self._size = self._remove_range(buffer, size, start, end)
+
+        for gi in range(self.num_groups):
+            if self._v_size[gi] >= min_size:
+                self._v_size[gi] = self._remove_range(self._v[gi], self._v_size[gi], start, end)
 
     def remove_obsolete_features(self, max_size: int):
+        self.version += 1
+
         # normalize with life duration
         usage = self.get_usage().flatten()
 
         values, _ = torch.topk(usage, k=(self.size-max_size), largest=False, sorted=True)
         survived = (usage > values[-1])
 
-        self.k = self.k[:, :, survived]
-        self.s = self.s[:, :, survived] if self.s is not None else None
-        # Long-term memory does not store ek so this should not be needed
-        self.e = self.e[:, :, survived] if self.e is not None else None
         if self.num_groups > 1:
             raise NotImplementedError("""The current data structure does not support feature removal with 
             multiple object groups (e.g., some objects start to appear later in the video)
             The indices for "survived" is based on keys but not all values are present for every key
             Basically we need to remap the indices for keys to values
             """)
-        for gi in range(self.num_groups):
-            self.v[gi] = self.v[gi][:, :, survived]
 
-        self.use_count = self.use_count[:, :, survived]
-        self.life_count = self.life_count[:, :, survived]
+        # compact the survivors to the beginning of the buffers
+        new_size = int(survived.sum())
+        for buffer in (self._k, self._s, self._e, self._use_count, self._life_count):
+            if buffer is not None:
+                buffer[..., :new_size] = buffer[..., :self._size][..., survived]
+        for gi in range(self.num_groups):
+            self._v[gi][..., :new_size] = self._v[gi][..., :self._v_size[gi]][..., survived]
+            self._v_size[gi] = new_size
+        self._size = new_size
 
     def get_usage(self):
         # return normalized usage
@@ -206,21 +271,42 @@ class KeyValueMemoryStore:
         return k, sk, ek, usage
 
     def get_v_size(self, ni: int):
-        return self.v[ni].shape[2]
+        return self._v_size[ni]
 
     def engaged(self):
-        return self.k is not None
+        return self._k is not None
 
     @property
     def size(self):
-        if self.k is None:
-            return 0
-        else:
-            return self.k.shape[-1]
+        return self._size
 
     @property
     def num_groups(self):
-        return len(self.v)
+        return len(self._v)
+
+    @property
+    def k(self):
+        return self._k[..., :self._size] if self._k is not None else None
+
+    @property
+    def s(self):
+        return self._s[..., :self._size] if self._s is not None else None
+
+    @property
+    def e(self):
+        return self._e[..., :self._size] if self._e is not None else None
+
+    @property
+    def use_count(self):
+        return self._use_count[..., :self._size] if self._use_count is not None else None
+
+    @property
+    def life_count(self):
+        return self._life_count[..., :self._size] if self._life_count is not None else None
+
+    @property
+    def v(self):
+        return [gv[..., :gs] for gv, gs in zip(self._v, self._v_size)]
 
     @property
     def key(self):
@@ -237,4 +323,3 @@ class KeyValueMemoryStore:
     @property
     def selection(self):
         return self.e
-
@@ -4,6 +4,9 @@ import warnings
 from inference.kv_memory_store import KeyValueMemoryStore
 from model.memory_util import *
 
+# the query pixels of a memory read are processed in chunks of a multiple of this
+READOUT_BLOCK = 64
+
 
 class MemoryManager:
     """
@@ -14,6 +17,8 @@ class MemoryManager:
         self.config = config
         self.hidden_dim = config['hidden_dim']
         self.top_k = config['top_k']
+        # peak memory (in MB) of the temporary tensors of a memory read, None to read all the query pixels at once
+        self.readout_budget_mb = config.get('memory_readout_budget_mb', 256)
 
         self.enable_long_term = config['enable_long_term']
         self.enable_long_term_usage = config['enable_long_term_count_usage']
@@ -37,12 +42,16 @@ class MemoryManager:
         if self.enable_long_term:
             self.long_mem = KeyValueMemoryStore(count_usage=self.enable_long_term_usage)
 
+        # concatenation of the memory stores for reading, see `_concatenated_memory`
+        self._memory_cache = None
+
         self.reset_config = True
 
     def update_config(self, config):
         self.reset_config = True
         self.hidden_dim = config['hidden_dim']
         self.top_k = config['top_k']
+        self.readout_budget_mb = config.get('memory_readout_budget_mb', 256)
 
         assert self.enable_long_term == config['enable_long_term'], 'cannot update this'
         assert self.enable_long_term_usage == config['enable_long_term_count_usage'], 'cannot update this'
@@ -58,134 +67,140 @@ class MemoryManager:
         # this function is for a single object group
         return v @ affinity
 
+    def _memory_stores(self, use_long_term):
+        return ([self.long_mem] if use_long_term else []) + [self.temporary_work_mem, self.permanent_work_mem]
+
+    def _concatenated_memory(self, use_long_term, transpose_values=False):
+        """
+        Keys, shrinkage and the values of every object group of the memory stores (long-term if `use_long_term`, temporary, permanent),
+        concatenated in this order. The memory does not change on most frames, so the result is cached
+        until one of the stores is modified (their `version` changes).
+        With `transpose_values`, the values of a group are N x (num_objects*CV), the layout `topk_readout` gathers from.
+        """
+        stores = self._memory_stores(use_long_term)
+        stamp = (transpose_values,) + tuple((id(store), store.version) for store in stores)
+
+        if self._memory_cache is None or self._memory_cache[0] != stamp:
+            # = permanent_work_mem.num_groups, since it's always >= temporary_work_mem.num_groups
+            num_groups = max(self.temporary_work_mem.num_groups, self.permanent_work_mem.num_groups)
+
+            memory_key = torch.cat([store.key for store in stores], -1)
+            shrinkage = torch.cat([store.shrinkage for store in stores], -1)
+            # later groups are not in the long-term memory if they did not go through consolidation yet
+            memory_value = [torch.cat([store.value[gi] for store in stores if gi < store.num_groups], -1)
+                            for gi in range(num_groups)]
+            if transpose_values:
+                memory_value = [gv.flatten(end_dim=1).t().contiguous() for gv in memory_value]
+
+            # drop the old concatenation before keeping the new one
+            self._memory_cache = None
+            self._memory_cache = (stamp, memory_key, shrinkage, memory_value)
+
+        return self._memory_cache[1:]
+
+    def _readout_chunk_size(self, num_memory, max_group_dims, hw):
+        # number of query pixels read at once, so that the temporary tensors of one chunk stay under the budget
+        if self.readout_budget_mb is None:
+            return hw
+        if self.top_k is not None:
+            # similarity and its rows for a group, readout, and the top-k values/indices of every query pixel
+            bytes_per_pixel = 4 * (2*num_memory + max_group_dims) + 32 * self.top_k
+        else:
+            # similarity and its rows for a group, the dense softmax temporaries, readout
+            bytes_per_pixel = 4 * (5*num_memory + max_group_dims)
+        # whole blocks of pixels: the matrix products of narrow chunks round differently than the untiled read
+        chunk_size = int(self.readout_budget_mb * 1024 * 1024) // bytes_per_pixel
+        return max(READOUT_BLOCK, chunk_size - chunk_size % READOUT_BLOCK)
+
     def match_memory(self, query_key, selection, disable_usage_updates=False):
         # query_key: B x C^k x H x W
         # selection:  B x C^k x H x W
         # 1x64x30x54
-
-        # = permanent_work_mem.num_groups, since it's always >= temporary_work_mem.num_groups
-        num_groups = max(self.temporary_work_mem.num_groups, self.permanent_work_mem.num_groups)
+        # The query pixels are read independently of each other, so they are processed in chunks
+        # and the N x HW similarity/affinity never has to be in memory at once (see `readout_budget_mb`)
         h, w = query_key.shape[-2:]
 
         query_key = query_key.flatten(start_dim=2)
         selection = selection.flatten(start_dim=2) if selection is not None else None
+        hw = query_key.shape[-1]
 
         """
         Memory readout using keys
         """
 
-        temp_work_mem_size = self.temporary_work_mem.size
-        if self.enable_long_term and self.long_mem.engaged():
-            # Use long-term memory
-            long_mem_size = self.long_mem.size
-
-            memory_key = torch.cat([self.long_mem.key, self.temporary_work_mem.key, self.permanent_work_mem.key], -1)
-            shrinkage = torch.cat([self.long_mem.shrinkage, self.temporary_work_mem.shrinkage, self.permanent_work_mem.shrinkage], -1)
-
-            similarity = get_similarity(memory_key, shrinkage, query_key, selection)
-
-            long_mem_similarity = similarity[:, :long_mem_size]
-            temp_work_mem_similarity = similarity[:, long_mem_size:long_mem_size+temp_work_mem_size]
-            perm_work_mem_similarity = similarity[:, long_mem_size+temp_work_mem_size:]
-
-            # get the usage with the first group
-            # the first group always have all the keys valid
-            affinity, usage = do_softmax(
-                torch.cat([long_mem_similarity[:, -self.long_mem.get_v_size(0):], temp_work_mem_similarity, perm_work_mem_similarity], 1),
-                top_k=self.top_k, inplace=True, return_usage=True)
-            affinity = [affinity]
-
-            # compute affinity group by group as later groups only have a subset of keys
-            for gi in range(1, num_groups):
-                temp_group_v_size = self.temporary_work_mem.get_v_size(gi)
-                perm_group_v_size = self.permanent_work_mem.get_v_size(gi)
-                temp_sim_size = temp_work_mem_similarity.shape[1] 
-                perm_sim_size = perm_work_mem_similarity.shape[1] 
-
-                if gi < self.long_mem.num_groups:
-                    # merge working and lt similarities before softmax
-                    affinity_one_group = do_softmax(
-                        torch.cat([long_mem_similarity[:, -self.long_mem.get_v_size(gi):],
-                                   temp_work_mem_similarity[:, temp_sim_size-temp_group_v_size:],
-                                   perm_work_mem_similarity[:, perm_sim_size-perm_group_v_size:]],
-                                dim=1),
-                        top_k=self.top_k, inplace=True)
-                else:
-                    # no long-term memory for this group
-                    affinity_one_group = do_softmax(torch.cat([
-                            temp_work_mem_similarity[:, temp_sim_size-temp_group_v_size:], 
-                            perm_work_mem_similarity[:, perm_sim_size-perm_group_v_size:]],
-                            1),
-                        top_k=self.top_k, inplace=(gi == num_groups-1))
-                affinity.append(affinity_one_group)
-
-            all_memory_value = []
-            for gi in range(num_groups):
-                # merge the working and lt values before readout
-                if gi < self.long_mem.num_groups:
-                    all_memory_value.append(torch.cat([self.long_mem.value[gi], self.temporary_work_mem.value[gi], self.permanent_work_mem.value[gi]], -1))
-                else:
-                    all_memory_value.append(torch.cat([self.temporary_work_mem.value[gi], self.permanent_work_mem.value[gi]], -1))
-
-            """
-            Record memory usage for working and long-term memory
-            """
-            if not disable_usage_updates:
-            # ignore the index return for long-term memory
-                work_usage = usage[:, long_mem_size:long_mem_size+temp_work_mem_size]  # no usage for permanent memory
-                self.temporary_work_mem.update_usage(work_usage.flatten())
-
-                if self.enable_long_term_usage:
-                    # ignore the index return for working memory
-                    long_usage = usage[:, :long_mem_size]
-                    self.long_mem.update_usage(long_usage.flatten())
+        use_long_term = self.enable_long_term and self.long_mem.engaged()
+        stores = self._memory_stores(use_long_term)
+        # with top-k, `topk_readout` reads the transposed values
+        memory_key, shrinkage, all_memory_value = self._concatenated_memory(use_long_term, transpose_values=(self.top_k is not None))
+        num_memory = memory_key.shape[-1]
+
+        # rows of the similarity used by every object group, None for all of them
+        # later groups only have a subset of keys: the values of a group are the last get_v_size(gi) elements of every store that has it
+        group_rows = []
+        for gi in range(len(all_memory_value)):
+            rows, offset = [], 0
+            for store in stores:
+                if gi < store.num_groups:
+                    rows.append(torch.arange(offset+store.size-store.get_v_size(gi), offset+store.size, device=memory_key.device))
+                offset += store.size
+            rows = torch.cat(rows)
+            group_rows.append(None if rows.shape[0] == num_memory else rows)
+
+        # usage of every memory element, from the first group (it always has all the keys valid)
+        usage = torch.zeros((1, num_memory), device=memory_key.device, dtype=torch.float32) if self.enable_long_term else None
+
+        if self.top_k is not None:
+            group_dims = [gv.shape[1] for gv in all_memory_value]
         else:
-            memory_key = torch.cat([self.temporary_work_mem.key, self.permanent_work_mem.key], -1)
-            shrinkage = torch.cat([self.temporary_work_mem.shrinkage, self.permanent_work_mem.shrinkage], -1)
-            # No long-term memory
-            similarity = get_similarity(memory_key, shrinkage, query_key, selection)
-            temp_work_mem_similarity = similarity[:, :temp_work_mem_size]
-            perm_work_mem_similarity = similarity[:, temp_work_mem_size:]
+            group_dims = [gv.shape[0]*gv.shape[1] for gv in all_memory_value]
+        chunk_size = self._readout_chunk_size(num_memory, max(group_dims), hw)
+
+        all_readout_mem = [torch.empty((1, dims, hw), device=memory_key.device, dtype=gv.dtype)
+                           for dims, gv in zip(group_dims, all_memory_value)]
+        start = 0
+        while start < hw:
+            end = min(start+chunk_size, hw)
+            if hw - end < READOUT_BLOCK:
+                end = hw  # no narrow last chunk
+            similarity = get_similarity(memory_key, shrinkage, query_key[:, :, start:end],
+                                        selection[:, :, start:end] if selection is not None else None)
+
+            for gi, gv in enumerate(all_memory_value):
+                rows = group_rows[gi]
+                group_usage = usage if gi == 0 else None
+                group_similarity = similarity if rows is None else similarity[:, rows]
+
+                if self.top_k is not None:
+                    readout_mem = topk_readout(group_similarity, gv, self.top_k, usage=group_usage, usage_rows=rows)
+                else:
+                    if group_usage is not None:
+                        affinity, group_chunk_usage = do_softmax(group_similarity, return_usage=True)
+                        if rows is None:
+                            group_usage += group_chunk_usage
+                        else:
+                            group_usage[:, rows] += group_chunk_usage
+                    else:
+                        affinity = do_softmax(group_similarity)
+                    # Shared affinity within each group
+                    readout_mem = self._readout(affinity, gv).flatten(end_dim=1).unsqueeze(0)
 
-            if self.enable_long_term:
-                affinity, usage = do_softmax(similarity, inplace=(num_groups == 1),
-                                             top_k=self.top_k, return_usage=True)
-                if not disable_usage_updates:
-                    # Record memory usage for working memory
-                    self.temporary_work_mem.update_usage(usage[:, :temp_work_mem_size].flatten())
-            else:
-                affinity = do_softmax(similarity, inplace=(num_groups == 1),
-                                      top_k=self.top_k, return_usage=False)
-
-            affinity = [affinity]
-
-            # compute affinity group by group as later groups only have a subset of keys
-            for gi in range(1, num_groups):
-                temp_group_v_size = self.temporary_work_mem.get_v_size(gi)
-                perm_group_v_size = self.permanent_work_mem.get_v_size(gi)
-                temp_sim_size = temp_work_mem_similarity.shape[1] 
-                perm_sim_size = perm_work_mem_similarity.shape[1] 
-
-                affinity_one_group = do_softmax(
-                    torch.cat([
-                        # concats empty tensor if the group is also empty for temporary memory
-                        temp_work_mem_similarity[:, temp_sim_size-temp_group_v_size:], 
-                        perm_work_mem_similarity[:, perm_sim_size-perm_group_v_size:], 
-                    ], dim=1),
-                    top_k=self.top_k, inplace=(gi == num_groups-1)
-                )
-                affinity.append(affinity_one_group)
-
-            all_memory_value = []
-            for gi in range(num_groups):
-                group_v_cat = torch.cat([self.temporary_work_mem.value[gi], self.permanent_work_mem.value[gi]], -1)
-                all_memory_value.append(group_v_cat)
-
-        # Shared affinity within each group
-        all_readout_mem = torch.cat([
-            self._readout(affinity[gi], gv)
-            for gi, gv in enumerate(all_memory_value)
-        ], 0)
+                all_readout_mem[gi][:, :, start:end] = readout_mem
+
+            start = end
+
+        """
+        Record memory usage for working and long-term memory
+        """
+        if usage is not None and not disable_usage_updates:
+            long_mem_size = self.long_mem.size if use_long_term else 0
+            work_usage = usage[:, long_mem_size:long_mem_size+self.temporary_work_mem.size]  # no usage for permanent memory
+            self.temporary_work_mem.update_usage(work_usage.flatten())
+
+            if use_long_term and self.enable_long_term_usage:
+                long_usage = usage[:, :long_mem_size]
+                self.long_mem.update_usage(long_usage.flatten())
+
+        all_readout_mem = torch.cat([mem.view(-1, self.CV, hw) for mem in all_readout_mem], 0)
 
         return all_readout_mem.view(all_readout_mem.shape[0], self.CV, h, w)
 
@@ -221,6 +236,10 @@ class MemoryManager:
                 # convert from num. frames to num. nodes
                 self.min_work_elements = self.min_mt_frames*self.HW
                 self.max_work_elements = self.max_mt_frames*self.HW
+                # the working memory is consolidated once it reaches max_work_elements
+                # the long-term memory never grows past max_long_elements
+                self.temporary_work_mem.reserve(self.max_work_elements + self.HW)
+                self.long_mem.reserve(self.max_long_elements)
 
         # key:   1*C*N
         # value: num_objects*C*N
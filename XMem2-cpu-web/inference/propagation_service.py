@@ -0,0 +1,185 @@
+"""
+In-process mask propagation for a single frame at a time.
+
+`run_on_video` is made for whole videos: every call creates the network, reads the weights from the disk,
+builds the data loaders and spins up the image savers. When frames are propagated one by one
+(the annotation tool does that on every "run model on frame" click), this set-up dominates the run time.
+
+`PropagationService` loads the network once and answers "propagate frame N" requests in-process.
+With a `session_id`, it also keeps the memory of the video between consecutive requests (see `PropagationSession`).
+"""
+from collections import OrderedDict
+from os import PathLike, path
+from typing import Optional, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+
+from inference.data.mask_mapper import MaskMapper
+from inference.data.video_reader import get_im_transform, resize_mask
+from inference.inference_core import InferenceCore
+from inference.run_on_video import _load_network
+from util.configuration import VIDEO_INFERENCE_CONFIG
+from util.image_saver import colorize_index_mask, palette_colors
+
+
+class PropagationSession:
+    """
+    Propagation state of one video, kept between consecutive single-frame requests.
+
+    Annotators step through a video frame by frame: propagate frame N, correct it, propagate frame N+1, ...
+    Instead of re-encoding the reference frame and rebuilding the memory from scratch on every step,
+    the session keeps the `MemoryManager` (permanent, working and long-term memory) of its `InferenceCore`.
+    When the request for frame N+1 arrives, the accepted mask of frame N is added to the memory
+    re-using the features computed when frame N was propagated, so only the new query frame is encoded.
+    """
+
+    def __init__(self, processor: InferenceCore) -> None:
+        self.processor = processor
+        self.mapper = None
+        self.reference_mask = None
+        # the last frame that was propagated; its mask is committed to the memory on the next request
+        self.last_frame_path = None
+
+    def can_continue_from(self, prev_frame_path) -> bool:
+        return self.last_frame_path is not None and path.abspath(prev_frame_path) == self.last_frame_path
+
+    def start(self, reference_mask: Image.Image):
+        self.processor.clear_memory()
+        self.mapper = MaskMapper()
+        self.reference_mask = reference_mask
+        self.last_frame_path = None
+
+
+class PropagationService:
+    """
+    Keeps the XMem network (and the `InferenceCore` around it) loaded between requests.
+
+    Parameters
+    ----------
+    overwrite_config : dict, optional
+        Values to override in `VIDEO_INFERENCE_CONFIG`, e.g. `{'model': 'saves/XMem.pth'}`.
+
+    Examples
+    --------
+    service = PropagationService({'model': 'saves/XMem.pth'})
+    mask = service.propagate('JPEGImages/frame_000004.jpg', 'Annotations/frame_000004.png', 'JPEGImages/frame_000005.jpg')
+    mask.save('Annotations/frame_000005.png')
+
+    # Stepping through a video, re-using the memory between the requests
+    mask = service.propagate('JPEGImages/frame_000005.jpg', 'Annotations/frame_000005.png', 'JPEGImages/frame_000006.jpg', session_id='video_1')
+    """
+
+    def __init__(self, overwrite_config: dict = None, max_sessions=4) -> None:
+        config = VIDEO_INFERENCE_CONFIG.copy()
+        config.update({} if overwrite_config is None else overwrite_config)
+
+        self.config = config
+        self.device = 'cuda' if torch.cuda.is_available() else 'cpu'
+        self.size = config['size']
+        self.im_transform = get_im_transform(self.size)
+
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict()
+
+        with torch.no_grad():
+            self.network = _load_network(config)
+            # only a couple of frames per request, no need to count usage for LT
+            self.processor = InferenceCore(self.network, config={**config, 'enable_long_term_count_usage': False})
+
+    def propagate(self, prev_frame_path: Union[str, PathLike], prev_mask_path: Union[str, PathLike], frame_path: Union[str, PathLike],
+                  session_id: Optional[str] = None) -> Image.Image:
+        """
+        Predict the mask for `frame_path`, using the annotated previous frame as the reference.
+        Same as running `run_on_video` on a 2-frame video with `original_memory_mechanism=True`.
+
+        If `session_id` is given and the previous request of that session propagated `prev_frame_path`,
+        the mask in `prev_mask_path` is added to the session's memory instead, and only `frame_path` is encoded.
+        Otherwise the session starts over from `prev_frame_path`.
+
+        Returns:
+        mask (Image.Image): RGB mask for `frame_path`, in the same colors as `prev_mask_path`.
+        """
+        with torch.no_grad():
+            if session_id is None:
+                return self._propagate_stateless(prev_frame_path, prev_mask_path, frame_path)
+
+            session = self._get_session(session_id)
+            if session.can_continue_from(prev_frame_path):
+                msk, _ = self._load_mask(Image.open(prev_mask_path).convert('P'), session.mapper, session.processor)
+                session.processor.commit_mask(msk)
+            else:
+                session.start(Image.open(prev_mask_path).convert('P'))
+                self._start_from_reference(session.processor, session.mapper, prev_frame_path, session.reference_mask)
+
+            rgb, shape = self._load_frame(frame_path)
+            # the predicted mask is not added to the memory, the accepted one is committed with the next request
+            prob = session.processor.step(rgb, manually_curated_masks=True)
+            session.last_frame_path = path.abspath(frame_path)
+
+            return self._to_mask_image(prob, shape, session.mapper, session.reference_mask)
+
+    def reset_session(self, session_id: str):
+        self.sessions.pop(session_id, None)
+
+    def _propagate_stateless(self, prev_frame_path, prev_mask_path, frame_path):
+        reference_mask = Image.open(prev_mask_path).convert('P')
+        mapper = MaskMapper()
+        self.processor.clear_memory()
+        self._start_from_reference(self.processor, mapper, prev_frame_path, reference_mask)
+
+        rgb, shape = self._load_frame(frame_path)
+        prob = self.processor.step(rgb, end=True)
+
+        return self._to_mask_image(prob, shape, mapper, reference_mask)
+
+    def _start_from_reference(self, processor: InferenceCore, mapper: MaskMapper, frame_path, mask_pil: Image.Image):
+        prev_rgb, _ = self._load_frame(frame_path)
+        msk, labels = self._load_mask(mask_pil, mapper, processor)
+
+        # the reference frame goes into the permanent memory and is not added again afterwards
+        processor.put_to_permanent_memory(prev_rgb, msk)
+        processor.step(prev_rgb, msk, labels, do_not_add_mask_to_memory=True)
+
+    def _get_session(self, session_id: str) -> PropagationSession:
+        if session_id in self.sessions:
+            self.sessions.move_to_end(session_id)
+        else:
+            if len(self.sessions) >= self.max_sessions:
+                self.sessions.popitem(last=False)  # drop the least recently used one
+            self.sessions[session_id] = PropagationSession(InferenceCore(self.network, config=self.config.copy(), warmup=False))
+
+        return self.sessions[session_id]
+
+    def _load_frame(self, frame_path):
+        img = Image.open(frame_path).convert('RGB')
+        shape = np.array(img).shape[:2]
+        rgb = self.im_transform(img).to(self.device)
+
+        return rgb, shape
+
+    def _load_mask(self, mask_pil: Image.Image, mapper: MaskMapper, processor: InferenceCore):
+        # https://github.com/hkchengrex/XMem/issues/21 just make exhaustive = True
+        msk, labels = mapper.convert_mask(np.array(mask_pil, dtype=np.uint8), exhaustive=True)
+        if min(msk.shape) == 0:
+            raise ValueError("The reference mask is empty, nothing to propagate!")
+
+        msk = msk.to(self.device)
+        if self.size >= 0:
+            msk = resize_mask(msk.unsqueeze(0), self.size)[0]
+        processor.set_all_labels(list(mapper.remappings.values()))
+
+        return msk, labels
+
+    def _to_mask_image(self, prob, shape, mapper: MaskMapper, reference_mask: Image.Image):
+        if self.size >= 0:
+            prob = F.interpolate(prob.unsqueeze(1), shape, mode='bilinear', align_corners=False)[:, 0]
+
+        # Probability mask -> index mask
+        out_mask = torch.argmax(prob, dim=0)
+        out_mask = (out_mask.detach().cpu().numpy()).astype(np.uint8)
+
+        # same as VideoReader.map_the_colors_back on the remapped mask
+        return colorize_index_mask(out_mask, palette_colors(reference_mask)[mapper.remapping_lut()])
@@ -1,3 +1,4 @@
+from contextlib import nullcontext
 from dataclasses import replace
 from functools import partial
 from multiprocessing import Process, Queue
@@ -21,7 +22,8 @@ from PIL import Image
 from inference.frame_selection.frame_selection import select_next_candidates
 from model.network import XMem
 from util.configuration import VIDEO_INFERENCE_CONFIG
-from util.image_saver import ParallelImageSaver, create_overlay, save_image
+from util.image_saver import ParallelImageSaver, create_overlay, palette_colors, save_image
+from util.mask_sinks import open_mask_sink
 from util.tensor_util import compute_array_iou
 from inference.inference_core import InferenceCore
 from inference.data.video_reader import Sample, VideoReader
@@ -38,7 +40,12 @@ def _inference_on_video(frames_with_masks, imgs_in_path, masks_in_path, masks_ou
                         save_overlay=True,
                         object_color_if_single_object=(255, 255, 255), 
                         print_fps=False,
-                        image_saving_max_queue_size=200):
+                        image_saving_max_queue_size=200,
+                        image_saving_num_workers=None,
+                        network: Optional[XMem] = None,
+                        progress_callback=None):
+    # network: an already loaded model to use instead of loading config['model'] (e.g. shared by several workers)
+    # progress_callback: called with (frames done, number of frames) after every frame
     device = 'cpu'
     
     torch.autograd.set_grad_enabled(False)
@@ -49,7 +56,7 @@ def _inference_on_video(frames_with_masks, imgs_in_path, masks_in_path, masks_ou
     overwrite_config['masks_out_path'] = masks_out_path
     config.update(overwrite_config)
 
-    mapper, processor, vid_reader, loader = _load_main_objects(imgs_in_path, masks_in_path, config)
+    mapper, processor, vid_reader, loader = _load_main_objects(imgs_in_path, masks_in_path, config, network=network)
     vid_name = vid_reader.vid_name
     vid_length = len(loader)
 
@@ -69,14 +76,19 @@ def _inference_on_video(frames_with_masks, imgs_in_path, masks_in_path, masks_ou
         raise ValueError("No valid masks provided!")
 
     stats = []
+    # palette color of every label of the reference mask, the masks are colored by the image saver
+    reference_colors = palette_colors(vid_reader.reference_mask)
+    # None for PNGs, saved by the image saver
+    mask_sink = open_mask_sink(config['mask_output_format'], config['masks_out_path'], reference_colors)
 
     total_processing_time = 0.0
-    with ParallelImageSaver(config['masks_out_path'], vid_name=vid_name, overlay_color_if_b_and_w=object_color_if_single_object, max_queue_size=image_saving_max_queue_size) as im_saver:
-        for ti, data in enumerate(tqdm(loader, disable=not print_progress)):
+    frames = _encode_keys_ahead(tqdm(loader, disable=not print_progress), processor, config['key_encoding_window'], device)
+    with ParallelImageSaver(config['masks_out_path'], vid_name=vid_name, overlay_color_if_b_and_w=object_color_if_single_object, max_queue_size=image_saving_max_queue_size, num_workers=image_saving_num_workers) as im_saver, \
+            (mask_sink if mask_sink is not None else nullcontext()):
+        for ti, (sample, encoded_key, encoding_time) in enumerate(frames):
             with torch.cuda.amp.autocast(enabled=True):
-                data: Sample = data  # Just for Intellisense
+                sample: Sample = sample  # Just for Intellisense
                 # No batch dimension here, just single samples
-                sample = replace(data, rgb=data.rgb.to(device))
                 
                 if ti in frames_with_masks:
                     msk = sample.mask
@@ -105,12 +117,13 @@ def _inference_on_video(frames_with_masks, imgs_in_path, masks_in_path, masks_ou
                 # 2+ channels, classes+ and background
                 a = perf_counter()
                 prob = processor.step(sample.rgb, msk, labels, end=(ti == vid_length-1),
-                                    manually_curated_masks=manually_curated_masks, do_not_add_mask_to_memory=do_not_add_mask_to_memory)
+                                    manually_curated_masks=manually_curated_masks, do_not_add_mask_to_memory=do_not_add_mask_to_memory,
+                                    encoded_key=encoded_key)
 
                 # Upsample to original size if needed
                 out_mask = _post_process(sample, prob)
                 b = perf_counter()
-                total_processing_time += (b - a)
+                total_processing_time += (b - a) + encoding_time
 
                 curr_stat = {'frame': sample.frame, 'mask_provided': msk is not None}
                 if compute_iou:
@@ -125,15 +138,20 @@ def _inference_on_video(frames_with_masks, imgs_in_path, masks_in_path, masks_ou
                 # Save the mask and the overlay (potentially)
 
                 if config['save_masks']:
-                    out_mask = mapper.remap_index_mask(out_mask)
-                    out_img = Image.fromarray(out_mask)
-                    out_img = vid_reader.map_the_colors_back(out_img)
+                    # index -> original label -> palette color, the same as `vid_reader.map_the_colors_back` on the remapped mask
+                    colors = reference_colors[mapper.remapping_lut()]
 
-                    im_saver.save_mask(mask=out_img, frame_name=sample.frame)
+                    if mask_sink is None:
+                        im_saver.save_mask(mask=out_mask, frame_name=sample.frame, colors=colors)
+                    else:
+                        mask_sink.write(sample.frame, mapper.remap_index_mask(out_mask))
 
                     if save_overlay:
                         original_img = sample.raw_image_pil
-                        im_saver.save_overlay(orig_img=original_img, mask=out_img, frame_name=sample.frame)
+                        im_saver.save_overlay(orig_img=original_img, mask=out_mask, frame_name=sample.frame, colors=colors)
+
+                if progress_callback is not None:
+                    progress_callback(ti + 1, vid_length)
         im_saver.wait_for_jobs_to_finish(verbose=True)
 
     if print_fps:
@@ -145,7 +163,42 @@ def _inference_on_video(frames_with_masks, imgs_in_path, masks_in_path, masks_ou
 
     return pd.DataFrame(stats)
 
-def _load_main_objects(imgs_in_path, masks_in_path, config):
+def _encode_keys_ahead(loader, processor: InferenceCore, window: int, device):
+    """
+    Yields `(sample, encoded_key, encoding_time)` for every frame of `loader`.
+
+    With `window` > 1, the keys and multi-scale features of the next `window` frames are encoded in one batched forward pass
+    (they do not depend on the memory), the memory readout and decoding still run frame by frame in `step`.
+    `encoding_time` is the share of the batch encoding time of the frame.
+    Otherwise `encoded_key` is None and `step` encodes the frame itself.
+    """
+    def encode(window_samples):
+        a = perf_counter()
+        with torch.cuda.amp.autocast(enabled=True):
+            if len({s.rgb.shape for s in window_samples}) == 1:
+                encoded = processor.encode_frames_batch([s.rgb for s in window_samples])
+            else:
+                encoded = [None] * len(window_samples)  # frames of different sizes, `step` encodes them one by one
+        encoding_time = (perf_counter() - a) / len(window_samples)
+        for s, e in zip(window_samples, encoded):
+            yield s, e, encoding_time
+
+    window_samples = []
+    for data in loader:
+        sample = replace(data, rgb=data.rgb.to(device))
+        if window <= 1:
+            yield sample, None, 0.0
+            continue
+
+        window_samples.append(sample)
+        if len(window_samples) == window:
+            yield from encode(window_samples)
+            window_samples = []
+
+    if window_samples:
+        yield from encode(window_samples)
+
+def _load_network(config):
     device = 'cuda' if torch.cuda.is_available() else 'cpu'
     model_path = config['model']
     network = XMem(config, model_path, pretrained_key_encoder=False, pretrained_value_encoder=False).to(device).eval()
@@ -155,6 +208,13 @@ def _load_main_objects(imgs_in_path, masks_in_path, config):
     else:
         warn('No model weights were loaded, as config["model"] was not specified.')
 
+    return network
+
+
+def _load_main_objects(imgs_in_path, masks_in_path, config, network=None):
+    if network is None:
+        network = _load_network(config)
+
     mapper = MaskMapper()
     processor = InferenceCore(network, config=config)
 
@@ -179,7 +239,9 @@ def _create_dataloaders(imgs_in_path: Union[str, PathLike], masks_in_path: Union
         imgs_in_path,  # f'/home/maksym/RESEARCH/VIDEOS/thanks_no_ears_5_annot/JPEGImages',
         masks_in_path,  # f'/home/maksym/RESEARCH/VIDEOS/thanks_no_ears_5_annot/Annotations_binarized_two_face',
         size=config['size'],
-        use_all_masks=True
+        use_all_masks=True,
+        frame_range=config.get('video_frame_range'),
+        read_ahead=config.get('video_read_ahead', 16)
     )
     
     # Just return the samples as they are; only using DataLoader for preloading frames from the disk
@@ -259,7 +321,7 @@ def run_on_video(
 
     masks_in_path (Union[str, PathLike]): Path to the directory containing video frames' masks in the same format, with corresponding names between video frames. Each unique object should have unique color.
 
-    masks_out_path (Union[str, PathLike]): Path to the output directory (will be created if doesn't exist) where the predicted masks will be stored in .png format.
+    masks_out_path (Union[str, PathLike]): Path to the output directory (will be created if doesn't exist) where the predicted masks will be stored in .png format (or run-length encoded in a single file, with `overwrite_config={'mask_output_format': 'coco_rle' or 'packed'}`, see `util.mask_sinks`).
 
     frames_with_masks (Iterable[int]): A list of integers representing the frames on which the masks should be applied (default: [0], only applied to the first frame). 0-based.
 
@@ -57,6 +57,7 @@ if __name__ == '__main__':
     parser.add_argument('--num_prototypes', help='P in paper', type=int, default=128) 
 
     parser.add_argument('--top_k', type=int, default=30)
+    parser.add_argument('--memory_readout_budget_mb', help='Peak memory of a memory read, decrease to save memory at high resolution', type=int, default=256)
     parser.add_argument('--mem_every', type=int, default=10)
     parser.add_argument('--deep_update_every', help='Leave -1 normally to synchronize with mem_every', type=int, default=-1)
     parser.add_argument('--no_amp', help='Turn off AMP', action='store_true')
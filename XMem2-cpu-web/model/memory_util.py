@@ -64,6 +64,33 @@ def do_softmax(similarity, top_k: Optional[int]=None, inplace=False, return_usag
 
     return affinity
 
+def topk_readout(similarity, mv_t, top_k: int, usage=None, usage_rows=None):
+    # memory readout with top-k softmax, equivalent to mv @ do_softmax(similarity, top_k)
+    # but the affinity is kept sparse (top_k non-zeros per query pixel), the dense (mostly zero) matrix is never built
+    # similarity: B x N x [HW/P]
+    # mv_t: N x CV         - Memory values, transposed (objects of the group flattened into CV)
+    # usage: B x N'        - (optional) the affinity of the memory elements summed over the query is added to it
+    # usage_rows: N        - (optional) index in usage of every memory element, if N' != N
+    # returns B x CV x [HW/P]
+    B, N, P = similarity.shape
+    values, indices = torch.topk(similarity, k=top_k, dim=1)
+
+    x_exp = values.exp_()
+    x_exp /= torch.sum(x_exp, dim=1, keepdim=True)  # B*k*HW
+
+    if usage is not None:
+        usage_indices = indices if usage_rows is None else usage_rows[indices]
+        usage.scatter_add_(1, usage_indices.flatten(start_dim=1), x_exp.flatten(start_dim=1))
+
+    # HW x N sparse affinity, one row per query pixel
+    pixels = torch.arange(P, device=similarity.device).repeat_interleave(top_k)
+    mem = []
+    for b in range(B):
+        affinity = torch.sparse_coo_tensor(torch.stack([pixels, indices[b].t().flatten()]), x_exp[b].t().flatten(), size=(P, N))
+        mem.append(torch.sparse.mm(affinity, mv_t).t())
+
+    return torch.stack(mem, 0)
+
 def get_affinity(mk, ms, qk, qe):
     # shorthand used in training with no top-k
     similarity = get_similarity(mk, ms, qk, qe)
@@ -1,20 +1,56 @@
 import argparse
+import json
 import re
 from pathlib import Path
 
 from inference.run_on_video import run_on_video
+from util.mask_sinks import MASK_OUTPUT_FORMATS
+
+
+def run_jobs(jobs_path, num_workers=None, threads_per_worker=None):
+    from inference.batch_scheduler import PropagationJob, PropagationScheduler
+
+    with open(jobs_path) as f:
+        jobs = [PropagationJob(**job) for job in json.load(f)]
+
+    def report(job_id, frames_done, num_frames):
+        if frames_done == num_frames or frames_done % 50 == 0:
+            print(f"[{jobs[job_id].video}] {frames_done}/{num_frames} frames")
+
+    with PropagationScheduler(num_workers=num_workers, threads_per_worker=threads_per_worker, progress_callback=report) as scheduler:
+        print(f"Running {len(jobs)} jobs in {scheduler.num_workers} workers with {scheduler.threads_per_worker} threads each")
+        for job in jobs:
+            scheduler.submit(job)
+        results = scheduler.wait()
+
+    failed = [job_id for job_id, result in results.items() if isinstance(result, Exception)]
+    for job_id in failed:
+        print(f"ERROR: job {jobs[job_id].video} failed: {results[job_id]}")
+    return not failed
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Process video frames given a few (1+) existing annotation masks')
-    parser.add_argument('--video', type=str, help='Path to the video file or directory with .jpg video frames to process', required=True)
+    parser.add_argument('--video', type=str, help='Path to the video file or directory with .jpg video frames to process')
     parser.add_argument('--masks', type=str, help='Path to the directory with individual .png masks  for corresponding video frames, named `frame_000000.png`, `frame_000123.png`, ... or similarly (the script searches for the first integer value in the filename). '
-                        'Will use all masks int the directory.', required=True)
+                        'Will use all masks int the directory.')
     parser.add_argument('--output', type=str, help='Path to the output directory where to save the resulting segmentation masks and overlays. '
-                        'Will be automatically created if does not exist', required=True)
+                        'Will be automatically created if does not exist')
+    parser.add_argument('--mask_format', type=str, default='png', choices=MASK_OUTPUT_FORMATS, help='How to save the masks: a .png per frame, '
+                        'or run-length encoded in a single file: COCO-style masks.json (coco_rle) or masks.rle (packed), see util/mask_sinks.py')
+    parser.add_argument('--jobs', type=str, help='Instead of --video/--masks/--output, process many videos at once: path to a JSON list of '
+                        '{"video": ..., "masks": ..., "output": ...} objects (optionally with "frames_with_masks" and "overwrite_config").')
+    parser.add_argument('--workers', type=int, default=None, help='With --jobs, number of videos processed at once')
+    parser.add_argument('--threads_per_worker', type=int, default=None, help='With --jobs, CPU cores used by every worker')
 
     args = parser.parse_args()
 
+    if args.jobs is not None:
+        exit(0 if run_jobs(args.jobs, args.workers, args.threads_per_worker) else 1)
+
+    if args.video is None or args.masks is None or args.output is None:
+        parser.error('--video, --masks and --output are required (unless --jobs is given)')
+
     frames_with_masks = []
     for file_path in (p for p in Path(args.masks).iterdir() if p.is_file()):
         frame_number_match = re.search(r'\d+', file_path.stem)
@@ -22,9 +58,9 @@ if __name__ == '__main__':
             print(f"ERROR: file {file_path} does not contain a frame number. Cannot load it as a mask.")
             exit(1)
         frames_with_masks.append(int(frame_number_match.group()))
-    
+
     print("Using masks for frames: ", frames_with_masks)
 
     p_out = Path(args.output)
     p_out.mkdir(parents=True, exist_ok=True)
-    run_on_video(args.video, args.masks, args.output, frames_with_masks)
+    run_on_video(args.video, args.masks, args.output, frames_with_masks, overwrite_config={'mask_output_format': args.mask_format})
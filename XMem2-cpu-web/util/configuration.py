@@ -147,6 +147,7 @@ VIDEO_INFERENCE_CONFIG = {
         'max_long_term_elements': 10000,
         'max_mid_term_frames': 10,
         'mem_every': 10,
+        'memory_readout_budget_mb': 256,  # peak memory of the temporary tensors of a memory read, None to read the whole frame at once
         'min_mid_term_frames': 5,
         'model': './saves/XMem.pth',
         'no_amp': False,
@@ -156,7 +157,11 @@ VIDEO_INFERENCE_CONFIG = {
         'size': 480,
         'top_k': 30,
         'value_dim': 512,
+        'video_frame_range': None,  # (start, end) frames to read when the input is a video file
+        'video_read_ahead': 16,  # frames decoded ahead when the input is a video file
+        'key_encoding_window': 1,  # encode the keys of this many upcoming frames in one batch (1 - frame by frame)
         'masks_out_path': None,
+        'mask_output_format': 'png',  # 'png' (an RGB image per frame), 'coco_rle' or 'packed', see util/mask_sinks.py
         'workspace': None,
         'save_masks': True
     }
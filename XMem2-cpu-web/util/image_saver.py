@@ -1,14 +1,13 @@
-from multiprocessing import Process, Queue, Value
 import os
 from pathlib import Path
-import queue
 from time import perf_counter
-import time
+from typing import Optional, Union
 import cv2
 import numpy as np
 from PIL import Image
 
 import torch
+import torch.multiprocessing as mp
 from dataset.range_transform import inv_im_trans
 from collections import defaultdict
 
@@ -178,6 +177,40 @@ def create_overlay(img: Image.Image, mask: Image.Image, mask_alpha=0.5, color_if
 
     return overlay
 
+def palette_colors(palette_img: Image.Image) -> np.ndarray:
+    # RGB color of every palette index (256*3), missing entries are black
+    # the same as `index_mask.quantize(palette=palette_img, dither=Image.Dither.NONE).convert('RGB')` for an 'L' index mask
+    colors = np.zeros((256, 3), dtype=np.uint8)
+    palette = np.array(palette_img.getpalette() or [], dtype=np.uint8).reshape(-1, 3)[:256]
+    colors[:len(palette)] = palette
+    return colors
+
+def colorize_index_mask(index_mask: np.ndarray, colors: np.ndarray) -> Image.Image:
+    # RGB image of an index mask (H*W uint8) with the `colors` lookup table (256*3, see `palette_colors`)
+    mask = Image.fromarray(index_mask, mode='P')
+    mask.putpalette(colors.ravel().tolist())
+    return mask.convert('RGB')
+
+def create_overlay_from_index_mask(img: Image.Image, index_mask: np.ndarray, colors: np.ndarray, mask_alpha=0.5, color_if_black_and_white=(255, 255, 255)):
+    # Same result as `create_overlay(img, colorize_index_mask(index_mask, colors), ...)`,
+    # but the colors, black-and-white check and alpha are worked out once for the 256 indices instead of for every pixel
+    index_img = Image.fromarray(index_mask, mode='L')
+    present_colors = np.unique(colors[np.flatnonzero(index_img.histogram())], axis=0)
+    is_b_and_w = len(present_colors) == 1 or (len(present_colors) == 2 and (present_colors == 255).all(axis=1).any())
+
+    if img.size != index_img.size:
+        index_img = index_img.resize(img.size, resample=Image.NEAREST)
+
+    if is_b_and_w:
+        colors = np.where(colors, np.array(color_if_black_and_white), colors).astype(np.uint8)
+
+    # 255 for black (to keep original image in full), `mask_alpha` for predicted pixels
+    alpha = np.full(256, 255, dtype=np.uint8)
+    alpha[cv2.cvtColor(colors[np.newaxis], cv2.COLOR_BGR2GRAY)[0] > 0] = int(mask_alpha * 255)
+
+    mask = colorize_index_mask(np.asarray(index_img), colors)
+    return Image.composite(img, mask, index_img.point(alpha.tolist()))
+
 def save_image(img: Image.Image, frame_name, video_name, general_dir_path, sub_dir_name='masks', extension='.png'):
     this_out_path = os.path.join(general_dir_path, video_name, sub_dir_name)
     os.makedirs(this_out_path, exist_ok=True)
@@ -191,6 +224,9 @@ class ParallelImageSaver:
     A class for parallel saving of masks and / or overlay images using multiple processes.
     Composing overlays and saving images on the drive is pretty slow, this class does it in the background.
 
+    Masks and overlays go to a single pool of worker processes, so the (slower) overlays are spread over all of them.
+    The images are handed over as shared memory tensors instead of being pickled through the queue.
+
     Parameters
     ----------
     general_output_path : str
@@ -200,16 +236,20 @@ class ParallelImageSaver:
     overlay_color_if_b_and_w : tuple, optional
         The RGB color to use for masks when there is only one object. Default is (255, 255, 255) (white).
     max_queue_size : int, optional
-        The maximum size of the mask and overlay queues. Default is 200.
+        The maximum number of images waiting to be saved, `save_mask`/`save_overlay` block when it is reached. Default is 200.
+    num_workers : int, optional
+        The number of worker processes. Default is a quarter of the CPU cores, at least 2.
 
     Methods
     -------
-    save_mask(mask, frame_name)
-        Start saving a mask in the background.
-    save_overlay(orig_img, mask, frame_name)
-        Create an overlay given an image and a mask, and start saving it in the background.
+    save_mask(mask, frame_name, colors=None)
+        Start saving a mask in the background. With `colors` (see `palette_colors`), `mask` is an index mask colored by the workers.
+    save_overlay(orig_img, mask, frame_name, colors=None)
+        Create an overlay given an image and a mask (or an index mask and its `colors`), and start saving it in the background.
     qsize() -> Tuple(int, int)
-        Get the current size of the mask and overlay queues (how many frames are still left to process).
+        Get the number of masks and overlays not saved yet (how many frames are still left to process).
+    stats() -> dict
+        Backpressure metrics: the number of images saved, the peak number of images waiting, how long the caller was blocked by a full queue.
     __enter__()
         Enter the context manager and return the instance itself.
     __exit__(exc_type, exc_value, exc_tb)
@@ -233,17 +273,23 @@ class ParallelImageSaver:
     # The images will be saved in separate processes in the background.
     """
 
-    def __init__(self, general_output_path: str, vid_name: str, overlay_color_if_b_and_w=(255, 255, 255), max_queue_size=200) -> None:
-        self._mask_queue = Queue(max_queue_size)
-        self._overlay_queue = Queue(max_queue_size)
+    def __init__(self, general_output_path: str, vid_name: str, overlay_color_if_b_and_w=(255, 255, 255), max_queue_size=200, num_workers=None) -> None:
+        if num_workers is None:
+            num_workers = max(2, (os.cpu_count() or 1) // 4)
+        self._num_workers = num_workers
 
-        self._mask_saver_worker = None
-        self._overlay_saver_worker = None
+        self._queue = mp.Queue(max_queue_size)
+        self._workers = []
 
         self._p_out = Path(general_output_path)
         self._vid_name = vid_name
         self._object_color = overlay_color_if_b_and_w
-        self._finished = Value('b', False)
+
+        # submitted by this process / saved by the workers, for masks and overlays
+        self._submitted = [0, 0]
+        self._saved = mp.Array('i', 2)
+        self._max_pending = 0
+        self._blocked_time = 0.0
 
     def __getstate__(self):
         # To solve issue in python 3.9.6 of multiprocessing.Process instances are unserializable
@@ -252,51 +298,83 @@ class ParallelImageSaver:
 
         # remove unpicklable/problematic variables
         # (multiprocessing.Process in this case)
-        state['_mask_saver_worker'] = None
-        state['_overlay_saver_worker'] = None
+        state['_workers'] = []
         return state
-    
-    def save_mask(self, mask: Image.Image, frame_name: str):
-        self._mask_queue.put((mask, frame_name, 'masks', '.png'))
 
-        if self._mask_saver_worker is None:
-            self._mask_saver_worker = Process(target=self._save_mask_fn)
-            self._mask_saver_worker.start()
+    @staticmethod
+    def _to_shared(img: Union[Image.Image, np.ndarray]):
+        # the pixels go through shared memory (torch.multiprocessing moves the tensor there), only the mode/palette are pickled
+        if isinstance(img, np.ndarray):
+            return torch.from_numpy(np.ascontiguousarray(img)), None, None
+        return torch.from_numpy(np.array(img)), img.mode, img.getpalette() if img.mode == 'P' else None
+
+    @staticmethod
+    def _from_shared(shared):
+        pixels, mode, palette = shared
+        img = Image.fromarray(pixels.numpy(), mode=mode)
+        if palette is not None:
+            img.putpalette(palette)
+        return img
+
+    def _submit(self, kind, task):
+        if not self._workers:
+            for _ in range(self._num_workers):
+                worker = mp.Process(target=self._save_fn, daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+        a = perf_counter()
+        self._queue.put((kind, task))
+        self._blocked_time += perf_counter() - a
+
+        self._submitted[kind] += 1
+        self._max_pending = max(self._max_pending, sum(self.qsize()))
+
+    def save_mask(self, mask: Union[Image.Image, np.ndarray], frame_name: str, colors: Optional[np.ndarray] = None):
+        self._submit(0, (self._to_shared(mask), colors, frame_name, 'masks', '.png'))
     
-    def save_overlay(self, orig_img: Image.Image, mask: Image.Image, frame_name: str):
-        self._overlay_queue.put((orig_img, mask, frame_name, 'overlay', '.jpg'))
-
-        if self._overlay_saver_worker is None:
-            self._overlay_saver_worker = Process(target=self._save_overlay_fn)
-            self._overlay_saver_worker.start()
+    def save_overlay(self, orig_img: Image.Image, mask: Union[Image.Image, np.ndarray], frame_name: str, colors: Optional[np.ndarray] = None):
+        self._submit(1, (self._to_shared(orig_img), self._to_shared(mask), colors, frame_name, 'overlay', '.jpg'))
 
-    def _save_mask_fn(self):
+    def _save_fn(self):
+        # masks and overlays alike, until the None sent by `wait_for_jobs_to_finish`
         while True:
-            try:
-                mask, frame_name, subdir, extension = self._mask_queue.get_nowait()
-            except queue.Empty:
-                if self._finished.value:
-                    return
-                else:
-                    time.sleep(1)
-                    continue
-            save_image(mask, frame_name, self._vid_name, self._p_out, subdir, extension)
+            item = self._queue.get()
+            if item is None:
+                return
 
-    def _save_overlay_fn(self):
-        while True:
+            kind, task = item
             try:
-                orig_image, mask, frame_name, subdir, extension = self._overlay_queue.get_nowait()
-            except queue.Empty:
-                if self._finished.value:
-                    return
+                if kind == 0:
+                    mask, colors, frame_name, subdir, extension = task
+                    if colors is None:
+                        mask_img = self._from_shared(mask)
+                    else:
+                        mask_img = colorize_index_mask(mask[0].numpy(), colors)
+                    save_image(mask_img, frame_name, self._vid_name, self._p_out, subdir, extension)
                 else:
-                    time.sleep(1)
-                    continue
-            overlaid_img = create_overlay(orig_image, mask, color_if_black_and_white=self._object_color)
-            save_image(overlaid_img, frame_name, self._vid_name, self._p_out, subdir, extension)
+                    orig_image, mask, colors, frame_name, subdir, extension = task
+                    if colors is None:
+                        overlaid_img = create_overlay(self._from_shared(orig_image), self._from_shared(mask), color_if_black_and_white=self._object_color)
+                    else:
+                        overlaid_img = create_overlay_from_index_mask(self._from_shared(orig_image), mask[0].numpy(), colors, color_if_black_and_white=self._object_color)
+                    save_image(overlaid_img, frame_name, self._vid_name, self._p_out, subdir, extension)
+            except Exception as e:
+                print(f"Error saving {task[-3]}: {e}")
+            finally:
+                with self._saved.get_lock():
+                    self._saved[kind] += 1
 
     def qsize(self):
-        return self._mask_queue.qsize(), self._overlay_queue.qsize()
+        return self._submitted[0] - self._saved[0], self._submitted[1] - self._saved[1]
+
+    def stats(self):
+        return {
+            'masks_saved': self._saved[0],
+            'overlays_saved': self._saved[1],
+            'max_pending': self._max_pending,
+            'blocked_time': self._blocked_time,
+        }
     
     def __enter__(self):
         # No need to initialize anything here
@@ -306,40 +384,36 @@ class ParallelImageSaver:
         if exc_type is not None:
             # Just kill everything for cleaner exit
             # Yeah, the child processed should be immediately killed if the main one exits, but just in case
-            if self._mask_saver_worker is not None:
-                self._mask_saver_worker.kill()
-            if self._mask_saver_worker is not None:
-                self._mask_saver_worker.kill()
+            for worker in self._workers:
+                worker.kill()
+            self._workers = []
 
             raise exc_value
         else:   
             self.wait_for_jobs_to_finish(verbose=False)
-            if self._mask_saver_worker is not None:
-                self._mask_saver_worker.close()
-            
-            if self._overlay_saver_worker is not None:
-                self._overlay_saver_worker.close()
     
     def wait_for_jobs_to_finish(self, verbose=False):
         # Optional, no need to call unless you want the verbose output
         # Will be called automatically by the __exit__ method
-        self._finished.value = True  # No need for a lock, as it's a single write with multiple reads
-        
-        if not verbose:
-            if self._mask_saver_worker is not None:
-                self._mask_saver_worker.join()
-            
-            if self._overlay_saver_worker is not None:
-                self._overlay_saver_worker.join()
-                
-        else:
+        if not self._workers:
+            return
+
+        for _ in self._workers:
+            self._queue.put(None)  # after all the images, every worker stops at one of them
+
+        for worker in self._workers:
             while True:
-                masks_left, overlays_left = self.qsize()
-                if max(masks_left, overlays_left) > 0:
-                    print(f"Finishing saving the results, {masks_left:>4d} masks and {overlays_left:>4d} overlays left.")
-                    time.sleep(1)
-                else:
+                worker.join(timeout=1 if verbose else None)
+                if not worker.is_alive():
                     break
-            
-            self.wait_for_jobs_to_finish(verbose=False)  # just to `.join()` them both
-            print("All saving jobs finished")
+                masks_left, overlays_left = self.qsize()
+                print(f"Finishing saving the results, {masks_left:>4d} masks and {overlays_left:>4d} overlays left.")
+
+        for worker in self._workers:
+            worker.close()
+        self._workers = []
+
+        if verbose:
+            stats = self.stats()
+            print(f"All saving jobs finished ({stats['max_pending']} images were waiting at most, "
+                  f"the queue was full for {stats['blocked_time']:.2f}s)")
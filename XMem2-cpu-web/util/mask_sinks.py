@@ -0,0 +1,314 @@
+"""
+Output formats of the propagated masks, other than one RGB PNG per frame.
+
+A long video gives one PNG per frame, and whatever consumes them (e.g. the polygon conversion of the annotation backend)
+decodes every one of them again. These sinks write run-length encoded masks instead:
+
+    'coco_rle' - `masks.json`, COCO-style annotations: one uncompressed RLE per object (original label) and frame.
+    'packed'   - `masks.rle`, a single append-only file of run-length encoded index masks,
+                 with the frame -> (offset, size) index in `masks.rle.index.json`.
+
+Both keep the original labels of the input masks and the RGB colors of their palette (`colors`, 256*3),
+so `colors[label_mask]` is the same image as the PNG that would have been saved. `open_masks` reads either of them back.
+
+Only numpy is needed here, so the readers can be used without torch.
+"""
+import json
+import os
+import struct
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+MASK_OUTPUT_FORMATS = ('png', 'coco_rle', 'packed')
+
+COCO_FILE_NAME = 'masks.json'
+PACKED_FILE_NAME = 'masks.rle'
+PACKED_INDEX_SUFFIX = '.index.json'
+
+_PACKED_MAGIC = b'XMEMRLE1'
+_RECORD_HEADER = struct.Struct('<HIII')  # frame name length, height, width, number of runs
+
+
+def rle_encode(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Runs of the values of `mask` in row-major order: (values as uint8, lengths as uint32)"""
+    flat = mask.ravel()
+    if flat.size == 0:
+        return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.uint32)
+
+    starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+    lengths = np.diff(np.append(starts, flat.size))
+    return flat[starts].astype(np.uint8), lengths.astype(np.uint32)
+
+
+def rle_decode(values: np.ndarray, lengths: np.ndarray, shape) -> np.ndarray:
+    return np.repeat(values.astype(np.uint8), lengths).reshape(shape)
+
+
+def binary_rle_counts(values: np.ndarray, lengths: np.ndarray, label: int) -> List[int]:
+    """
+    COCO uncompressed RLE `counts` of `label`, from the runs of a whole mask in column-major order (see `rle_encode`):
+    alternating lengths of the pixels without and with the label, starting with the ones without.
+    """
+    is_label = values == label
+    # a new COCO run starts wherever the label starts or stops
+    starts = np.concatenate(([0], np.flatnonzero(is_label[1:] != is_label[:-1]) + 1))
+    counts = np.add.reduceat(lengths.astype(np.int64), starts).tolist()
+    if is_label[0]:
+        counts.insert(0, 0)
+    return counts
+
+
+def binary_rle_decode(counts: List[int], shape) -> np.ndarray:
+    """Boolean mask of COCO uncompressed RLE `counts`"""
+    counts = np.asarray(counts, dtype=np.int64)
+    is_label = (np.arange(len(counts)) % 2).astype(bool)
+    return np.repeat(is_label, counts).reshape(shape[::-1]).T
+
+
+class CocoRleMaskSink:
+    """
+    Collects the masks of a video as COCO-style annotations, written to `path` (usually `masks.json`) by `close`.
+
+    Every frame is an image (`file_name` is the frame name), every original label in it an annotation
+    with `"iscrowd": 1` and an uncompressed RLE as the segmentation. The label is the category id, the categories
+    also have the `color` of the label in the reference palette.
+
+    Parameters
+    ----------
+    path : str
+        Path of the JSON file.
+    colors : np.ndarray
+        RGB color of every label (256*3), see `util.image_saver.palette_colors`.
+    """
+
+    def __init__(self, path: str, colors: np.ndarray):
+        self.path = path
+        self.colors = colors
+        self._images = []
+        self._annotations = []
+        self._labels = set()
+
+    def write(self, frame_name: str, label_mask: np.ndarray):
+        height, width = label_mask.shape
+        image_id = len(self._images) + 1
+        self._images.append({'id': image_id, 'file_name': frame_name, 'height': height, 'width': width})
+
+        # column-major, as COCO counts the pixels
+        values, lengths = rle_encode(label_mask.T)
+        for label in np.unique(values):
+            if label == 0:
+                continue
+            label = int(label)
+            counts = binary_rle_counts(values, lengths, label)
+
+            binary = label_mask == label
+            rows = np.flatnonzero(binary.any(axis=1))
+            cols = np.flatnonzero(binary.any(axis=0))
+            self._labels.add(label)
+            self._annotations.append({
+                'id': len(self._annotations) + 1,
+                'image_id': image_id,
+                'category_id': label,
+                'segmentation': {'size': [height, width], 'counts': counts},
+                'area': int(lengths[values == label].sum()),
+                'bbox': [int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)],
+                'iscrowd': 1,
+            })
+
+    def close(self):
+        if self._images is None:
+            return
+
+        data = {
+            'images': self._images,
+            'annotations': self._annotations,
+            'categories': [{'id': label, 'name': str(label), 'color': self.colors[label].tolist()} for label in sorted(self._labels)],
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'w') as f:
+            json.dump(data, f)
+        self._images = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+
+class PackedMaskSink:
+    """
+    Appends the run-length encoded label masks of a video to a single binary file.
+
+    The file starts with a magic string and the 256*3 palette colors, then every frame is a record:
+    frame name length, height, width, number of runs (little-endian uint16 + 3*uint32), the name (utf-8),
+    the run values (uint8) and the run lengths (uint32), row-major.
+    The frame -> [offset, size] index is written next to it by `close`; without it (an interrupted run),
+    `PackedMaskReader` finds the records by scanning the file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file, usually `masks.rle`. An existing file is overwritten.
+    colors : np.ndarray
+        RGB color of every label (256*3), see `util.image_saver.palette_colors`.
+    """
+
+    def __init__(self, path: str, colors: np.ndarray):
+        self.path = path
+        self.colors = colors
+        self._index: Dict[str, List[int]] = {}
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        if os.path.exists(path + PACKED_INDEX_SUFFIX):
+            os.remove(path + PACKED_INDEX_SUFFIX)  # of a previous run, would not match the new file
+        self._file = open(path, 'wb')
+        self._file.write(_PACKED_MAGIC)
+        self._file.write(np.ascontiguousarray(colors, dtype=np.uint8).tobytes())
+
+    def write(self, frame_name: str, label_mask: np.ndarray):
+        values, lengths = rle_encode(label_mask)
+        name = frame_name.encode('utf-8')
+        height, width = label_mask.shape
+
+        offset = self._file.tell()
+        self._file.write(_RECORD_HEADER.pack(len(name), height, width, len(values)))
+        self._file.write(name)
+        self._file.write(values.tobytes())
+        self._file.write(lengths.astype('<u4').tobytes())
+        self._index[frame_name] = [offset, self._file.tell() - offset]
+
+    def close(self):
+        if self._file is None:
+            return
+
+        self._file.close()
+        self._file = None
+        with open(self.path + PACKED_INDEX_SUFFIX, 'w') as f:
+            json.dump({'frames': self._index}, f)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        self.close()
+
+
+def open_mask_sink(mask_output_format: str, output_dir: str, colors: np.ndarray):
+    """Sink of `mask_output_format` in `output_dir`, or None for 'png' (saved by `ParallelImageSaver` instead)"""
+    if mask_output_format == 'png':
+        return None
+    if mask_output_format == 'coco_rle':
+        return CocoRleMaskSink(os.path.join(output_dir, COCO_FILE_NAME), colors)
+    if mask_output_format == 'packed':
+        return PackedMaskSink(os.path.join(output_dir, PACKED_FILE_NAME), colors)
+    raise ValueError(f"Unknown mask output format {mask_output_format}, expected one of {MASK_OUTPUT_FORMATS}")
+
+
+class CocoRleMaskReader:
+    """Label masks of a `CocoRleMaskSink` file, by frame name"""
+
+    def __init__(self, path: str):
+        with open(path) as f:
+            data = json.load(f)
+
+        self.colors = np.zeros((256, 3), dtype=np.uint8)
+        for category in data['categories']:
+            self.colors[category['id']] = category['color']
+
+        self._images = {image['file_name']: image for image in data['images']}
+        self._annotations = {image['id']: [] for image in data['images']}
+        for annotation in data['annotations']:
+            self._annotations[annotation['image_id']].append(annotation)
+        self.frames = list(self._images)
+
+    def read(self, frame_name: str) -> np.ndarray:
+        image = self._images[frame_name]
+        shape = (image['height'], image['width'])
+
+        label_mask = np.zeros(shape, dtype=np.uint8)
+        for annotation in self._annotations[image['id']]:
+            label_mask[binary_rle_decode(annotation['segmentation']['counts'], shape)] = annotation['category_id']
+        return label_mask
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self) -> Iterator[Tuple[str, np.ndarray]]:
+        for frame_name in self.frames:
+            yield frame_name, self.read(frame_name)
+
+
+class PackedMaskReader:
+    """Label masks of a `PackedMaskSink` file, by frame name"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(_PACKED_MAGIC)) != _PACKED_MAGIC:
+                raise ValueError(f"{path} is not a packed mask file")
+            self.colors = np.frombuffer(f.read(256 * 3), dtype=np.uint8).reshape(256, 3)
+
+        index_path = path + PACKED_INDEX_SUFFIX
+        if os.path.exists(index_path):
+            with open(index_path) as f:
+                self._index = json.load(f)['frames']
+        else:
+            self._index = self._scan()
+        self.frames = list(self._index)
+
+    def _scan(self):
+        index = {}
+        with open(self.path, 'rb') as f:
+            offset = len(_PACKED_MAGIC) + 256 * 3
+            f.seek(offset)
+            while True:
+                header = f.read(_RECORD_HEADER.size)
+                if len(header) < _RECORD_HEADER.size:
+                    break
+                name_length, _, _, num_runs = _RECORD_HEADER.unpack(header)
+                name = f.read(name_length).decode('utf-8')
+                size = _RECORD_HEADER.size + name_length + num_runs * 5
+                if offset + size > os.path.getsize(self.path):
+                    break  # the last record was not written completely
+                index[name] = [offset, size]
+                offset += size
+                f.seek(offset)
+        return index
+
+    def read(self, frame_name: str) -> np.ndarray:
+        offset, size = self._index[frame_name]
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            record = f.read(size)
+
+        name_length, height, width, num_runs = _RECORD_HEADER.unpack_from(record)
+        start = _RECORD_HEADER.size + name_length
+        values = np.frombuffer(record, dtype=np.uint8, count=num_runs, offset=start)
+        lengths = np.frombuffer(record, dtype='<u4', count=num_runs, offset=start + num_runs)
+        return rle_decode(values, lengths, (height, width))
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __iter__(self) -> Iterator[Tuple[str, np.ndarray]]:
+        for frame_name in self.frames:
+            yield frame_name, self.read(frame_name)
+
+
+def open_masks(path: str):
+    """
+    Reader of the masks saved by a sink: `path` is the JSON/packed file itself, or the output directory of `run_on_video`.
+    Both readers have `frames`, `colors` (RGB color of every label), `read(frame_name)` -> label mask
+    and iterate over (frame name, label mask).
+    """
+    if os.path.isdir(path):
+        for file_name in (PACKED_FILE_NAME, COCO_FILE_NAME):
+            if os.path.exists(os.path.join(path, file_name)):
+                return open_masks(os.path.join(path, file_name))
+        raise FileNotFoundError(f"No {PACKED_FILE_NAME} or {COCO_FILE_NAME} in {path}")
+
+    with open(path, 'rb') as f:
+        is_packed = f.read(len(_PACKED_MAGIC)) == _PACKED_MAGIC
+    return PackedMaskReader(path) if is_packed else CocoRleMaskReader(path)
@@ -1,6 +1,43 @@
 const { spawn } = require('child_process');
+const http = require('http');
 const path = require('path');
 
+// Persistent XMem service (scripts/xmem_daemon.py), used instead of spawning the script when running
+const XMEM_DAEMON_URL = process.env.XMEM_DAEMON_URL || 'http://127.0.0.1:5001';
+
+// Resolves with the daemon's JSON result, or with null if the daemon is not running
+function propagateWithDaemon(frameNumber) {
+  return new Promise((resolve, reject) => {
+    const body = JSON.stringify({ frameNumber: Number(frameNumber) });
+    const daemonReq = http.request(`${XMEM_DAEMON_URL}/propagate`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+        'Content-Length': Buffer.byteLength(body)
+      }
+    }, (daemonRes) => {
+      let data = '';
+      daemonRes.on('data', (chunk) => { data += chunk; });
+      daemonRes.on('end', () => {
+        try {
+          resolve(JSON.parse(data));
+        } catch (parseError) {
+          reject(parseError);
+        }
+      });
+    });
+
+    daemonReq.on('error', (error) => {
+      if (error.code === 'ECONNREFUSED') {
+        resolve(null);
+      } else {
+        reject(error);
+      }
+    });
+    daemonReq.end(body);
+  });
+}
+
 class ModelController {
   async runSingleFrame(req, res) {
     try {
@@ -11,6 +48,12 @@ class ModelController {
       }
       
       console.log(`Running model on frame: ${frameNumber}`);
+
+      const daemonResult = await propagateWithDaemon(frameNumber);
+      if (daemonResult !== null) {
+        return res.json(daemonResult);
+      }
+      console.log('XMem daemon is not running, falling back to a one-off Python process');
       
       // Path to the Python script
       const scriptPath = path.join(__dirname, '..', 'scripts', 'process_single_frame.py');
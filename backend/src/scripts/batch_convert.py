@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+
+"""
+Batch conversion between masks and JSON annotations over a pool of worker processes.
+
+    mask_to_json  - Annotations/*.png -> json/*.json   (see mask_to_json.py)
+    create_masks  - json/*.json -> Annotations/*.png   (see create_masks.py)
+
+Usage:
+    python3 batch_convert.py mask_to_json                              # the whole directory
+    python3 batch_convert.py create_masks --files frame_000001.json    # only the changed files
+    python3 batch_convert.py create_masks --watch                      # resident watcher
+
+In `--watch` mode the script stays alive, polls the input directory and converts every new or changed file,
+so that a burst of changes does not start a new interpreter per file.
+"""
+
+import os
+import sys
+import glob
+import time
+import argparse
+from multiprocessing import Pool
+
+import cv2
+
+from mask_to_json import mask_to_json
+from create_masks import create_mask_from_polygons
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+
+# mode -> (converter, default input directory, default output directory, input file pattern)
+MODES = {
+    'mask_to_json': (mask_to_json, os.path.join(script_dir, '../Annotations'), os.path.join(script_dir, '../json'), '*.png'),
+    'create_masks': (create_mask_from_polygons, os.path.join(script_dir, '../json'), os.path.join(script_dir, '../Annotations'), '*.json'),
+}
+
+def _init_worker():
+    # Each worker converts one file at a time, OpenCV threads would only compete with the other workers
+    cv2.setNumThreads(1)
+
+def _convert_one(job):
+    mode, input_path, output_dir, meta_path = job
+    converter = MODES[mode][0]
+    start = time.perf_counter()
+    try:
+        if mode == 'mask_to_json':
+            converter(input_path, output_dir, meta_path)
+        else:
+            converter(input_path, output_dir)
+        error = None
+    except Exception as e:
+        error = str(e)
+
+    return input_path, time.perf_counter() - start, error
+
+def make_pool(workers=None):
+    return Pool(processes=workers, initializer=_init_worker)
+
+def run_batch(mode, input_paths, output_dir, workers=None, meta_path=None, pool=None):
+    """
+    Convert `input_paths` in parallel and print the time spent on every file.
+    Uses `pool` if given (e.g. a resident one from `make_pool`), otherwise a new pool of `workers` processes.
+    Returns a list of (input_path, seconds, error or None), in the order of completion.
+    """
+    jobs = [(mode, path, output_dir, meta_path) for path in input_paths]
+    if not jobs:
+        return []
+
+    own_pool = pool is None
+    if own_pool:
+        pool = make_pool(workers)
+
+    results = []
+    start = time.perf_counter()
+    try:
+        for input_path, seconds, error in pool.imap_unordered(_convert_one, jobs):
+            results.append((input_path, seconds, error))
+            if error is None:
+                print(f"[{len(results)}/{len(jobs)}] {os.path.basename(input_path)}: {seconds:.3f}s")
+            else:
+                print(f"[{len(results)}/{len(jobs)}] Failed to process {input_path}: {error}")
+    finally:
+        if own_pool:
+            pool.close()
+            pool.join()
+
+    total = time.perf_counter() - start
+    failed = sum(error is not None for _, _, error in results)
+    print(f"Converted {len(results) - failed}/{len(jobs)} files in {total:.2f}s ({len(jobs) / max(total, 1e-9):.1f} files/s)")
+
+    return results
+
+def watch(mode, input_dir, output_dir, workers=None, meta_path=None, interval=0.5, settle=1.0):
+    """
+    Poll `input_dir` and convert every file that was added or modified.
+    A file is converted once it has not changed for `settle` seconds (i.e. its write has finished),
+    all files that settled at the same time are converted as one batch.
+    """
+    pattern = MODES[mode][3]
+    seen = {}     # path -> last seen modification time
+    pending = {}  # path -> when its last modification was noticed
+
+    print(f"Watching {input_dir} for {pattern} files")
+    with make_pool(workers) as pool:
+        while True:
+            now = time.monotonic()
+            current = set()
+            for path in glob.glob(os.path.join(input_dir, pattern)):
+                try:
+                    mtime = os.stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    continue  # deleted in the meantime
+                current.add(path)
+                if seen.get(path) != mtime:
+                    seen[path] = mtime
+                    pending[path] = now
+
+            for path in set(seen) - current:
+                del seen[path]
+                pending.pop(path, None)
+
+            ready = sorted(path for path, changed_at in pending.items() if now - changed_at >= settle)
+            if ready:
+                for path in ready:
+                    del pending[path]
+                run_batch(mode, ready, output_dir, meta_path=meta_path, pool=pool)
+                sys.stdout.flush()
+
+            time.sleep(interval)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert masks to JSON annotations (or back) in parallel')
+    parser.add_argument('mode', choices=list(MODES), help='Conversion to run')
+    parser.add_argument('--files', nargs='+', help='Specific files to process (names in the input directory or paths). Default: the whole directory')
+    parser.add_argument('--input-dir', help='Directory with the files to convert. Default: Annotations for mask_to_json, json for create_masks')
+    parser.add_argument('--output-dir', help='Directory to save the results to. Default: json for mask_to_json, Annotations for create_masks')
+    parser.add_argument('--meta', help='Path to meta JSON file (mask_to_json only)', default=None)
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes. Default: number of CPUs')
+    parser.add_argument('--watch', action='store_true', help='Keep running and convert files as they are added or modified')
+    args = parser.parse_args()
+
+    _, default_input_dir, default_output_dir, pattern = MODES[args.mode]
+    input_dir = os.path.abspath(args.input_dir or default_input_dir)
+    output_dir = os.path.abspath(args.output_dir or default_output_dir)
+
+    print(f"Input directory: {input_dir}")
+    print(f"Output directory: {output_dir}")
+
+    try:
+        if args.watch:
+            watch(args.mode, input_dir, output_dir, args.workers, args.meta)
+        else:
+            if args.files:
+                input_paths = [f if os.path.isabs(f) else os.path.join(input_dir, f) for f in args.files]
+                missing = [f for f in input_paths if not os.path.exists(f)]
+                if missing:
+                    raise FileNotFoundError(f"Files not found: {', '.join(missing)}")
+            else:
+                input_paths = sorted(glob.glob(os.path.join(input_dir, pattern)))
+
+            if not input_paths:
+                print("No files found to process")
+            else:
+                results = run_batch(args.mode, input_paths, output_dir, args.workers, args.meta)
+                if any(error is not None for _, _, error in results):
+                    exit(1)
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        exit(1)
@@ -78,6 +78,7 @@ if __name__ == "__main__":
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Create masks from JSON annotations')
     parser.add_argument('--file', help='Specific JSON file to process')
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for the whole directory. Default: number of CPUs')
     args = parser.parse_args()
 
     # Define directories using absolute paths
@@ -104,12 +105,8 @@ if __name__ == "__main__":
             if not json_files:
                 print("No JSON files found to process")
             else:
-                for json_file in sorted(json_files):
-                    try:
-                        print(f"\nProcessing {os.path.basename(json_file)}...")
-                        create_mask_from_polygons(json_file, output_dir)
-                    except Exception as e:
-                        print(f"Failed to process {json_file}: {str(e)}")
+                from batch_convert import run_batch
+                run_batch('create_masks', sorted(json_files), output_dir, args.workers)
     except Exception as e:
         print(f"Error: {str(e)}")
         exit(1) 
\ No newline at end of file
@@ -47,9 +47,26 @@
 
 #!/usr/bin/env python3
 
+"""
+Generate `predicted_masks/meta.json`: for every frame, the instances of the previous frame's JSON,
+so that mask_to_json can keep the instance ids when a predicted mask is converted back to JSON.
+
+The meta is updated incrementally: `predicted_masks/meta_index.json` records the modification time and size
+of every JSON it was built from, and only the entries of frames whose previous frame changed are rebuilt.
+For a single frame, `load_frame_meta` reads the previous frame's JSON directly, without touching meta.json.
+
+Usage:
+    python3 generate_meta_json.py          # update meta.json for the changed frames
+    python3 generate_meta_json.py --full   # rebuild meta.json from all the JSON files
+"""
+
 import os
 import json
 import re
+import argparse
+
+META_FILE = 'meta.json'
+INDEX_FILE = 'meta_index.json'
 
 def compute_bbox(coords):
     """Compute bounding box from polygon coordinates"""
@@ -62,71 +79,143 @@ def extract_frame_number(filename):
     match = re.search(r'frame_(\d+)', filename)
     return int(match.group(1)) if match else -1
 
-def main():
-    base_dir = os.path.dirname(__file__)
-    json_dir = os.path.join(base_dir, '../json')
-    meta_dir = os.path.join(base_dir, '../predicted_masks')
-    
+def meta_key_for(fname):
+    """
+    Key of the meta entry built from `fname`.
+    Each frame's JSON provides the metadata for the NEXT frame, so the next frame can use it for tracking.
+    """
+    return f'frame_{extract_frame_number(fname) + 1:06d}'
+
+def read_meta_entries(json_path, verbose=True):
+    """Instances of one JSON annotation file, in the meta format"""
+    with open(json_path, 'r') as f:
+        data = json.load(f)
+
+    entries = []
+    # Process each class and instance
+    for cls in data.get('classes', []):
+        class_name = cls.get('className', 'unknown')
+
+        for inst in cls.get('instances', []):
+            coords = inst.get('coordinates', [])
+            bbox = compute_bbox(coords) if coords else None
+
+            if bbox:  # Only add if we have valid bbox
+                entries.append({
+                    'instanceId': inst.get('instanceId', ''),
+                    'name': inst.get('name', 'Object'),
+                    'className': class_name,  # Add class name to metadata
+                    'bbox': bbox,
+                    'coordinates': coords  # Keep original coordinates for reference
+                })
+                if verbose:
+                    print(f"  Added meta for {class_name}:{inst.get('instanceId', 'unknown')}")
+
+    return entries
+
+def load_frame_meta(json_dir, frame_key):
+    """
+    Meta instances for a single frame (e.g. 'frame_000005'), read from the previous frame's JSON.
+    Same as `load_meta(meta.json)[frame_key]`, without reading or writing the whole meta.json.
+    """
+    frame_num = extract_frame_number(frame_key)
+    prev_json = os.path.join(json_dir, f'frame_{frame_num - 1:06d}.json')
+    if frame_num < 1 or not os.path.exists(prev_json):
+        return []
+
+    try:
+        return read_meta_entries(prev_json, verbose=False)
+    except Exception as e:
+        print(f"Error processing {prev_json}: {e}")
+        return []
+
+def _load_json(path, default):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def update_meta(json_dir, meta_dir, full=False):
+    """
+    Bring `meta_dir/meta.json` up to date with the JSON files in `json_dir`,
+    re-reading only the files that were added or modified since the last update.
+
+    Returns:
+    meta (dict): frame key -> list of meta instances
+    """
     os.makedirs(meta_dir, exist_ok=True)
-    
+    meta_path = os.path.join(meta_dir, META_FILE)
+    index_path = os.path.join(meta_dir, INDEX_FILE)
+
+    meta = {} if full else _load_json(meta_path, None)
+    index = {} if full else _load_json(index_path, None)
+    if meta is None or index is None:
+        # Nothing to start from (or it is unreadable), rebuild everything
+        meta, index = {}, {}
+
     # Get all JSON files except meta.json
-    files = [f for f in os.listdir(json_dir) if f.endswith('.json') and f != 'meta.json']
-    
-    if not files:
-        print("No JSON files found")
-        return
-    
+    files = [f for f in os.listdir(json_dir) if f.endswith('.json') and f != META_FILE]
+    current = {}
+    for fname in files:
+        try:
+            stat = os.stat(os.path.join(json_dir, fname))
+        except FileNotFoundError:
+            continue  # deleted in the meantime
+        current[fname] = [stat.st_mtime_ns, stat.st_size]
+
+    changed = False
+
+    # Drop the entries built from files that no longer exist
+    for fname in set(index) - set(current):
+        del index[fname]
+        meta.pop(meta_key_for(fname), None)
+        changed = True
+
     # Sort files by frame number
-    files_sorted = sorted(files, key=extract_frame_number)
-    
-    meta = {}
-    
-    for idx, fname in enumerate(files_sorted):
-        frame_num = extract_frame_number(fname)
-        
-        # For each frame, we need to create metadata for the NEXT frame
-        # So the next frame can use this frame's data for tracking
-        next_frame_num = frame_num + 1
-        next_frame_key = f'frame_{next_frame_num:06d}'
-        
-        print(f"Processing {fname} (frame {frame_num}) -> creating meta for frame {next_frame_num}")
-        
+    for fname in sorted(current, key=extract_frame_number):
+        if index.get(fname) == current[fname]:
+            continue
+
+        next_frame_key = meta_key_for(fname)
+        print(f"Processing {fname} (frame {extract_frame_number(fname)}) -> creating meta for {next_frame_key}")
+        changed = True
         try:
-            with open(os.path.join(json_dir, fname), 'r') as f:
-                data = json.load(f)
-            
-            meta[next_frame_key] = []
-            
-            # Process each class and instance
-            for cls in data.get('classes', []):
-                class_name = cls.get('className', 'unknown')
-                
-                for inst in cls.get('instances', []):
-                    coords = inst.get('coordinates', [])
-                    bbox = compute_bbox(coords) if coords else None
-                    
-                    if bbox:  # Only add if we have valid bbox
-                        meta_entry = {
-                            'instanceId': inst.get('instanceId', ''),
-                            'name': inst.get('name', 'Object'),
-                            'className': class_name,  # Add class name to metadata
-                            'bbox': bbox,
-                            'coordinates': coords  # Keep original coordinates for reference
-                        }
-                        meta[next_frame_key].append(meta_entry)
-                        print(f"  Added meta for {class_name}:{inst.get('instanceId', 'unknown')}")
-        
+            meta[next_frame_key] = read_meta_entries(os.path.join(json_dir, fname))
+            index[fname] = current[fname]
         except Exception as e:
+            # Not recorded in the index, so it is retried on the next update
             print(f"Error processing {fname}: {e}")
-            continue
-    
-    # Save metadata
-    out_path = os.path.join(meta_dir, 'meta.json')
-    with open(out_path, 'w') as f:
-        json.dump(meta, f, indent=2)
-    
-    print(f"\nMeta JSON saved to {out_path}")
+            meta.pop(next_frame_key, None)
+            index.pop(fname, None)
+
+    if changed or not os.path.exists(meta_path):
+        # Keys in frame order, same as a full rebuild
+        meta = dict(sorted(meta.items()))
+        with open(meta_path, 'w') as f:
+            json.dump(meta, f, indent=2)
+        with open(index_path, 'w') as f:
+            json.dump(index, f)
+
+    return meta
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate tracking metadata from the JSON annotations')
+    parser.add_argument('--full', action='store_true', help='Rebuild meta.json from all the JSON files')
+    args = parser.parse_args()
+
+    base_dir = os.path.dirname(__file__)
+    json_dir = os.path.join(base_dir, '../json')
+    meta_dir = os.path.join(base_dir, '../predicted_masks')
+
+    if not any(f.endswith('.json') and f != META_FILE for f in os.listdir(json_dir)):
+        print("No JSON files found")
+        return
+
+    meta = update_meta(json_dir, meta_dir, full=args.full)
+
+    print(f"\nMeta JSON saved to {os.path.join(meta_dir, META_FILE)}")
     print(f"Created metadata for {len(meta)} future frames")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
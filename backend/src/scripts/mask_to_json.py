@@ -2,12 +2,83 @@
 
 import json
 import os
+import sys
 import numpy as np
 import cv2
 from PIL import Image
 import glob
 import argparse
 
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:
+    # Without scipy, fall back to matching the highest scoring pairs first
+    linear_sum_assignment = None
+
+# Define colors for different classes (BGR format)
+CLASS_COLORS = {
+    (0, 0, 255): "1",    # Red
+    (255, 0, 0): "2",    # Blue
+    (0, 255, 0): "3",    # Green
+    (255, 255, 0): "4",  # Cyan
+    (255, 0, 255): "5",  # Magenta
+    (0, 255, 255): "6",  # Yellow
+    (128, 0, 128): "7",  # Purple
+    (255, 165, 0): "8",  # Orange
+}
+
+# Every BGR color packed into a single integer, the same way as the pixels in `mask_to_label_image`
+_PACKED_COLORS = cv2.cvtColor(np.array([list(CLASS_COLORS)], dtype=np.uint8), cv2.COLOR_BGR2BGRA).view(np.uint32)[0, :, 0]
+
+# Minimum combined score for a found instance to keep the identity of an instance from metadata
+MIN_MATCH_SCORE = 0.3
+
+# Extra margin around a label's bounding box, so that cropped morphology matches the full-image one
+_CROP_MARGIN = 2
+
+def mask_to_label_image(mask):
+    """
+    Map a BGR mask to a label image.
+    Pixels of the i-th color in CLASS_COLORS get label i+1, any other color (including black) gets 0.
+    Also returns the histogram of the labels, so that absent colors can be skipped.
+    """
+    # All 3 channels of a pixel packed into one uint32, so every color is matched with a single comparison
+    packed = cv2.cvtColor(mask, cv2.COLOR_BGR2BGRA).view(np.uint32)[..., 0]
+
+    label_image = np.zeros(packed.shape, dtype=np.uint8)
+    label_counts = np.zeros(len(CLASS_COLORS) + 1, dtype=np.int64)
+    matches = np.empty(packed.shape, dtype=bool)
+    for label, color in enumerate(_PACKED_COLORS, start=1):
+        np.equal(packed, color, out=matches)
+        label_counts[label] = np.count_nonzero(matches)
+        if label_counts[label] > 0:
+            np.copyto(label_image, label, where=matches)
+    label_counts[0] = packed.size - label_counts[1:].sum()
+
+    return label_image, label_counts
+
+def find_label_contours(label_image, label):
+    """
+    Find external contours of one label, with morphology and contour search cropped to its bounding box.
+    Same contours (in the same order) as running them over the full image.
+    """
+    binary = (label_image == label).astype(np.uint8)
+    rows = np.flatnonzero(binary.any(axis=1))
+    cols = np.flatnonzero(binary.any(axis=0))
+
+    height, width = binary.shape
+    y0, y1 = max(rows[0] - _CROP_MARGIN, 0), min(rows[-1] + _CROP_MARGIN + 1, height)
+    x0, x1 = max(cols[0] - _CROP_MARGIN, 0), min(cols[-1] + _CROP_MARGIN + 1, width)
+    crop = binary[y0:y1, x0:x1]
+
+    # Smoothing and denoising: apply morphological operations
+    kernel = np.ones((3, 3), np.uint8)
+    crop = cv2.morphologyEx(crop, cv2.MORPH_OPEN, kernel, iterations=1)
+    crop = cv2.morphologyEx(crop, cv2.MORPH_CLOSE, kernel, iterations=1)
+
+    contours, _ = cv2.findContours(crop, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE, offset=(int(x0), int(y0)))
+    return contours
+
 def compute_bbox(points):
     xs = [p[0] for p in points]
     ys = [p[1] for p in points]
@@ -54,43 +125,100 @@ def load_meta(meta_path):
         print(f"Error loading meta file: {e}")
         return {}
 
-def find_best_match(bbox, meta_instances, used_meta):
-    """Find the best matching instance from metadata"""
-    best_score = 0
-    best_meta = None
-    
-    for idx, meta_inst in enumerate(meta_instances):
-        if idx in used_meta:
-            continue
-            
-        meta_bbox = meta_inst.get('bbox')
-        if not meta_bbox:
+def _boxes_array(boxes):
+    return np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+
+def compute_iou_matrix(boxesA, boxesB):
+    """IoU of every box in `boxesA` with every box in `boxesB`, same as `compute_iou` for each pair"""
+    A, B = _boxes_array(boxesA)[:, None], _boxes_array(boxesB)[None]
+
+    inter_w = np.maximum(0, np.minimum(A[..., 2], B[..., 2]) - np.maximum(A[..., 0], B[..., 0]))
+    inter_h = np.maximum(0, np.minimum(A[..., 3], B[..., 3]) - np.maximum(A[..., 1], B[..., 1]))
+    interArea = inter_w * inter_h
+
+    boxAArea = (A[..., 2] - A[..., 0]) * (A[..., 3] - A[..., 1])
+    boxBArea = (B[..., 2] - B[..., 0]) * (B[..., 3] - B[..., 1])
+
+    return interArea / (boxAArea + boxBArea - interArea + 1e-6)
+
+def compute_center_distance_matrix(boxesA, boxesB):
+    """Normalized center distance of every pair of boxes, same as `compute_center_distance` for each pair"""
+    A, B = _boxes_array(boxesA)[:, None], _boxes_array(boxesB)[None]
+
+    dist = np.hypot((A[..., 0] + A[..., 2]) / 2 - (B[..., 0] + B[..., 2]) / 2,
+                    (A[..., 1] + A[..., 3]) / 2 - (B[..., 1] + B[..., 3]) / 2)
+    avg_size = ((A[..., 2] - A[..., 0]) + (A[..., 3] - A[..., 1]) + (B[..., 2] - B[..., 0]) + (B[..., 3] - B[..., 1])) / 4
+
+    return dist / (avg_size + 1e-6)
+
+def compute_match_scores(bboxes, meta_bboxes):
+    """Combined score of every (bbox, meta bbox) pair, IoU is primary, center distance is secondary"""
+    iou = compute_iou_matrix(bboxes, meta_bboxes)
+    # lower distance is better, so invert it; anything farther than 1 (incl. >= 2) scores 0
+    distance_score = np.clip(1 - compute_center_distance_matrix(bboxes, meta_bboxes), 0, None)
+
+    return 0.7 * iou + 0.3 * distance_score
+
+def _greedy_assignment(scores):
+    # Highest scoring pairs first, each row and column used at most once
+    rows, cols = [], []
+    used_rows, used_cols = set(), set()
+    for flat_idx in np.argsort(-scores, axis=None, kind='stable'):
+        row, col = np.unravel_index(flat_idx, scores.shape)
+        if scores[row, col] <= 0:
+            break
+        if row in used_rows or col in used_cols:
             continue
-        
-        # Calculate IoU
-        iou = compute_iou(bbox, meta_bbox)
-        
-        # Calculate center distance (lower is better, so invert it)
-        center_dist = compute_center_distance(bbox, meta_bbox)
-        distance_score = max(0, 1 - center_dist) if center_dist < 2 else 0
-        
-        # Combined score (IoU is primary, distance is secondary)
-        combined_score = 0.7 * iou + 0.3 * distance_score
-        
-        if combined_score > best_score:
-            best_score = combined_score
-            best_meta = (idx, meta_inst, combined_score)
-    
-    return best_meta
+        used_rows.add(row)
+        used_cols.add(col)
+        rows.append(row)
+        cols.append(col)
+
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+def match_instances(bboxes, meta_instances, min_score=MIN_MATCH_SCORE):
+    """
+    Match the found instances to the instances from metadata.
+    Only pairs with a combined score above `min_score` can be matched, and among those
+    the assignment with the highest total score is picked (so it does not depend on the order of the contours).
 
-def mask_to_json(mask_path, output_dir, meta_path=None):
+    Returns:
+    matches (list): for every bbox, either (meta index, meta instance, score) or None
+    """
+    matches = [None] * len(bboxes)
+
+    meta_indices = [idx for idx, meta_inst in enumerate(meta_instances) if meta_inst.get('bbox')]
+    if not bboxes or not meta_indices:
+        return matches
+
+    scores = compute_match_scores(bboxes, [meta_instances[idx]['bbox'] for idx in meta_indices])
+    # Pairs at or below the threshold would not be accepted anyway, they must not influence the assignment
+    gains = np.where(scores > min_score, scores, 0)
+
+    if linear_sum_assignment is not None:
+        rows, cols = linear_sum_assignment(gains, maximize=True)
+    else:
+        rows, cols = _greedy_assignment(gains)
+
+    for row, col in zip(rows, cols):
+        if gains[row, col] > 0:
+            idx = meta_indices[col]
+            matches[row] = (idx, meta_instances[idx], float(scores[row, col]))
+
+    return matches
+
+def mask_to_json(mask_path, output_dir, meta_path=None, meta_instances=None, mask=None):
     """
     Convert a mask image back to JSON format with polygon annotations.
     Each color in the mask will be converted to a separate class with polygon coordinates.
+    Instances are matched to `meta_instances` if given (e.g. from generate_meta_json.load_frame_meta),
+    otherwise to this frame's entry in the meta JSON file at `meta_path`.
+    If `mask` (BGR) is given, it is used instead of reading `mask_path`, which then only names the outputs.
     """
     try:
         # Read the mask file
-        mask = cv2.imread(mask_path)
+        if mask is None:
+            mask = cv2.imread(mask_path)
         if mask is None:
             raise ValueError(f"Could not read mask file: {mask_path}")
 
@@ -106,41 +234,28 @@ def mask_to_json(mask_path, output_dir, meta_path=None):
             'classes': []
         }
 
-        # Define colors for different classes (BGR format)
-        colors = {
-            (0, 0, 255): "1",    # Red
-            (255, 0, 0): "2",    # Blue
-            (0, 255, 0): "3",    # Green
-            (255, 255, 0): "4",  # Cyan
-            (255, 0, 255): "5",  # Magenta
-            (0, 255, 255): "6",  # Yellow
-            (128, 0, 128): "7",  # Purple
-            (255, 165, 0): "8",  # Orange
-        }
-
-        # Load meta JSON
-        meta = load_meta(meta_path) if meta_path else {}
         frame_key = os.path.splitext(mask_name)[0]  # e.g., frame_000001
-        meta_instances = meta.get(frame_key, [])
-        used_meta = set()
+        if meta_instances is None:
+            # Load meta JSON
+            meta = load_meta(meta_path) if meta_path else {}
+            meta_instances = meta.get(frame_key, [])
 
         print(f"Found {len(meta_instances)} meta instances for {frame_key}")
 
         # Group instances by class from metadata
         class_groups = {}
         
-        # Process each color/class
-        for color, default_class_name in colors.items():
-            # Create binary mask for this color
-            color_mask = cv2.inRange(mask, np.array(color), np.array(color))
+        # Map all colors to labels at once, and skip the colors absent from the mask
+        label_image, label_counts = mask_to_label_image(mask)
 
-            # Smoothing and denoising: apply morphological operations
-            kernel = np.ones((3, 3), np.uint8)
-            color_mask = cv2.morphologyEx(color_mask, cv2.MORPH_OPEN, kernel, iterations=1)
-            color_mask = cv2.morphologyEx(color_mask, cv2.MORPH_CLOSE, kernel, iterations=1)
+        # Collect the polygons of all colors/classes first, so that all of them are matched to meta at once
+        found_instances = []  # (coordinates, bbox, default class name)
+        for label, (color, default_class_name) in enumerate(CLASS_COLORS.items(), start=1):
+            if label_counts[label] == 0:
+                continue
 
             # Find contours for this color
-            contours, _ = cv2.findContours(color_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            contours = find_label_contours(label_image, label)
 
             if len(contours) > 0:
                 print(f"Found {len(contours)} contours for color {color}")
@@ -167,35 +282,37 @@ def mask_to_json(mask_path, output_dir, meta_path=None):
 
                     # Only add if we have enough points to form a polygon
                     if len(coordinates) >= 3:
-                        bbox = compute_bbox(coordinates)
-
-                        # Find best match in meta by combined score
-                        best_match = find_best_match(bbox, meta_instances, used_meta)
-
-                        if best_match and best_match[2] > 0.3:  # Minimum score threshold
-                            used_meta.add(best_match[0])
-                            meta_inst = best_match[1]
-                            instanceId = meta_inst.get('instanceId', f'Object-{len(used_meta)}')
-                            name = meta_inst.get('name', 'Object')
-                            class_name = meta_inst.get('className', default_class_name)
-                            print(f"  Matched instance {instanceId} with score {best_match[2]:.3f}")
-                        else:
-                            # No good match found, create new instance
-                            instanceId = f'Object-{len(used_meta)+1}'
-                            name = 'Object'
-                            class_name = default_class_name
-                            print(f"  Created new instance {instanceId} (no good match found)")
-
-                        # Group by class name
-                        if class_name not in class_groups:
-                            class_groups[class_name] = []
-
-                        instance = {
-                            'instanceId': instanceId,
-                            'name': name,
-                            'coordinates': coordinates
-                        }
-                        class_groups[class_name].append(instance)
+                        found_instances.append((coordinates, compute_bbox(coordinates), default_class_name))
+
+        # Find the best overall assignment to meta by combined score
+        matches = match_instances([bbox for _, bbox, _ in found_instances], meta_instances)
+
+        matched_count = 0
+        for (coordinates, bbox, default_class_name), match in zip(found_instances, matches):
+            if match:
+                matched_count += 1
+                meta_inst = match[1]
+                instanceId = meta_inst.get('instanceId', f'Object-{matched_count}')
+                name = meta_inst.get('name', 'Object')
+                class_name = meta_inst.get('className', default_class_name)
+                print(f"  Matched instance {instanceId} with score {match[2]:.3f}")
+            else:
+                # No good match found, create new instance
+                instanceId = f'Object-{matched_count+1}'
+                name = 'Object'
+                class_name = default_class_name
+                print(f"  Created new instance {instanceId} (no good match found)")
+
+            # Group by class name
+            if class_name not in class_groups:
+                class_groups[class_name] = []
+
+            instance = {
+                'instanceId': instanceId,
+                'name': name,
+                'coordinates': coordinates
+            }
+            class_groups[class_name].append(instance)
 
         # Convert class groups to final JSON structure
         for class_name, instances in class_groups.items():
@@ -223,11 +340,52 @@ def mask_to_json(mask_path, output_dir, meta_path=None):
         print(f"Error processing {mask_path}: {str(e)}")
         raise
 
+def open_masks_file(masks_path):
+    """
+    Reader of the run-length encoded masks written by XMem instead of PNGs (`masks.rle` or `masks.json`, see
+    XMem2-cpu-web/util/mask_sinks.py). Reading them only needs numpy.
+    """
+    xmem_root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '../../../XMem2-cpu-web'))
+    if xmem_root not in sys.path:
+        sys.path.append(xmem_root)
+    from util.mask_sinks import open_masks
+    return open_masks(masks_path)
+
+# Reader of a worker of `masks_file_to_json`, opened once by `_init_masks_file_worker`
+_worker_masks = None
+
+def _init_masks_file_worker(masks_path):
+    global _worker_masks
+    cv2.setNumThreads(1)
+    _worker_masks = open_masks_file(masks_path)
+
+def _masks_file_frame_to_json(job):
+    frame_name, output_dir, meta_path = job
+    # the colors of the labels are the ones of the PNG that would have been saved, in BGR as cv2.imread gives them
+    mask = np.ascontiguousarray(_worker_masks.colors[_worker_masks.read(frame_name)][..., ::-1])
+    mask_to_json(os.path.splitext(frame_name)[0] + '.png', output_dir, meta_path, mask=mask)
+    return frame_name
+
+def masks_file_to_json(masks_path, output_dir, meta_path=None, workers=None):
+    """
+    Convert every frame of a run-length encoded mask file of XMem to JSON, without decoding PNGs in between.
+    Same results as `mask_to_json` on the PNG masks of the same run.
+    """
+    from multiprocessing import Pool
+
+    frames = open_masks_file(masks_path).frames
+    jobs = [(frame_name, output_dir, meta_path) for frame_name in frames]
+    with Pool(processes=workers, initializer=_init_masks_file_worker, initargs=(masks_path,)) as pool:
+        for i, frame_name in enumerate(pool.imap_unordered(_masks_file_frame_to_json, jobs), start=1):
+            print(f"[{i}/{len(jobs)}] {frame_name}")
+
 if __name__ == "__main__":
     # Set up argument parser
     parser = argparse.ArgumentParser(description='Convert mask images back to JSON annotations')
     parser.add_argument('--file', help='Specific mask file to process')
     parser.add_argument('--meta', help='Path to meta JSON file', default=None)
+    parser.add_argument('--workers', type=int, default=None, help='Number of worker processes for the whole directory. Default: number of CPUs')
+    parser.add_argument('--masks-file', help='Convert all the frames of a masks.rle/masks.json file written by XMem instead of the PNG masks', default=None)
     args = parser.parse_args()
 
     # Define directories using relative paths
@@ -242,7 +400,10 @@ if __name__ == "__main__":
         print(f"Meta JSON path: {meta_path}")
 
     try:
-        if args.file:
+        if args.masks_file:
+            print(f"\nProcessing all the frames of {args.masks_file}")
+            masks_file_to_json(args.masks_file, json_dir, meta_path, args.workers)
+        elif args.file:
             # Process specific file
             mask_file = os.path.join(mask_dir, args.file)
             if not os.path.exists(mask_file):
@@ -257,12 +418,8 @@ if __name__ == "__main__":
             if not mask_files:
                 print("No mask files found to process")
             else:
-                for mask_file in sorted(mask_files):
-                    try:
-                        print(f"\nProcessing {os.path.basename(mask_file)}...")
-                        mask_to_json(mask_file, json_dir, meta_path)
-                    except Exception as e:
-                        print(f"Failed to process {mask_file}: {str(e)}")
+                from batch_convert import run_batch
+                run_batch('mask_to_json', sorted(mask_files), json_dir, args.workers, meta_path)
     except Exception as e:
         print(f"Error: {str(e)}")
         exit(1)
\ No newline at end of file
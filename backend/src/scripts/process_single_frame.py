@@ -5,7 +5,6 @@ import sys
 import json
 from pathlib import Path
 import argparse
-import subprocess
 
 # Add the XMem project root to Python path
 xmem_root = Path(__file__).resolve().parents[3] / 'XMem2-cpu-web'
@@ -16,6 +15,31 @@ if str(xmem_root) not in sys.path:
 from inference.run_on_video import run_on_video
 import torch
 
+BASE_DIR = Path(__file__).resolve().parent.parent
+
+
+def get_xmem_config():
+    """XMem configuration with the model paths resolved relative to the XMem project root"""
+    return {
+        'model': str(xmem_root / 'saves' / 'XMem.pth'),
+        's2m_model': str(xmem_root / 'saves' / 's2m.pth'),
+        'fbrs_model': str(xmem_root / 'saves' / 'fbrs.pth')
+    }
+
+
+def convert_mask_to_json(base_dir, mask_name):
+    """
+    Convert a newly predicted mask in `Annotations` to the JSON annotation format,
+    matching its instances against the previous frame's metadata.
+    """
+    from mask_to_json import mask_to_json
+    from generate_meta_json import load_frame_meta
+    # Only this frame's meta is needed, read it from the previous frame's JSON instead of regenerating meta.json
+    json_dir = str(base_dir / 'json')
+    meta_instances = load_frame_meta(json_dir, Path(mask_name).stem)
+    mask_to_json(str(base_dir / 'Annotations' / mask_name), json_dir, meta_instances=meta_instances)
+
+
 def process_single_frame(current_frame_number):
     """
     Process a single frame using the previous frame's mask as reference.
@@ -28,7 +52,7 @@ def process_single_frame(current_frame_number):
     
     try:
         # Define paths first
-        base_dir = Path(__file__).resolve().parent.parent 
+        base_dir = BASE_DIR
         frames_dir = base_dir / 'JPEGImages'
         masks_dir = base_dir / 'Annotations'
         output_dir = base_dir / 'predicted_masks'
@@ -59,11 +83,7 @@ def process_single_frame(current_frame_number):
         print(f"Starting to process frame {current_frame_number}", file=sys.stderr)
         
         # Set up XMem configuration with correct model path
-        config = {
-            'model': str(xmem_root / 'saves' / 'XMem.pth'),
-            's2m_model': str(xmem_root / 'saves' / 's2m.pth'),
-            'fbrs_model': str(xmem_root / 'saves' / 'fbrs.pth')
-        }
+        config = get_xmem_config()
 
         # Ensure the frame number is valid
         if current_frame_number < 1:
@@ -119,12 +139,7 @@ def process_single_frame(current_frame_number):
             )
 
             # Convert the new mask to JSON
-            from mask_to_json import mask_to_json
-            # Generate meta.json before mask_to_json
-            meta_script = str(base_dir / 'scripts' / 'generate_meta_json.py')
-            meta_json_path = str(base_dir / 'predicted_masks' / 'meta.json')
-            subprocess.run(['python3', meta_script], check=True)
-            mask_to_json(str(masks_dir / predicted_mask), str(base_dir / 'json'), meta_json_path)
+            convert_mask_to_json(base_dir, predicted_mask)
             result["success"] = True
             result["message"] = f"Successfully processed frame {current_frame_number}"
         else:
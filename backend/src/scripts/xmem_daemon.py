@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""
+Long-lived XMem propagation service.
+
+`process_single_frame.py` starts a new interpreter for every request, re-imports torch and reloads
+`XMem.pth` just to propagate one frame. This daemon loads the network once and answers
+"propagate frame N" requests over a local HTTP port instead.
+
+Usage:
+    python3 xmem_daemon.py [--host 127.0.0.1] [--port 5001]
+
+Consecutive requests (frame N, then N+1, ...) re-use the XMem memory of the video: the accepted mask
+of the previous frame is added to it, and only the new frame is encoded.
+
+Endpoints:
+    POST /propagate   {"frameNumber": N}  -> same JSON result as process_single_frame.py
+    POST /reset                           -> drop the kept memory, e.g. after earlier frames were re-annotated
+    GET  /health                          -> {"status": "ok"}
+"""
+
+import sys
+import argparse
+import threading
+from time import perf_counter
+
+from flask import Flask, request, jsonify
+
+from process_single_frame import BASE_DIR, get_xmem_config, convert_mask_to_json
+from inference.propagation_service import PropagationService
+
+app = Flask(__name__)
+
+# The network is not thread-safe, requests are served one at a time
+service_lock = threading.Lock()
+service = None
+
+
+def propagate_frame(current_frame_number):
+    """
+    Propagate the previous frame's mask to `current_frame_number` in-process
+    and convert the resulting mask to JSON.
+    """
+    result = {"success": False, "message": "", "error": None}
+
+    try:
+        frames_dir = BASE_DIR / 'JPEGImages'
+        masks_dir = BASE_DIR / 'Annotations'
+
+        # Ensure the frame number is valid
+        if current_frame_number < 1:
+            raise ValueError("Cannot process frame 0 - first frame must be manually annotated")
+
+        prev_frame_number = current_frame_number - 1
+        prev_frame_path = frames_dir / f"frame_{prev_frame_number:06d}.jpg"
+        prev_mask_path = masks_dir / f"frame_{prev_frame_number:06d}.png"
+        current_frame_path = frames_dir / f"frame_{current_frame_number:06d}.jpg"
+
+        if not prev_mask_path.exists():
+            raise FileNotFoundError(f"Previous frame's mask not found: {prev_mask_path}")
+        if not current_frame_path.exists():
+            raise FileNotFoundError(f"Current frame not found: {current_frame_path}")
+
+        a = perf_counter()
+        mask = service.propagate(prev_frame_path, prev_mask_path, current_frame_path, session_id=str(frames_dir))
+        b = perf_counter()
+
+        predicted_mask = f"frame_{current_frame_number:06d}.png"
+        mask.save(masks_dir / predicted_mask)
+        convert_mask_to_json(BASE_DIR, predicted_mask)
+        c = perf_counter()
+
+        print(f"Frame {current_frame_number}: propagation {b - a:.3f}s, mask to JSON {c - b:.3f}s", file=sys.stderr)
+        result["success"] = True
+        result["message"] = f"Successfully processed frame {current_frame_number}"
+
+    except Exception as e:
+        result["error"] = str(e)
+        result["message"] = f"Error processing frame {current_frame_number}: {str(e)}"
+
+    return result
+
+
+@app.route('/propagate', methods=['POST'])
+def propagate():
+    data = request.get_json(silent=True) or {}
+    frame_number = data.get('frameNumber')
+    if frame_number is None or not isinstance(frame_number, int):
+        return jsonify({'error': 'frameNumber is required and must be an integer'}), 400
+
+    with service_lock:
+        result = propagate_frame(frame_number)
+
+    # Same as the output of process_single_frame.py, failures are reported in the result itself
+    return jsonify(result)
+
+
+@app.route('/reset', methods=['POST'])
+def reset():
+    with service_lock:
+        service.reset_session(str(BASE_DIR / 'JPEGImages'))
+
+    return jsonify({'success': True})
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok'})
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Keep XMem loaded and propagate single frames on request')
+    parser.add_argument('--host', default='127.0.0.1', help='Interface to listen on (local only by default)')
+    parser.add_argument('--port', type=int, default=5001, help='Port to listen on')
+    args = parser.parse_args()
+
+    print("Loading XMem...", file=sys.stderr)
+    service = PropagationService(get_xmem_config())
+    print(f"XMem loaded, listening on http://{args.host}:{args.port}", file=sys.stderr)
+
+    app.run(host=args.host, port=args.port, threaded=True)
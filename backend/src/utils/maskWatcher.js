@@ -1,32 +1,27 @@
-const chokidar = require('chokidar');
 const { spawn } = require('child_process');
 const path = require('path');
-const fs = require('fs');
 
 class MaskWatcher {
     constructor() {
         this.jsonDir = path.join(__dirname, '../../src/json');
-        this.scriptPath = path.join(__dirname, '../scripts/create_masks.py');
-        this.watcher = null;
+        this.scriptPath = path.join(__dirname, '../scripts/batch_convert.py');
+        this.pythonProcess = null;
+        this.stopping = false;
+        this.restartDelay = 2000;
     }
 
-    createMaskForFile(jsonFile) {
-        // Get just the filename without path
-        const filename = path.basename(jsonFile);
-        
-        // Skip .gitkeep and other non-json files
-        if (!filename.endsWith('.json') || filename === '.gitkeep') {
-            return;
-        }
-
-        console.log(`\n🔄 Creating/Updating mask for: ${filename}`);
-
-        // Spawn Python process
+    // A single resident Python process watches the JSON directory and creates the masks for
+    // added/modified files in parallel (see batch_convert.py --watch), instead of starting a new
+    // interpreter for every file event.
+    spawnWatcher() {
         const pythonProcess = spawn('python3', [
+            '-u',  // unbuffered, so that the output shows up as the files are processed
             this.scriptPath,
-            '--file',
-            filename
-        ]);
+            'create_masks',
+            '--watch',
+            '--input-dir',
+            this.jsonDir
+        ], { cwd: path.dirname(this.scriptPath) });
 
         pythonProcess.stdout.on('data', (data) => {
             console.log(`📝 Mask creation output: ${data.toString().trim()}`);
@@ -37,61 +32,45 @@ class MaskWatcher {
         });
 
         pythonProcess.on('close', (code) => {
-            if (code === 0) {
-                console.log(`✅ Successfully created/updated mask for ${filename}`);
-            } else {
-                console.error(`❌ Failed to create mask for ${filename} (exit code: ${code})`);
+            this.pythonProcess = null;
+            if (this.stopping) {
+                return;
             }
+            console.error(`❌ Mask watcher exited (exit code: ${code}), restarting in ${this.restartDelay / 1000}s`);
+            setTimeout(() => {
+                if (!this.stopping && !this.pythonProcess) {
+                    this.spawnWatcher();
+                }
+            }, this.restartDelay);
         });
 
         pythonProcess.on('error', (error) => {
             console.error(`❌ Failed to start Python process: ${error}`);
         });
+
+        this.pythonProcess = pythonProcess;
     }
 
     start() {
-        if (this.watcher) {
+        if (this.pythonProcess) {
             console.log('Watcher is already running');
             return;
         }
 
         console.log(`👀 Starting mask watcher on ${this.jsonDir}`);
-
-        // Initialize watcher
-        this.watcher = chokidar.watch(this.jsonDir, {
-            ignored: /(^|[\/\\])\../, // Ignore dot files
-            persistent: true,
-            ignoreInitial: false, // Process existing files on startup
-            awaitWriteFinish: {     // Wait for writes to finish
-                stabilityThreshold: 1000,
-                pollInterval: 100
-            }
-        });
-
-        // Handle file add/change events
-        this.watcher
-            .on('add', (filePath) => {
-                console.log(`📁 JSON file added: ${path.basename(filePath)}`);
-                this.createMaskForFile(filePath);
-            })
-            .on('change', (filePath) => {
-                console.log(`📝 JSON file modified: ${path.basename(filePath)}`);
-                this.createMaskForFile(filePath);
-            })
-            .on('error', (error) => {
-                console.error(`❌ Watcher error: ${error}`);
-            });
-
+        this.stopping = false;
+        this.spawnWatcher();
         console.log('✅ Mask watcher started successfully');
     }
 
     stop() {
-        if (this.watcher) {
-            this.watcher.close();
-            this.watcher = null;
+        this.stopping = true;
+        if (this.pythonProcess) {
+            this.pythonProcess.kill('SIGINT');
+            this.pythonProcess = null;
             console.log('Mask watcher stopped');
         }
     }
 }
 
-module.exports = new MaskWatcher(); 
\ No newline at end of file
+module.exports = new MaskWatcher();
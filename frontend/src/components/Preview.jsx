@@ -14,6 +14,7 @@ import {
 import { reorderPoints, adjustPolygonPoints } from "./canvas/PolygonUtilities";
 import JsonStorageService from "../services/JsonStorageService";
 import blobMapper from "../utils/BlobMapper";
+import { ritmHeaders } from "../utils/ritmSession";
 
 const Preview = ({
   selectedFile,
@@ -93,7 +94,7 @@ const Preview = ({
       // // Extract just filename from path
       fetch("http://localhost:5000/load_image_by_name", {
         method: "POST",
-        headers: { "Content-Type": "application/json" },
+        headers: ritmHeaders({ "Content-Type": "application/json" }),
         body: JSON.stringify({ filename: fileName2 }),
       })
         .then((res) => res.json())
@@ -789,7 +790,7 @@ const Preview = ({
       try {
         const response = await fetch("http://localhost:5000/add_click", {
           method: "POST",
-          headers: { "Content-Type": "application/json" },
+          headers: ritmHeaders({ "Content-Type": "application/json" }),
           body: JSON.stringify({ x, y, is_positive: true }),
         });
         const data = await response.json();
@@ -2,6 +2,7 @@ import React, { useState, useEffect } from 'react';
 import JsonStorageService from '../../services/JsonStorageService';
 import ModelService from '../../services/ModelService';
 import blobMapper from '../../utils/BlobMapper';
+import { ritmHeaders } from '../../utils/ritmSession';
 
 const ActionButtons = ({ 
   joinPolygon, 
@@ -164,7 +165,7 @@ const ActionButtons = ({
   // --- RITM Backend Integration Handlers ---
   const handleFinishObject = async () => {
     try {
-      const response = await fetch('http://localhost:5000/finish_object', { method: 'POST' });
+      const response = await fetch('http://localhost:5000/finish_object', { method: 'POST', headers: ritmHeaders() });
       const data = await response.json();
       if (data.success) {
         if (onUpdateMask && data.image) {
@@ -180,7 +181,7 @@ const ActionButtons = ({
 
   const handleUndoClick = async () => {
     try {
-      const response = await fetch('http://localhost:5000/undo_click', { method: 'POST' });
+      const response = await fetch('http://localhost:5000/undo_click', { method: 'POST', headers: ritmHeaders() });
       const data = await response.json();
       if (data.success) {
         if (onUpdateMask && data.image) {
@@ -196,7 +197,7 @@ const ActionButtons = ({
 
   const handleResetClicks = async () => {
     try {
-      const response = await fetch('http://localhost:5000/reset_clicks', { method: 'POST' });
+      const response = await fetch('http://localhost:5000/reset_clicks', { method: 'POST', headers: ritmHeaders() });
       const data = await response.json();
       if (data.success) {
         if (onUpdateMask && data.image) {
@@ -214,7 +215,7 @@ const ActionButtons = ({
     if (isRitmMode) {
       // Switching from RITM to Manual, save the RITM JSON
       try {
-        await fetch('http://localhost:5000/save_ritm_json', { method: 'POST' });
+        await fetch('http://localhost:5000/save_ritm_json', { method: 'POST', headers: ritmHeaders() });
       } catch (err) {
         setErrorMessage('Failed to save RITM JSON');
       }
@@ -1,3 +1,5 @@
+import { ritmHeaders } from "../../utils/ritmSession";
+
 export async function sendRITMClick(x, y, isPositive = true) {
   console.log(`[RITM] Sending click:`, { x, y, isPositive });
   const payload = { x, y, is_positive: isPositive };
@@ -5,7 +7,7 @@ export async function sendRITMClick(x, y, isPositive = true) {
   try {
     const response = await fetch("/add_click", {
       method: "POST",
-      headers: { "Content-Type": "application/json" },
+      headers: ritmHeaders({ "Content-Type": "application/json" }),
       body: JSON.stringify(payload)
     });
     const data = await response.json();
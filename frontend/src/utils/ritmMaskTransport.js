@@ -0,0 +1,59 @@
+// Decoder for the binary mask responses of the RITM server (`?format=rle`, see
+// ritm_interactive_segmentation/web_demo/mask_transport.py for the layout). The server only sends the
+// dirty rectangle of the label mask, run-length encoded; the mask is kept and blended here instead.
+const HEADER_SIZE = 36;
+const FLAG_FULL = 1;
+
+// Applies a payload (ArrayBuffer) to the previous mask and returns { width, height, mask },
+// `mask` being a Uint16Array of labels (0 - background, i - object i), row by row.
+export function decodeMaskDelta(buffer, prev = null) {
+  const view = new DataView(buffer);
+  const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+  if (magic !== 'RMSK' || view.getUint8(4) !== 1) {
+    throw new Error('Not a mask payload');
+  }
+  const flags = view.getUint8(5);
+  const [width, height, x, y, w, h, numRuns] = [8, 12, 16, 20, 24, 28, 32].map((offset) =>
+    view.getUint32(offset, true)
+  );
+
+  const keepPrev = !(flags & FLAG_FULL) && prev && prev.width === width && prev.height === height;
+  const mask = keepPrev ? prev.mask.slice() : new Uint16Array(width * height);
+
+  const valuesOffset = HEADER_SIZE;
+  const lengthsOffset = HEADER_SIZE + 2 * numRuns;
+  let col = 0;
+  let row = 0;
+  for (let run = 0; run < numRuns; run++) {
+    const value = view.getUint16(valuesOffset + 2 * run, true);
+    let length = view.getUint32(lengthsOffset + 4 * run, true);
+    while (length > 0) {
+      const count = Math.min(length, w - col);
+      const start = (y + row) * width + x + col;
+      mask.fill(value, start, start + count);
+      length -= count;
+      col += count;
+      if (col === w) {
+        col = 0;
+        row++;
+      }
+    }
+  }
+
+  return { width, height, mask };
+}
+
+// Blends the label mask over the image pixels (ImageData of the same size) in place.
+// `colors` maps a label to [r, g, b], unlisted labels are left as they are.
+export function blendMask(imageData, { mask }, colors, alpha = 0.5) {
+  const pixels = imageData.data;
+  for (let i = 0; i < mask.length; i++) {
+    const color = mask[i] && colors[mask[i]];
+    if (!color) continue;
+    const p = 4 * i;
+    pixels[p] = pixels[p] * (1 - alpha) + color[0] * alpha;
+    pixels[p + 1] = pixels[p + 1] * (1 - alpha) + color[1] * alpha;
+    pixels[p + 2] = pixels[p + 2] * (1 - alpha) + color[2] * alpha;
+  }
+  return imageData;
+}
@@ -0,0 +1,16 @@
+// Identifies this browser tab to the RITM server, so that every tab gets its own
+// image, clicks and masks there. Kept in sessionStorage: it survives reloads, but not across tabs.
+const STORAGE_KEY = 'ritmSessionId';
+
+export function getRitmSessionId() {
+  let sessionId = window.sessionStorage.getItem(STORAGE_KEY);
+  if (!sessionId) {
+    sessionId = `${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`;
+    window.sessionStorage.setItem(STORAGE_KEY, sessionId);
+  }
+  return sessionId;
+}
+
+export function ritmHeaders(headers = {}) {
+  return { ...headers, 'X-Session-Id': getRitmSessionId() };
+}
@@ -3,7 +3,7 @@ from .berkeley import BerkeleyDataset
 from .coco import CocoDataset
 from .davis import DavisDataset
 from .grabcut import GrabCutDataset
-from .coco_lvis import CocoLvisDataset
+from .coco_lvis import CocoLvisDataset, PackedCocoLvisDataset
 from .lvis import LvisDataset
 from .openimages import OpenImagesDataset
 from .sbd import SBDDataset, SBDEvaluationDataset
@@ -8,6 +8,15 @@ from copy import deepcopy
 from isegm.data.base import ISDataset
 from isegm.data.sample import DSample
 
+PACKED_DATA_FILES = ('images.bin', 'masks.bin', 'annotations.bin')
+PACKED_INDEX_FILE = 'index.npy'
+PACKED_INDEX_DTYPE = np.dtype([
+    ('image_id', 'U32'),
+    ('height', np.int32), ('width', np.int32), ('num_layers', np.int32),
+    ('image_offset', np.int64), ('masks_offset', np.int64),
+    ('annotation_offset', np.int64), ('annotation_size', np.int64)
+])
+
 
 class CocoLvisDataset(ISDataset):
     def __init__(self, dataset_path, split='train', stuff_prob=0.0,
@@ -34,6 +43,12 @@ class CocoLvisDataset(ISDataset):
 
     def get_sample(self, index) -> DSample:
         image_id, sample = self.dataset_samples[index]
+        image, layers, objs_mapping = self.load_image_and_layers(image_id)
+        instances_info = get_instances_info(sample['hierarchy'], objs_mapping)
+
+        return self._make_sample(image, layers, instances_info, objs_mapping, sample['num_instance_masks'])
+
+    def load_image_and_layers(self, image_id):
         image_path = self._images_path / f'{image_id}.jpg'
 
         image = cv2.imread(str(image_path))
@@ -45,23 +60,88 @@ class CocoLvisDataset(ISDataset):
         layers = [cv2.imdecode(x, cv2.IMREAD_UNCHANGED) for x in encoded_layers]
         layers = np.stack(layers, axis=2)
 
-        instances_info = deepcopy(sample['hierarchy'])
-        for inst_id, inst_info in list(instances_info.items()):
-            if inst_info is None:
-                inst_info = {'children': [], 'parent': None, 'node_level': 0}
-                instances_info[inst_id] = inst_info
-            inst_info['mapping'] = objs_mapping[inst_id]
+        return image, layers, objs_mapping
 
+    def _make_sample(self, image, layers, instances_info, objs_mapping, num_instance_masks) -> DSample:
         if self.stuff_prob > 0 and random.random() < self.stuff_prob:
-            for inst_id in range(sample['num_instance_masks'], len(objs_mapping)):
+            for inst_id in range(num_instance_masks, len(objs_mapping)):
                 instances_info[inst_id] = {
                     'mapping': objs_mapping[inst_id],
                     'parent': None,
                     'children': []
                 }
         else:
-            for inst_id in range(sample['num_instance_masks'], len(objs_mapping)):
+            for inst_id in range(num_instance_masks, len(objs_mapping)):
                 layer_indx, mask_id = objs_mapping[inst_id]
                 layers[:, :, layer_indx][layers[:, :, layer_indx] == mask_id] = 0
 
         return DSample(image, layers, objects=instances_info)
+
+
+class PackedCocoLvisDataset(CocoLvisDataset):
+    """
+    CocoLvisDataset read from the files of `scripts/convert_annotations.py coco_lvis_packed` in `<split>/packed`:
+    the decoded images and mask layers of all the samples one after another in `images.bin` and `masks.bin`,
+    their pickled annotations in `annotations.bin`, and the offsets of every sample in `index.npy`.
+
+    The files are memory-mapped (in every DataLoader worker, all of them share the pages of the OS cache),
+    and there is no Python object per sample in the dataset, so nothing is copied to the workers on access.
+    """
+    def __init__(self, dataset_path, split='train', stuff_prob=0.0,
+                 allow_list_name=None, packed_dir='packed', **kwargs):
+        ISDataset.__init__(self, **kwargs)
+        dataset_path = Path(dataset_path)
+        self._split_path = dataset_path / split
+        self._packed_path = self._split_path / packed_dir
+        self.split = split
+        self.stuff_prob = stuff_prob
+
+        self._index = np.load(self._packed_path / PACKED_INDEX_FILE)
+        self.dataset_samples = np.arange(len(self._index))
+
+        if allow_list_name is not None:
+            allow_list_path = self._split_path / allow_list_name
+            with open(allow_list_path, 'r') as f:
+                allow_images_ids = json.load(f)
+
+            self.dataset_samples = np.flatnonzero(np.isin(self._index['image_id'], allow_images_ids))
+
+        self._packed_files = None
+
+    def get_sample(self, index) -> DSample:
+        images, masks, annotations = self._get_packed_files()
+        info = self._index[self.dataset_samples[index]]
+        height, width, num_layers = int(info['height']), int(info['width']), int(info['num_layers'])
+
+        image_size = height * width * 3
+        image = images[info['image_offset']:info['image_offset'] + image_size].reshape(height, width, 3)
+        layers_size = height * width * num_layers
+        layers = masks[info['masks_offset']:info['masks_offset'] + layers_size].reshape(height, width, num_layers)
+        instances_info, objs_mapping, num_instance_masks = \
+            pickle.loads(annotations[info['annotation_offset']:info['annotation_offset'] + info['annotation_size']])
+
+        # the maps are read-only, and the layers are changed in place
+        return self._make_sample(np.array(image), np.array(layers), instances_info, objs_mapping, num_instance_masks)
+
+    def _get_packed_files(self):
+        # opened on the first access in every process, not pickled with the dataset
+        if self._packed_files is None:
+            self._packed_files = tuple(np.memmap(self._packed_path / file_name, dtype=np.uint8, mode='r')
+                                       for file_name in PACKED_DATA_FILES)
+        return self._packed_files
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_packed_files'] = None
+        return state
+
+
+def get_instances_info(hierarchy, objs_mapping):
+    instances_info = deepcopy(hierarchy)
+    for inst_id, inst_info in list(instances_info.items()):
+        if inst_info is None:
+            inst_info = {'children': [], 'parent': None, 'node_level': 0}
+            instances_info[inst_id] = inst_info
+        inst_info['mapping'] = objs_mapping[inst_id]
+
+    return instances_info
@@ -12,7 +12,7 @@ from torch.utils.data import DataLoader
 
 from isegm.utils.log import logger, TqdmToLogger, SummaryWriterAvg
 from isegm.utils.vis import draw_probmap, draw_points
-from isegm.utils.misc import save_checkpoint
+from isegm.utils.misc import save_checkpoint, get_roi_distance_transform
 from isegm.utils.serialization import get_config_repr
 from isegm.utils.distributed import get_dp_wrapper, get_sampler, reduce_loss_dict
 from .optimizer import get_optimizer
@@ -370,38 +370,39 @@ class ISTrainer(object):
 
 def get_next_points(pred, gt, points, click_indx, pred_thresh=0.49):
     assert click_indx > 0
-    pred = pred.cpu().numpy()[:, 0, :, :]
-    gt = gt.cpu().numpy()[:, 0, :, :] > 0.5
+    # the error masks of the whole batch are computed on its device, only they are copied to the CPU
+    pred = pred[:, 0, :, :]
+    gt = gt[:, 0, :, :] > 0.5
 
-    fn_mask = np.logical_and(gt, pred < pred_thresh)
-    fp_mask = np.logical_and(np.logical_not(gt), pred > pred_thresh)
-
-    fn_mask = np.pad(fn_mask, ((0, 0), (1, 1), (1, 1)), 'constant').astype(np.uint8)
-    fp_mask = np.pad(fp_mask, ((0, 0), (1, 1), (1, 1)), 'constant').astype(np.uint8)
+    fn_mask = torch.logical_and(gt, pred < pred_thresh).cpu().numpy()
+    fp_mask = torch.logical_and(torch.logical_not(gt), pred > pred_thresh).cpu().numpy()
     num_points = points.size(1) // 2
     points = points.clone()
 
+    batch_indices, points_indices, new_points = [], [], []
     for bindx in range(fn_mask.shape[0]):
-        fn_mask_dt = cv2.distanceTransform(fn_mask[bindx], cv2.DIST_L2, 5)[1:-1, 1:-1]
-        fp_mask_dt = cv2.distanceTransform(fp_mask[bindx], cv2.DIST_L2, 5)[1:-1, 1:-1]
+        fn_roi_dt = get_roi_distance_transform(fn_mask[bindx], mask_size=5)
+        fp_roi_dt = get_roi_distance_transform(fp_mask[bindx], mask_size=5)
 
-        fn_max_dist = np.max(fn_mask_dt)
-        fp_max_dist = np.max(fp_mask_dt)
+        fn_max_dist = np.max(fn_roi_dt[0]) if fn_roi_dt is not None else 0
+        fp_max_dist = np.max(fp_roi_dt[0]) if fp_roi_dt is not None else 0
 
         is_positive = fn_max_dist > fp_max_dist
-        dt = fn_mask_dt if is_positive else fp_mask_dt
+        roi_dt = fn_roi_dt if is_positive else fp_roi_dt
+        if roi_dt is None:
+            continue
+
+        dt, (rmin, cmin) = roi_dt
         inner_mask = dt > max(fn_max_dist, fp_max_dist) / 2.0
         indices = np.argwhere(inner_mask)
         if len(indices) > 0:
             coords = indices[np.random.randint(0, len(indices))]
-            if is_positive:
-                points[bindx, num_points - click_indx, 0] = float(coords[0])
-                points[bindx, num_points - click_indx, 1] = float(coords[1])
-                points[bindx, num_points - click_indx, 2] = float(click_indx)
-            else:
-                points[bindx, 2 * num_points - click_indx, 0] = float(coords[0])
-                points[bindx, 2 * num_points - click_indx, 1] = float(coords[1])
-                points[bindx, 2 * num_points - click_indx, 2] = float(click_indx)
+            batch_indices.append(bindx)
+            points_indices.append(num_points - click_indx if is_positive else 2 * num_points - click_indx)
+            new_points.append([float(rmin + coords[0]), float(cmin + coords[1]), float(click_indx)])
+
+    if new_points:
+        points[batch_indices, points_indices] = torch.tensor(new_points, dtype=points.dtype, device=points.device)
 
     return points
 
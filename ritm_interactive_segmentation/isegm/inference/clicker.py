@@ -1,6 +1,7 @@
 import numpy as np
 from copy import deepcopy
-import cv2
+
+from isegm.utils.misc import get_roi_distance_transform
 
 
 class Clicker(object):
@@ -30,30 +31,34 @@ class Clicker(object):
         fn_mask = np.logical_and(np.logical_and(self.gt_mask, np.logical_not(pred_mask)), self.not_ignore_mask)
         fp_mask = np.logical_and(np.logical_and(np.logical_not(self.gt_mask), pred_mask), self.not_ignore_mask)
 
-        if padding:
-            fn_mask = np.pad(fn_mask, ((1, 1), (1, 1)), 'constant')
-            fp_mask = np.pad(fp_mask, ((1, 1), (1, 1)), 'constant')
+        fn_max_sq_dist, fn_coords = self._get_farthest_point(fn_mask, padding)
+        fp_max_sq_dist, fp_coords = self._get_farthest_point(fp_mask, padding)
 
-        fn_mask_dt = cv2.distanceTransform(fn_mask.astype(np.uint8), cv2.DIST_L2, 0)
-        fp_mask_dt = cv2.distanceTransform(fp_mask.astype(np.uint8), cv2.DIST_L2, 0)
+        is_positive = fn_max_sq_dist > fp_max_sq_dist
+        coords = fn_coords if is_positive else fp_coords  # coords is [y, x]
 
-        if padding:
-            fn_mask_dt = fn_mask_dt[1:-1, 1:-1]
-            fp_mask_dt = fp_mask_dt[1:-1, 1:-1]
+        return Click(is_positive=is_positive, coords=coords)
 
-        fn_mask_dt = fn_mask_dt * self.not_clicked_map
-        fp_mask_dt = fp_mask_dt * self.not_clicked_map
+    def _get_farthest_point(self, mask, padding):
+        # The first not clicked point of the mask farthest from its border, in the row-major order.
+        # Only the bounding box of the mask can have non-zero distances. They are square roots of integers,
+        # but their float rounding by OpenCV depends on the size of the box, so the points are compared
+        # by the (exact) squared distances: equally distant points are a tie wherever the box is.
+        roi_dt = get_roi_distance_transform(mask, padding=padding)
+        if roi_dt is None:
+            return 0, (0, 0)
 
-        fn_max_dist = np.max(fn_mask_dt)
-        fp_max_dist = np.max(fp_mask_dt)
+        mask_dt, (rmin, cmin) = roi_dt
+        not_clicked_map = self.not_clicked_map[rmin:rmin + mask_dt.shape[0], cmin:cmin + mask_dt.shape[1]]
+        mask_sq_dt = np.rint(np.square(mask_dt, dtype=np.float64)) * not_clicked_map
 
-        is_positive = fn_max_dist > fp_max_dist
-        if is_positive:
-            coords_y, coords_x = np.where(fn_mask_dt == fn_max_dist)  # coords is [y, x]
-        else:
-            coords_y, coords_x = np.where(fp_mask_dt == fp_max_dist)  # coords is [y, x]
+        max_indx = np.argmax(mask_sq_dt)
+        max_sq_dist = mask_sq_dt.flat[max_indx]
+        if max_sq_dist == 0:
+            return 0, (0, 0)
 
-        return Click(is_positive=is_positive, coords=(coords_y[0], coords_x[0]))
+        coords_y, coords_x = np.unravel_index(max_indx, mask_sq_dt.shape)
+        return max_sq_dist, (rmin + coords_y, cmin + coords_x)
 
     def add_click(self, click):
         coords = click.coords
@@ -1,10 +1,16 @@
+import os
+from copy import copy, deepcopy
+from concurrent.futures import ProcessPoolExecutor
 from time import time
 
 import numpy as np
 import torch
+import torch.multiprocessing as mp
+import torch.nn.functional as F
 
 from isegm.inference import utils
 from isegm.inference.clicker import Clicker
+from isegm.inference.predictors import BasePredictor
 
 try:
     get_ipython()
@@ -13,7 +19,21 @@ except NameError:
     from tqdm import tqdm
 
 
-def evaluate_dataset(dataset, predictor, **kwargs):
+def evaluate_dataset(dataset, predictor, num_workers=1, threads_per_worker=None, batch_size=1, **kwargs):
+    """
+    With num_workers > 1, the samples are evaluated in a pool of worker processes, each with its own copy of
+    the predictor (the model weights are shared) and `threads_per_worker` torch threads (default: the CPU cores
+    split between the workers). The dataset, the predictor and the keyword arguments (incl. `callback`)
+    must be picklable then. `all_ious` are in the order of the samples either way.
+
+    With batch_size > 1, `batch_size` samples are evaluated at once instead, see `evaluate_dataset_batched`.
+    """
+    assert num_workers == 1 or batch_size == 1, "Use either several workers or batches, not both."
+    if num_workers > 1:
+        return _evaluate_dataset_parallel(dataset, predictor, num_workers, threads_per_worker, **kwargs)
+    if batch_size > 1:
+        return evaluate_dataset_batched(dataset, predictor, batch_size, **kwargs)
+
     all_ious = []
 
     start_time = time()
@@ -29,6 +49,45 @@ def evaluate_dataset(dataset, predictor, **kwargs):
     return all_ious, elapsed_time
 
 
+# State of an evaluation worker process, set by `_init_worker`
+_worker_state = None
+
+
+def _init_worker(dataset, predictor, threads, kwargs):
+    global _worker_state
+    torch.set_num_threads(threads)
+    _worker_state = dataset, predictor, kwargs
+
+
+def _evaluate_sample_by_index(index):
+    dataset, predictor, kwargs = _worker_state
+    sample = dataset.get_sample(index)
+    _, sample_ious, _ = evaluate_sample(sample.image, sample.gt_mask, predictor,
+                                        sample_id=index, **kwargs)
+    return sample_ious
+
+
+def _evaluate_dataset_parallel(dataset, predictor, num_workers, threads_per_worker=None, **kwargs):
+    if threads_per_worker is None:
+        threads_per_worker = max(1, (os.cpu_count() or 1) // num_workers)
+
+    # the workers get the shared memory of the weights instead of their own copies
+    for net in [predictor.net] + list(predictor.click_models or []):
+        net.share_memory()
+
+    start_time = time()
+    context = mp.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=context, initializer=_init_worker,
+                             initargs=(dataset, predictor, threads_per_worker, kwargs)) as executor:
+        # one sample at a time, the number of clicks (and so the time) differs a lot between them
+        results = executor.map(_evaluate_sample_by_index, range(len(dataset)))
+        all_ious = list(tqdm(results, total=len(dataset), leave=False))
+    end_time = time()
+    elapsed_time = end_time - start_time
+
+    return all_ious, elapsed_time
+
+
 def evaluate_sample(image, gt_mask, predictor, max_iou_thr,
                     pred_thr=0.49, min_clicks=1, max_clicks=20,
                     sample_id=None, callback=None):
@@ -54,3 +113,114 @@ def evaluate_sample(image, gt_mask, predictor, max_iou_thr,
                 break
 
         return clicker.clicks_list, np.array(ious_list, dtype=np.float32), pred_probs
+
+
+class _BatchSample(object):
+    def __init__(self, index, sample, predictor):
+        self.index = index
+        self.image = sample.image
+        self.gt_mask = sample.gt_mask
+        self.clicker = Clicker(gt_mask=sample.gt_mask)
+        self.pred_mask = np.zeros_like(sample.gt_mask)
+        self.ious_list = []
+
+        # the same network, but its own input image, previous prediction and transform states
+        self.predictor = copy(predictor)
+        self.predictor.zoom_in, self.predictor.transforms = deepcopy((predictor.zoom_in, predictor.transforms))
+        self.predictor._image_features_cache = None
+        self.predictor._dist_maps_cache = None
+        self.predictor.set_input_image(sample.image)
+
+
+def evaluate_dataset_batched(dataset, predictor, batch_size, max_iou_thr,
+                             pred_thr=0.49, min_clicks=1, max_clicks=20, callback=None):
+    """
+    Runs the clickers of `batch_size` samples in lockstep: on every step, each of them makes its next click,
+    and the network gets the inputs of all of them (after the transforms of the predictor), zero-padded to
+    the same size, as one batch. A sample that reaches `max_iou_thr` (or `max_clicks`) is replaced
+    with the next one of the dataset.
+
+    Only for NoBRS predictors with a single model. The padding can change the predictions slightly,
+    unless the inputs already have the same size (e.g. the fixed<number> eval mode after the first click).
+    """
+    assert predictor.click_models is None and type(predictor)._get_prediction is BasePredictor._get_prediction, \
+        "Batched evaluation supports only NoBRS predictors with a single model."
+
+    all_ious = [None] * len(dataset)
+    next_index = 0
+    batch = []
+
+    start_time = time()
+    with torch.no_grad(), tqdm(total=len(dataset), leave=False) as progress_bar:
+        while True:
+            while len(batch) < batch_size and next_index < len(dataset):
+                batch.append(_BatchSample(next_index, dataset.get_sample(next_index), predictor))
+                next_index += 1
+            if not batch:
+                break
+
+            for sample in batch:
+                sample.clicker.make_next_click(sample.pred_mask)
+            batch_pred_probs = _get_batch_prediction(predictor.net, batch)
+
+            unfinished = []
+            for sample, pred_probs in zip(batch, batch_pred_probs):
+                click_indx = len(sample.ious_list)
+                sample.pred_mask = pred_probs > pred_thr
+
+                if callback is not None:
+                    callback(sample.image, sample.gt_mask, pred_probs, sample.index, click_indx,
+                             sample.clicker.clicks_list)
+
+                iou = utils.get_iou(sample.gt_mask, sample.pred_mask)
+                sample.ious_list.append(iou)
+
+                if (iou >= max_iou_thr and click_indx + 1 >= min_clicks) or click_indx + 1 >= max_clicks:
+                    all_ious[sample.index] = np.array(sample.ious_list, dtype=np.float32)
+                    progress_bar.update()
+                else:
+                    unfinished.append(sample)
+            batch = unfinished
+    end_time = time()
+    elapsed_time = end_time - start_time
+
+    return all_ious, elapsed_time
+
+
+def _get_batch_prediction(net, batch):
+    net_inputs = [sample.predictor.get_net_input(sample.clicker) for sample in batch]
+    height = max(image_nd.shape[2] for image_nd, _, _ in net_inputs)
+    width = max(image_nd.shape[3] for image_nd, _, _ in net_inputs)
+
+    batch_image_nd = torch.cat([F.pad(image_nd, (0, width - image_nd.shape[3], 0, height - image_nd.shape[2]))
+                                for image_nd, _, _ in net_inputs])
+    batch_clicks_lists = [clicks_list for _, clicks_lists, _ in net_inputs for clicks_list in clicks_lists]
+    points_nd = batch[0].predictor.get_points_nd(batch_clicks_lists)
+    batch_pred_logits = net(batch_image_nd, points_nd)['instances']
+    batch_pred_logits = F.interpolate(batch_pred_logits, mode='bilinear', align_corners=True, size=(height, width))
+
+    batch_pred_probs = [None] * len(batch)
+    recalculate = []
+    offset = 0
+    for i, (sample, (image_nd, _, _)) in enumerate(zip(batch, net_inputs)):
+        # the flip transform adds images to the batch
+        num_images, _, image_height, image_width = image_nd.shape
+        pred_logits = batch_pred_logits[offset:offset + num_images, :, :image_height, :image_width]
+        offset += num_images
+
+        prediction = sample.predictor.get_prob_map(pred_logits, image_nd)
+        zoom_in = sample.predictor.zoom_in
+        if zoom_in is not None and zoom_in.check_possible_recalculation():
+            recalculate.append(i)
+            continue
+
+        sample.predictor.prev_prediction = prediction
+        batch_pred_probs[i] = prediction.cpu().numpy()[0, 0]
+
+    # as in `BasePredictor.get_prediction`, with the zoom-in of the new prediction
+    if recalculate:
+        recalculated = _get_batch_prediction(net, [batch[i] for i in recalculate])
+        for i, pred_probs in zip(recalculate, recalculated):
+            batch_pred_probs[i] = pred_probs
+
+    return batch_pred_probs
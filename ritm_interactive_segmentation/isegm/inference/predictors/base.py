@@ -2,6 +2,7 @@ import torch
 import torch.nn.functional as F
 from torchvision import transforms
 from isegm.inference.transforms import AddHorizontalFlip, SigmoidForPred, LimitLongestSide
+from isegm.model.ops import DistMapsCache
 
 
 class BasePredictor(object):
@@ -10,6 +11,8 @@ class BasePredictor(object):
                  with_flip=False,
                  zoom_in=None,
                  max_size=None,
+                 cache_image_features=False,
+                 cache_dist_maps=False,
                  **kwargs):
         self.with_flip = with_flip
         self.net_clicks_limit = net_clicks_limit
@@ -20,6 +23,11 @@ class BasePredictor(object):
         self.model_indx = 0
         self.click_models = None
         self.net_state_dict = None
+        # Reuse the click-independent backbone features between the clicks on the same image
+        self.cache_image_features = cache_image_features
+        self._image_features_cache = None
+        # Update the click distance maps only for the new click (or go back to a snapshot on undo)
+        self._dist_maps_cache = DistMapsCache() if cache_dist_maps else None
 
         if isinstance(model, tuple):
             self.net, self.click_models = model
@@ -43,8 +51,22 @@ class BasePredictor(object):
         if len(self.original_image.shape) == 3:
             self.original_image = self.original_image.unsqueeze(0)
         self.prev_prediction = torch.zeros_like(self.original_image[:, :1, :, :])
+        self._image_features_cache = None
+        if self._dist_maps_cache is not None:
+            self._dist_maps_cache.reset()
 
     def get_prediction(self, clicker, prev_mask=None):
+        image_nd, clicks_lists, is_image_changed = self.get_net_input(clicker, prev_mask)
+        pred_logits = self._get_prediction(image_nd, clicks_lists, is_image_changed)
+        prediction = self.get_prob_map(pred_logits, image_nd)
+
+        if self.zoom_in is not None and self.zoom_in.check_possible_recalculation():
+            return self.get_prediction(clicker)
+
+        self.prev_prediction = prediction
+        return prediction.cpu().numpy()[0, 0]
+
+    def get_net_input(self, clicker, prev_mask=None):
         clicks_list = clicker.get_clicks()
 
         if self.click_models is not None:
@@ -58,26 +80,38 @@ class BasePredictor(object):
             prev_mask = self.prev_prediction
         if hasattr(self.net, 'with_prev_mask') and self.net.with_prev_mask:
             input_image = torch.cat((input_image, prev_mask), dim=1)
-        image_nd, clicks_lists, is_image_changed = self.apply_transforms(
-            input_image, [clicks_list]
-        )
+        return self.apply_transforms(input_image, [clicks_list])
 
-        pred_logits = self._get_prediction(image_nd, clicks_lists, is_image_changed)
+    def get_prob_map(self, pred_logits, image_nd):
         prediction = F.interpolate(pred_logits, mode='bilinear', align_corners=True,
                                    size=image_nd.size()[2:])
 
         for t in reversed(self.transforms):
             prediction = t.inv_transform(prediction)
-
-        if self.zoom_in is not None and self.zoom_in.check_possible_recalculation():
-            return self.get_prediction(clicker)
-
-        self.prev_prediction = prediction
-        return prediction.cpu().numpy()[0, 0]
+        return prediction
 
     def _get_prediction(self, image_nd, clicks_lists, is_image_changed):
         points_nd = self.get_points_nd(clicks_lists)
-        return self.net(image_nd, points_nd)['instances']
+        net_kwargs = {}
+        if self._dist_maps_cache is not None:
+            net_kwargs['dist_maps_cache'] = self._dist_maps_cache
+        if self.cache_image_features and hasattr(self.net, 'get_image_features'):
+            net_kwargs['image_features'] = self._get_image_features(image_nd)
+        return self.net(image_nd, points_nd, **net_kwargs)['instances']
+
+    def _get_image_features(self, image_nd):
+        # The transforms (zoom-in, flip) can change the network input between the clicks,
+        # so the cached features are reused only for exactly the same image
+        image_rgb = image_nd[:, :3]
+        if self._image_features_cache is not None:
+            net, cached_rgb, image_features = self._image_features_cache
+            if net is self.net and cached_rgb.shape == image_rgb.shape and torch.equal(cached_rgb, image_rgb):
+                return image_features
+
+        with torch.no_grad():
+            image_features = self.net.get_image_features(image_nd)
+        self._image_features_cache = (self.net, image_rgb, image_features)
+        return image_features
 
     def _get_transform_states(self):
         return [x.get_state() for x in self.transforms]
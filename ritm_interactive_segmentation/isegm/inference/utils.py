@@ -18,6 +18,13 @@ def get_time_metrics(all_ious, elapsed_time):
     return mean_spc, mean_spi
 
 
+def get_throughput_metrics(all_ious, elapsed_time):
+    n_images = len(all_ious)
+    n_clicks = sum(map(len, all_ious))
+
+    return n_images / elapsed_time, n_clicks / elapsed_time
+
+
 def load_is_model(checkpoint, device, **kwargs):
     if isinstance(checkpoint, (str, Path)):
         state_dict = torch.load(checkpoint, map_location='cpu')
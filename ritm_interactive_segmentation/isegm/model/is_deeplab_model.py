@@ -19,7 +19,10 @@ class DeeplabModel(ISModel):
         self.head = SepConvHead(1, in_channels=deeplab_ch, mid_channels=deeplab_ch // 2,
                                 num_layers=2, norm_layer=norm_layer)
 
-    def backbone_forward(self, image, coord_features=None):
-        backbone_features = self.feature_extractor(image, coord_features)
+    def backbone_forward(self, image, coord_features=None, image_features=None):
+        backbone_features = self.feature_extractor(image, coord_features, image_features)
 
         return {'instances': self.head(backbone_features[0])}
+
+    def backbone_image_features(self, image):
+        return self.feature_extractor.backbone.compute_stem_features(image)
@@ -20,7 +20,10 @@ class HRNetModel(ISModel):
             self.feature_extractor.ocr_gather_head.apply(LRMult(1.0))
             self.feature_extractor.conv3x3_ocr.apply(LRMult(1.0))
 
-    def backbone_forward(self, image, coord_features=None):
-        net_outputs = self.feature_extractor(image, coord_features)
+    def backbone_forward(self, image, coord_features=None, image_features=None):
+        net_outputs = self.feature_extractor(image, coord_features, image_features)
 
         return {'instances': net_outputs[0], 'instances_aux': net_outputs[1]}
+
+    def backbone_image_features(self, image):
+        return self.feature_extractor.compute_stem_features(image)
@@ -58,16 +58,21 @@ class ISModel(nn.Module):
             self.dist_maps = DistMaps(norm_radius=norm_radius, spatial_scale=1.0,
                                       cpu_mode=cpu_dist_maps, use_disks=use_disks)
 
-    def forward(self, image, points):
+    def forward(self, image, points, image_features=None, dist_maps_cache=None):
+        """
+        image_features: result of `get_image_features(image)`, to skip recomputing the part of the backbone
+        that does not depend on the clicks (e.g. on every click on the same image).
+        dist_maps_cache: `DistMapsCache` of the caller, to update the click maps only for the new clicks.
+        """
         image, prev_mask = self.prepare_input(image)
-        coord_features = self.get_coord_features(image, prev_mask, points)
+        coord_features = self.get_coord_features(image, prev_mask, points, dist_maps_cache)
 
         if self.rgb_conv is not None:
             x = self.rgb_conv(torch.cat((image, coord_features), dim=1))
             outputs = self.backbone_forward(x)
         else:
             coord_features = self.maps_transform(coord_features)
-            outputs = self.backbone_forward(image, coord_features)
+            outputs = self.backbone_forward(image, coord_features, image_features)
 
         outputs['instances'] = nn.functional.interpolate(outputs['instances'], size=image.size()[2:],
                                                          mode='bilinear', align_corners=True)
@@ -88,16 +93,30 @@ class ISModel(nn.Module):
         image = self.normalization(image)
         return image, prev_mask
 
-    def backbone_forward(self, image, coord_features=None):
+    def backbone_forward(self, image, coord_features=None, image_features=None):
         raise NotImplementedError
 
-    def get_coord_features(self, image, prev_mask, points):
+    def get_image_features(self, image):
+        """
+        Backbone features that depend only on the image, not on the clicks or the previous mask.
+        None if there are no such features: with `rgb_conv` the clicks are fused with the input image.
+        """
+        if self.rgb_conv is not None:
+            return None
+
+        image, _ = self.prepare_input(image)
+        return self.backbone_image_features(image)
+
+    def backbone_image_features(self, image):
+        return None
+
+    def get_coord_features(self, image, prev_mask, points, dist_maps_cache=None):
         if self.clicks_groups is not None:
             points_groups = split_points_by_order(points, groups=(2,) + (1, ) * (len(self.clicks_groups) - 2) + (-1,))
-            coord_features = [dist_map(image, pg) for dist_map, pg in zip(self.dist_maps, points_groups)]
+            coord_features = [dist_map(image, pg, cache=dist_maps_cache) for dist_map, pg in zip(self.dist_maps, points_groups)]
             coord_features = torch.cat(coord_features, dim=1)
         else:
-            coord_features = self.dist_maps(image, points)
+            coord_features = self.dist_maps(image, points, cache=dist_maps_cache)
 
         if prev_mask is not None:
             coord_features = torch.cat((prev_mask, coord_features), dim=1)
@@ -326,8 +326,8 @@ class HighResolutionNet(nn.Module):
 
         return nn.Sequential(*modules), num_inchannels
 
-    def forward(self, x, additional_features=None):
-        feats = self.compute_hrnet_feats(x, additional_features)
+    def forward(self, x, additional_features=None, stem_features=None):
+        feats = self.compute_hrnet_feats(x, additional_features, stem_features)
         if self.ocr_width > 0:
             out_aux = self.aux_head(feats)
             feats = self.conv3x3_ocr(feats)
@@ -339,8 +339,8 @@ class HighResolutionNet(nn.Module):
         else:
             return [self.cls_head(feats), None]
 
-    def compute_hrnet_feats(self, x, additional_features):
-        x = self.compute_pre_stage_features(x, additional_features)
+    def compute_hrnet_feats(self, x, additional_features, stem_features=None):
+        x = self.compute_pre_stage_features(x, additional_features, stem_features)
         x = self.layer1(x)
 
         x_list = []
@@ -375,10 +375,14 @@ class HighResolutionNet(nn.Module):
 
         return self.aggregate_hrnet_features(x)
 
-    def compute_pre_stage_features(self, x, additional_features):
+    def compute_stem_features(self, x):
         x = self.conv1(x)
         x = self.bn1(x)
-        x = self.relu(x)
+        return self.relu(x)
+
+    def compute_pre_stage_features(self, x, additional_features, stem_features=None):
+        # stem_features: precomputed self.compute_stem_features(x), they do not depend on the clicks
+        x = self.compute_stem_features(x) if stem_features is None else stem_features
         if additional_features is not None:
             x = x + additional_features
         x = self.conv2(x)
@@ -26,10 +26,14 @@ class ResNetBackbone(torch.nn.Module):
         self.layer3 = pretrained.layer3
         self.layer4 = pretrained.layer4
 
-    def forward(self, x, additional_features=None):
+    def compute_stem_features(self, x):
         x = self.conv1(x)
         x = self.bn1(x)
-        x = self.relu(x)
+        return self.relu(x)
+
+    def forward(self, x, additional_features=None, stem_features=None):
+        # stem_features: precomputed self.compute_stem_features(x), they do not depend on the clicks
+        x = self.compute_stem_features(x) if stem_features is None else stem_features
         if additional_features is not None:
             x = x + torch.nn.functional.pad(additional_features,
                                             [0, 0, 0, 0, 0, x.size(1) - additional_features.size(1)],
@@ -45,7 +45,21 @@ class DistMaps(nn.Module):
             from isegm.utils.cython import get_dist_maps
             self._get_dist_maps = get_dist_maps
 
-    def get_coord_features(self, points, batchsize, rows, cols):
+    def get_coord_features(self, points, batchsize, rows, cols, cache=None):
+        if cache is not None:
+            coords = cache.get_dist_maps(self, points, rows, cols).clone()
+        else:
+            coords = self.get_squared_dist_maps(points, batchsize, rows, cols)
+
+        if self.use_disks:
+            coords = (coords <= (self.norm_radius * self.spatial_scale) ** 2).float()
+        else:
+            coords.sqrt_().mul_(2).tanh_()
+
+        return coords
+
+    def get_squared_dist_maps(self, points, batchsize, rows, cols):
+        # (bs * num_masks) x 2 x h x w, squared (normalized) distance to the nearest positive / negative click
         if self.cpu_mode:
             coords = []
             for i in range(batchsize):
@@ -80,15 +94,96 @@ class DistMaps(nn.Module):
             coords = coords.min(dim=1)[0]  # -> (bs * num_masks * 2) x 1 x h x w
             coords = coords.view(-1, 2, rows, cols)
 
-        if self.use_disks:
-            coords = (coords <= (self.norm_radius * self.spatial_scale) ** 2).float()
-        else:
-            coords.sqrt_().mul_(2).tanh_()
-
         return coords
 
-    def forward(self, x, coords):
-        return self.get_coord_features(coords, x.shape[0], x.shape[2], x.shape[3])
+    def get_point_squared_dist_map(self, point, rows, cols, device):
+        # h x w map of a single click, the same values as the torch mode computes for it
+        point = torch.as_tensor(point, device=device) * self.spatial_scale
+        row_array = torch.arange(start=0, end=rows, step=1, dtype=torch.float32, device=device) - point[0]
+        col_array = torch.arange(start=0, end=cols, step=1, dtype=torch.float32, device=device) - point[1]
+        if not self.use_disks:
+            row_array.div_(self.norm_radius * self.spatial_scale)
+            col_array.div_(self.norm_radius * self.spatial_scale)
+
+        return (row_array * row_array)[:, None] + (col_array * col_array)[None, :]
+
+    def forward(self, x, coords, cache=None):
+        return self.get_coord_features(coords, x.shape[0], x.shape[2], x.shape[3], cache=cache)
+
+
+class DistMapsCache:
+    """
+    Squared distance maps of the clicks of one predictor, kept between its predictions.
+
+    Clicks are only appended or popped, so the maps of a new click are the elementwise minimum of the
+    previous maps and the map of that single click, and an undo goes back to a snapshot of earlier maps.
+    Any other change of the clicks (e.g. the zoom-in moving all of them) builds the maps from scratch.
+    The maps are built click by click, the same as the torch mode of DistMaps computes them.
+    """
+
+    def __init__(self, max_snapshots=4):
+        self.max_snapshots = max_snapshots
+        self._snapshots = {}  # DistMaps -> [(clicks key, maps)], the latest last
+
+    def reset(self):
+        self._snapshots = {}
+
+    @staticmethod
+    def _clicks_key(points, rows, cols):
+        # for every batch item, the valid (row, col) of the positive and of the negative clicks in order
+        points = points[:, :, :2].cpu().numpy()
+        num_points = points.shape[1] // 2
+        key = []
+        for item_points in points:
+            key.append(tuple(tuple(tuple(p) for p in layer_points if max(p) >= 0)
+                             for layer_points in (item_points[:num_points], item_points[num_points:])))
+        return (rows, cols), tuple(key)
+
+    @staticmethod
+    def _new_clicks(old_key, new_key):
+        # clicks added since `old_key` for every item and layer, None if the clicks changed otherwise
+        if old_key[0] != new_key[0] or len(old_key[1]) != len(new_key[1]):
+            return None
+
+        new_clicks = []
+        for old_item, new_item in zip(old_key[1], new_key[1]):
+            item_clicks = []
+            for old_layer, new_layer in zip(old_item, new_item):
+                if new_layer[:len(old_layer)] != old_layer:
+                    return None
+                item_clicks.append(new_layer[len(old_layer):])
+            new_clicks.append(item_clicks)
+        return new_clicks
+
+    def get_dist_maps(self, dist_maps, points, rows, cols):
+        key = self._clicks_key(points, rows, cols)
+        snapshots = self._snapshots.setdefault(dist_maps, [])
+
+        for i in reversed(range(len(snapshots))):
+            if snapshots[i][0] == key:
+                # undo: the later snapshots had the removed clicks
+                del snapshots[i + 1:]
+                return snapshots[i][1]
+
+        for snapshot_key, snapshot_maps in reversed(snapshots):
+            new_clicks = self._new_clicks(snapshot_key, key)
+            if new_clicks is not None:
+                maps = snapshot_maps.clone()
+                break
+        else:
+            snapshots.clear()
+            new_clicks = key[1]
+            maps = torch.full((len(new_clicks), 2, rows, cols), 1e6, dtype=torch.float32, device=points.device)
+
+        for item_indx, item_clicks in enumerate(new_clicks):
+            for layer_indx, layer_clicks in enumerate(item_clicks):
+                for click in layer_clicks:
+                    click_map = dist_maps.get_point_squared_dist_map(click, rows, cols, points.device)
+                    torch.min(maps[item_indx, layer_indx], click_map, out=maps[item_indx, layer_indx])
+
+        snapshots.append((key, maps))
+        del snapshots[:-self.max_snapshots]
+        return maps
 
 
 class ScaleLayer(nn.Module):
@@ -1,3 +1,4 @@
+import cv2
 import torch
 import numpy as np
 
@@ -42,6 +43,33 @@ def get_bbox_from_mask(mask):
     return rmin, rmax, cmin, cmax
 
 
+def get_roi_distance_transform(mask, mask_size=0, padding=True):
+    """
+    cv2.distanceTransform (DIST_L2) of a binary mask, computed only in the bounding box of its non-zero pixels
+    with a margin of 1 pixel. The nearest zero of every pixel in the box is always in the box or in the margin,
+    so the distances are the same as for the whole mask (and zero outside of the box).
+    With padding, the pixels outside of the image are zeros too.
+
+    Returns the distances and the (row, col) of their top-left pixel in the mask, or None for an empty mask.
+    """
+    rows = np.flatnonzero(np.any(mask, axis=1))
+    if len(rows) == 0:
+        return None
+    cols = np.flatnonzero(np.any(mask, axis=0))
+
+    rmin, rmax = max(rows[0] - 1, 0), min(rows[-1] + 1, mask.shape[0] - 1)
+    cmin, cmax = max(cols[0] - 1, 0), min(cols[-1] + 1, mask.shape[1] - 1)
+    roi_mask = mask[rmin:rmax + 1, cmin:cmax + 1].astype(np.uint8)
+
+    if padding:
+        roi_mask = np.pad(roi_mask, ((1, 1), (1, 1)), 'constant')
+        roi_dt = cv2.distanceTransform(roi_mask, cv2.DIST_L2, mask_size)[1:-1, 1:-1]
+    else:
+        roi_dt = cv2.distanceTransform(roi_mask, cv2.DIST_L2, mask_size)
+
+    return roi_dt, (rmin, cmin)
+
+
 def expand_bbox(bbox, expand_ratio, min_crop_size=None):
     rmin, rmax, cmin, cmax = bbox
     rcenter = 0.5 * (rmin + rmax)
@@ -4,7 +4,8 @@ import numpy as np
 from pathlib import Path
 from tqdm import tqdm
 
-from isegm.data.datasets import LvisDataset, CocoDataset
+from isegm.data.datasets import LvisDataset, CocoDataset, CocoLvisDataset
+from isegm.data.datasets.coco_lvis import get_instances_info, PACKED_DATA_FILES, PACKED_INDEX_FILE, PACKED_INDEX_DTYPE
 from isegm.utils.misc import get_bbox_from_mask, get_bbox_iou
 from scripts.annotations_conversion.common import get_masks_hierarchy, get_iou, encode_masks
 
@@ -100,6 +101,37 @@ def create_annotations(lvis_path: Path, coco_path: Path, dataset_split='train',
         pickle.dump(hlvis_annotation, f, protocol=pickle.HIGHEST_PROTOCOL)
 
 
+def create_packed_dataset(lvis_path: Path, dataset_split='train', anno_file='hannotation.pickle', packed_dir='packed'):
+    """Decodes the samples of the COCO+LVIS split once, for PackedCocoLvisDataset"""
+    dataset = CocoLvisDataset(lvis_path, split=dataset_split, anno_file=anno_file)
+    output_path = lvis_path / dataset_split / packed_dir
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    index = np.zeros(len(dataset.dataset_samples), dtype=PACKED_INDEX_DTYPE)
+    max_image_id_length = PACKED_INDEX_DTYPE['image_id'].itemsize // 4
+    data_files = [open(output_path / file_name, 'wb') for file_name in PACKED_DATA_FILES]
+    try:
+        images_file, masks_file, annotations_file = data_files
+        for indx, (image_id, sample) in enumerate(tqdm(dataset.dataset_samples)):
+            assert len(image_id) <= max_image_id_length, f'Too long image id: {image_id}'
+            image, layers, objs_mapping = dataset.load_image_and_layers(image_id)
+            instances_info = get_instances_info(sample['hierarchy'], objs_mapping)
+            annotation = pickle.dumps((instances_info, objs_mapping, sample['num_instance_masks']),
+                                      protocol=pickle.HIGHEST_PROTOCOL)
+
+            index[indx] = (image_id, image.shape[0], image.shape[1], layers.shape[2],
+                           images_file.tell(), masks_file.tell(), annotations_file.tell(), len(annotation))
+            images_file.write(np.ascontiguousarray(image, dtype=np.uint8).tobytes())
+            masks_file.write(np.ascontiguousarray(layers, dtype=np.uint8).tobytes())
+            annotations_file.write(annotation)
+    finally:
+        for f in data_files:
+            f.close()
+
+    # written last, so that an interrupted conversion can't be loaded
+    np.save(output_path / PACKED_INDEX_FILE, index)
+
+
 def get_coco_sample(dataset, index):
     dataset_sample = dataset.dataset_samples[index]
 
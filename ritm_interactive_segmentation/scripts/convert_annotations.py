@@ -11,7 +11,7 @@ from scripts.annotations_conversion import openimages, ade20k, coco_lvis
 def parse_args():
     parser = argparse.ArgumentParser()
 
-    parser.add_argument('dataset', choices=['openimages', 'ade20k', 'coco_lvis'], help='')
+    parser.add_argument('dataset', choices=['openimages', 'ade20k', 'coco_lvis', 'coco_lvis_packed'], help='')
     parser.add_argument('--split', nargs='+', choices=['train', 'val', 'test'], type=str, default=['train', 'val'],
                         help='')
     parser.add_argument('--n-jobs', type=int, default=10)
@@ -34,6 +34,8 @@ def main():
             ade20k.create_annotations(Path(cfg.ADE20K_PATH), dataset_split=split, n_jobs=args.n_jobs)
         elif args.dataset == 'coco_lvis':
             coco_lvis.create_annotations(Path(cfg.LVIS_PATH), Path(cfg.COCO_PATH), dataset_split=split)
+        elif args.dataset == 'coco_lvis_packed':
+            coco_lvis.create_packed_dataset(Path(cfg.LVIS_PATH), dataset_split=split)
 
 
 if __name__ == '__main__':
@@ -1,6 +1,7 @@
 import sys
 import pickle
 import argparse
+from functools import partial
 from pathlib import Path
 
 import cv2
@@ -55,6 +56,12 @@ def parse_args():
     parser.add_argument('--thresh', type=float, required=False, default=0.49,
                         help='The segmentation mask is obtained from the probability outputs using this threshold.')
     parser.add_argument('--clicks-limit', type=int, default=None)
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of worker processes evaluating the samples in parallel, each with its own predictor.')
+    parser.add_argument('--threads-per-worker', type=int, default=None,
+                        help='Torch threads of every worker. Default: the CPU cores split between the workers.')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Number of samples evaluated at once, with their clicks in one batch (NoBRS mode only).')
     parser.add_argument('--eval-mode', type=str, default='cvpr',
                         help='Possible choices: cvpr, fixed<number> (e.g. fixed400, fixed600).')
 
@@ -117,7 +124,10 @@ def main():
                                                max_iou_thr=args.target_iou,
                                                min_clicks=args.min_n_clicks,
                                                max_clicks=args.n_clicks,
-                                               callback=vis_callback)
+                                               callback=vis_callback,
+                                               num_workers=args.workers,
+                                               threads_per_worker=args.threads_per_worker,
+                                               batch_size=args.batch_size)
 
             row_name = args.mode if single_model_eval else checkpoint_path.stem
             if args.iou_analysis:
@@ -191,6 +201,7 @@ def save_results(args, row_name, dataset_name, logs_path, logs_prefix, dataset_r
                  save_ious=False, print_header=True, single_model_eval=False):
     all_ious, elapsed_time = dataset_results
     mean_spc, mean_spi = utils.get_time_metrics(all_ious, elapsed_time)
+    samples_per_second, clicks_per_second = utils.get_throughput_metrics(all_ious, elapsed_time)
 
     iou_thrs = np.arange(0.8, min(0.95, args.target_iou) + 0.001, 0.05).tolist()
     noc_list, over_max_list = utils.compute_noc_metric(all_ious, iou_thrs=iou_thrs, max_clicks=args.n_clicks)
@@ -215,6 +226,8 @@ def save_results(args, row_name, dataset_name, logs_path, logs_prefix, dataset_r
             table_row += f' NoC@{args.target_iou:.1%} = {noc_list[0]:.2f};'
             table_row += f' >={args.n_clicks}@{args.target_iou:.1%} = {over_max_list[0]}'
 
+    table_row += f' {samples_per_second:.2f} samples/s, {clicks_per_second:.2f} clicks/s;'
+
     if print_header:
         print(header)
     print(table_row)
@@ -262,17 +275,19 @@ def save_iou_analysis_data(args, dataset_name, logs_path, logs_prefix, dataset_r
         }, f)
 
 
+def save_prediction_vis(save_path, prob_thresh, image, gt_mask, pred_probs, sample_id, click_indx, clicks_list):
+    sample_path = save_path / f'{sample_id}_{click_indx}.jpg'
+    prob_map = draw_probmap(pred_probs)
+    image_with_mask = draw_with_blend_and_clicks(image, pred_probs > prob_thresh, clicks_list=clicks_list)
+    cv2.imwrite(str(sample_path), np.concatenate((image_with_mask, prob_map), axis=1)[:, :, ::-1])
+
+
 def get_prediction_vis_callback(logs_path, dataset_name, prob_thresh):
     save_path = logs_path / 'predictions_vis' / dataset_name
     save_path.mkdir(parents=True, exist_ok=True)
 
-    def callback(image, gt_mask, pred_probs, sample_id, click_indx, clicks_list):
-        sample_path = save_path / f'{sample_id}_{click_indx}.jpg'
-        prob_map = draw_probmap(pred_probs)
-        image_with_mask = draw_with_blend_and_clicks(image, pred_probs > prob_thresh, clicks_list=clicks_list)
-        cv2.imwrite(str(sample_path), np.concatenate((image_with_mask, prob_map), axis=1)[:, :, ::-1])
-
-    return callback
+    # not a closure, so that it can be sent to the evaluation workers
+    return partial(save_prediction_vis, save_path, prob_thresh)
 
 
 if __name__ == '__main__':
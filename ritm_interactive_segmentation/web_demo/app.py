@@ -10,7 +10,11 @@ import tempfile
 import json
 import sys
 import traceback
+import functools
+import atexit
 import subprocess
+import urllib.request
+import urllib.error
 
 # Add parent directory to Python path for isegm module
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -21,6 +25,10 @@ from interactive_demo.controller import InteractiveController
 # Import model loader
 from model_loader import load_model_from_config, get_model_config
 
+from session_store import SessionStore
+from mask_transport import encode_mask_delta, MIMETYPE as MASK_DELTA_MIMETYPE
+from mask_writer import CoalescingMaskWriter
+
 # Import mask_to_json
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../../backend/src/scripts')))
 from mask_to_json import mask_to_json
@@ -33,15 +41,19 @@ MASK_RITM_DIR = '/home/aravinthakshan/Projects/Samsung2/Samsung-Prism/backend/sr
 JPEGIMAGES_DIR = '/home/aravinthakshan/Projects/Samsung2/Samsung-Prism/backend/src/JPEGImages'
 JSON_DIR = '/home/aravinthakshan/Projects/Samsung2/Samsung-Prism/backend/src/json'
 PROCESS_SINGLE_FRAME_SCRIPT = '/home/aravinthakshan/Projects/Samsung2/Samsung-Prism/backend/src/scripts/process_single_frame.py'
+# Persistent XMem service (backend/src/scripts/xmem_daemon.py), used instead of the script when running
+XMEM_DAEMON_URL = os.environ.get('XMEM_DAEMON_URL', 'http://127.0.0.1:5001')
 
 app = Flask(__name__)
-CORS(app)  # Enable CORS for all routes
+CORS(app, expose_headers=['X-Clicks-Count', 'X-Object-Count'])  # Enable CORS for all routes
 
-# Global variables to store the current session state
-current_controller = None
-current_image = None
-session_data = {}
-current_filename = None  # Store the uploaded filename
+# State of every annotator (browser tab), keyed by the session id sent with the requests.
+# Requests without one share the 'default' session.
+sessions = SessionStore(
+    idle_timeout=float(os.environ.get('RITM_SESSION_IDLE_TIMEOUT', 1800)),
+    max_sessions=int(os.environ.get('RITM_MAX_SESSIONS', 16)),
+    max_memory_mb=float(os.environ.get('RITM_SESSION_MEMORY_MB', 2048))
+)
 
 # Load model at startup
 print("Loading model...")
@@ -49,14 +61,86 @@ model_config = get_model_config()
 model = load_model_from_config(model_config)
 print(f"Model loaded: {type(model)}")
 
+def get_session_id():
+    """Session id from the X-Session-Id header, the `session_id` field of the request or 'default'"""
+    session_id = request.headers.get('X-Session-Id') or request.args.get('session_id')
+    if not session_id:
+        data = request.get_json(silent=True) if request.is_json else None
+        session_id = (data or {}).get('session_id') or request.form.get('session_id')
+    return session_id or 'default'
+
+def get_session():
+    return sessions.get(get_session_id())
+
+def with_session(view):
+    """Pass the caller's session to the view, holding its lock for the whole request"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        session = get_session()
+        with session.lock:
+            return view(session, *args, **kwargs)
+    return wrapper
+
+def wants_mask_delta():
+    """
+    Whether the client asked for the compact binary mask (see mask_transport.py) instead of a base64 PNG:
+    `?format=rle` or the `X-Mask-Format: rle` header.
+    """
+    return request.args.get('format') == 'rle' or request.headers.get('X-Mask-Format') == 'rle'
+
+def mask_delta_response(session, headers):
+    """Changes of the label mask since the last binary response of the session, run-length encoded"""
+    mask = session.controller.result_mask
+    prev_mask = None if request.args.get('full') == '1' else session.sent_mask
+    response = app.response_class(encode_mask_delta(mask, prev_mask), mimetype=MASK_DELTA_MIMETYPE)
+    session.sent_mask = mask
+    for name, value in headers.items():
+        response.headers[name] = str(value)
+    return response
+
+def write_ritm_mask(save_path, mask):
+    mask_to_save = mask
+    if mask_to_save.max() < 256:
+        mask_to_save = mask_to_save.astype(np.uint8)
+        mask_to_save *= 255 // mask_to_save.max() if mask_to_save.max() > 0 else 255
+    os.makedirs(os.path.dirname(save_path), exist_ok=True)
+    if not cv2.imwrite(save_path, mask_to_save):
+        raise IOError(f'Could not write mask: {save_path}')
+
+# The masks saved after every click are written in the background, only the latest one per file
+mask_writer = CoalescingMaskWriter(write_ritm_mask)
+atexit.register(mask_writer.close)
+
+def ritm_mask_path(filename):
+    return os.path.join(MASK_RITM_DIR, f'{filename}.png')
+
+def save_ritm_mask(session, mask):
+    """Queue the current mask to be saved under mask-ritm/<imagename>.png"""
+    if mask is None or not session.filename:
+        return
+    # result_mask is a fresh copy, nothing else modifies it while it waits in the queue
+    mask_writer.submit(ritm_mask_path(session.filename), mask)
+
+def create_controller(image):
+    """Controller for a new image, all sessions share the loaded model"""
+    controller = InteractiveController(
+        net=model,  # Use the loaded model
+        device=model_config.get('device', 'cpu'),
+        # the image-only backbone features are computed once per image and reused on every click,
+        # the click maps are only updated for the new click
+        predictor_params={'brs_mode': 'NoBRS', 'predictor_params': {'cache_image_features': True, 'cache_dist_maps': True}},
+        update_image_callback=lambda reset_canvas=False: None,
+        prob_thresh=0.5
+    )
+    controller.set_image(image)
+    return controller
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/upload_image', methods=['POST'])
 def upload_image():
-    global current_controller, current_image, session_data, current_filename
-    
     if 'image' not in request.files:
         return jsonify({'error': 'No image uploaded'}), 400
     
@@ -64,7 +148,7 @@ def upload_image():
     if file.filename == '':
         return jsonify({'error': 'No image selected'}), 400
     
-    current_filename = os.path.splitext(file.filename)[0]  # Store base name without extension
+    session = get_session()
     
     try:
         # Read and process the image
@@ -85,15 +169,16 @@ def upload_image():
         print(f"Image dtype: {image.dtype}")
         
         # Initialize controller with the loaded model
-        current_image = image
-        current_controller = InteractiveController(
-            net=model,  # Use the loaded model
-            device=model_config.get('device', 'cpu'),
-            predictor_params={'brs_mode': 'NoBRS'},
-            update_image_callback=lambda reset_canvas=False: None,
-            prob_thresh=0.5
-        )
-        current_controller.set_image(image)
+        controller = create_controller(image)
+        with session.lock:
+            session.filename = os.path.splitext(file.filename)[0]  # Store base name without extension
+            session.image = image
+            session.controller = controller
+            session.sent_mask = None
+
+        if wants_mask_delta():
+            # The browser already has the image, it only needs the masks from now on
+            return jsonify({'success': True, 'width': image.shape[1], 'height': image.shape[0]})
         
         # Convert image to base64 for display
         pil_image = Image.fromarray(image)
@@ -112,11 +197,12 @@ def upload_image():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/add_click', methods=['POST'])
-def add_click():
-    global current_controller
+@with_session
+def add_click(session):
+    controller = session.controller
     
-    if current_controller is None:
-        return jsonify({'error': 'No image loaded', 'debug': 'current_controller is None'}), 400
+    if controller is None:
+        return jsonify({'error': 'No image loaded', 'debug': 'controller is None'}), 400
     try:
         data = request.get_json()
         x = data.get('x')
@@ -124,9 +210,12 @@ def add_click():
         is_positive = data.get('is_positive', True)
         
         print(f"[RITM] Received click: x={x}, y={y}, is_positive={is_positive}", flush=True)
-        current_controller.add_click(x, y, is_positive)
+        controller.add_click(x, y, is_positive)
+        if wants_mask_delta():
+            save_ritm_mask(session, controller.result_mask)
+            return mask_delta_response(session, {'X-Clicks-Count': len(controller.clicker.clicks_list)})
         # Get the visualization
-        vis_image = current_controller.get_visualization(alpha_blend=0.5, click_radius=3)
+        vis_image = controller.get_visualization(alpha_blend=0.5, click_radius=3)
         if vis_image is not None:
             pil_image = Image.fromarray(vis_image)
             buffer = io.BytesIO()
@@ -134,23 +223,12 @@ def add_click():
             img_str = base64.b64encode(buffer.getvalue()).decode()
             
             # Save the current mask after each click
-            mask = current_controller.result_mask
-            if mask is not None:
-                mask_to_save = mask.copy()
-                if mask_to_save.max() < 256:
-                    mask_to_save = mask_to_save.astype(np.uint8)
-                    mask_to_save *= 255 // mask_to_save.max() if mask_to_save.max() > 0 else 255
-                # Save under mask-ritm/<imagename>.png
-                if not os.path.exists(MASK_RITM_DIR):
-                    os.makedirs(MASK_RITM_DIR)
-                if current_filename:
-                    save_path = os.path.join(MASK_RITM_DIR, f'{current_filename}.png')
-                    cv2.imwrite(save_path, mask_to_save)
+            save_ritm_mask(session, controller.result_mask)
             
             return jsonify({
                 'success': True,
                 'image': img_str,
-                'clicks_count': len(current_controller.clicker.clicks_list)
+                'clicks_count': len(controller.clicker.clicks_list)
             })
         else:
             return jsonify({'error': 'Failed to generate visualization', 'debug': 'vis_image is None'}), 500
@@ -160,17 +238,20 @@ def add_click():
         return jsonify({'error': str(e), 'trace': tb}), 500
 
 @app.route('/finish_object', methods=['POST'])
-def finish_object():
-    global current_controller
+@with_session
+def finish_object(session):
+    controller = session.controller
     
-    if current_controller is None:
+    if controller is None:
         return jsonify({'error': 'No image loaded'}), 400
     
     try:
-        current_controller.finish_object()
+        controller.finish_object()
+        if wants_mask_delta():
+            return mask_delta_response(session, {'X-Object-Count': controller.object_count})
         
         # Get the visualization
-        vis_image = current_controller.get_visualization(alpha_blend=0.5, click_radius=3)
+        vis_image = controller.get_visualization(alpha_blend=0.5, click_radius=3)
         
         if vis_image is not None:
             # Convert to base64
@@ -182,7 +263,7 @@ def finish_object():
             return jsonify({
                 'success': True,
                 'image': img_str,
-                'object_count': current_controller.object_count
+                'object_count': controller.object_count
             })
         else:
             return jsonify({'error': 'Failed to generate visualization'}), 500
@@ -191,17 +272,20 @@ def finish_object():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/undo_click', methods=['POST'])
-def undo_click():
-    global current_controller
+@with_session
+def undo_click(session):
+    controller = session.controller
     
-    if current_controller is None:
+    if controller is None:
         return jsonify({'error': 'No image loaded'}), 400
     
     try:
-        current_controller.undo_click()
+        controller.undo_click()
+        if wants_mask_delta():
+            return mask_delta_response(session, {'X-Clicks-Count': len(controller.clicker.clicks_list)})
         
         # Get the visualization
-        vis_image = current_controller.get_visualization(alpha_blend=0.5, click_radius=3)
+        vis_image = controller.get_visualization(alpha_blend=0.5, click_radius=3)
         
         if vis_image is not None:
             # Convert to base64
@@ -213,7 +297,7 @@ def undo_click():
             return jsonify({
                 'success': True,
                 'image': img_str,
-                'clicks_count': len(current_controller.clicker.clicks_list)
+                'clicks_count': len(controller.clicker.clicks_list)
             })
         else:
             return jsonify({'error': 'Failed to generate visualization'}), 500
@@ -222,17 +306,20 @@ def undo_click():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/reset_clicks', methods=['POST'])
-def reset_clicks():
-    global current_controller
+@with_session
+def reset_clicks(session):
+    controller = session.controller
     
-    if current_controller is None:
+    if controller is None:
         return jsonify({'error': 'No image loaded'}), 400
     
     try:
-        current_controller.reset_last_object()
+        controller.reset_last_object()
+        if wants_mask_delta():
+            return mask_delta_response(session, {'X-Clicks-Count': 0})
         
         # Get the visualization
-        vis_image = current_controller.get_visualization(alpha_blend=0.5, click_radius=3)
+        vis_image = controller.get_visualization(alpha_blend=0.5, click_radius=3)
         
         if vis_image is not None:
             # Convert to base64
@@ -253,14 +340,15 @@ def reset_clicks():
         return jsonify({'error': str(e)}), 500
 
 @app.route('/save_mask', methods=['POST'])
-def save_mask():
-    global current_controller
+@with_session
+def save_mask(session):
+    controller = session.controller
     
-    if current_controller is None:
+    if controller is None:
         return jsonify({'error': 'No image loaded'}), 400
     
     try:
-        mask = current_controller.result_mask
+        mask = controller.result_mask
         
         if mask is None:
             return jsonify({'error': 'No mask to save'}), 400
@@ -290,10 +378,18 @@ def model_info():
         'model_class': type(model).__name__
     })
 
+@app.route('/close_session', methods=['POST'])
+def close_session():
+    """Drop the caller's session (e.g. when the annotation tab is closed) to free its memory right away."""
+    return jsonify({'success': sessions.remove(get_session_id())})
+
+@app.route('/sessions_info', methods=['GET'])
+def sessions_info():
+    """Number of active sessions and the memory they hold."""
+    return jsonify(sessions.stats())
+
 @app.route('/load_image_by_name', methods=['POST'])
 def load_image_by_name():
-    global current_controller, current_image, session_data, current_filename
-
     data = request.get_json()
     filename = data.get('filename')
     if not filename:
@@ -307,16 +403,16 @@ def load_image_by_name():
     try:
         image = cv2.imread(image_path)
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        current_filename = os.path.splitext(filename)[0]
-        current_image = image
-        current_controller = InteractiveController(
-            net=model,
-            device=model_config.get('device', 'cpu'),
-            predictor_params={'brs_mode': 'NoBRS'},
-            update_image_callback=lambda reset_canvas=False: None,
-            prob_thresh=0.5
-        )
-        current_controller.set_image(image)
+        controller = create_controller(image)
+        session = get_session()
+        with session.lock:
+            session.filename = os.path.splitext(filename)[0]
+            session.image = image
+            session.controller = controller
+            session.sent_mask = None
+
+        if wants_mask_delta():
+            return jsonify({'success': True, 'width': image.shape[1], 'height': image.shape[0]})
 
         pil_image = Image.fromarray(image)
         buffer = io.BytesIO()
@@ -335,13 +431,15 @@ def load_image_by_name():
         return jsonify({'error': str(e), 'trace': tb}), 500
 
 @app.route('/save_ritm_json', methods=['POST'])
-def save_ritm_json():
-    global current_controller, current_filename
-    if current_controller is None or current_filename is None:
+@with_session
+def save_ritm_json(session):
+    controller, current_filename = session.controller, session.filename
+    if controller is None or current_filename is None:
         return jsonify({'error': 'No image loaded'}), 400
     try:
-        # Path to the latest mask
-        mask_path = os.path.join(MASK_RITM_DIR, f'{current_filename}.png')
+        # Path to the latest mask, wait until it is written
+        mask_path = ritm_mask_path(current_filename)
+        mask_writer.flush(mask_path)
         if not os.path.exists(mask_path):
             return jsonify({'error': f'Mask not found for {current_filename}'}), 404
         # Output JSON directory
@@ -353,12 +451,34 @@ def save_ritm_json():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def propagate_with_xmem_daemon(frame_number):
+    """Ask the running XMem daemon to propagate a frame. Returns (result, status code) or None if it is not running."""
+    req = urllib.request.Request(
+        f'{XMEM_DAEMON_URL}/propagate',
+        data=json.dumps({'frameNumber': frame_number}).encode(),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(req) as response:
+            return json.loads(response.read()), response.status
+    except urllib.error.HTTPError as e:
+        # The daemon is up, but failed to process the frame
+        return json.loads(e.read()), e.code
+    except (urllib.error.URLError, ConnectionError):
+        return None
+
 @app.route('/xmem_single_frame', methods=['POST'])
 def xmem_single_frame():
     data = request.get_json()
     frame_number = data.get('frameNumber')
     if frame_number is None or not isinstance(frame_number, int):
         return jsonify({'error': 'frameNumber is required and must be an integer'}), 400
+    daemon_response = propagate_with_xmem_daemon(frame_number)
+    if daemon_response is not None:
+        result, status = daemon_response
+        return jsonify(result), status
+    # Fall back to a one-off XMem process if the daemon is not running
     script_path = PROCESS_SINGLE_FRAME_SCRIPT
     try:
         process = subprocess.Popen(
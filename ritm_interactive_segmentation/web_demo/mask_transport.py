@@ -0,0 +1,91 @@
+"""
+Compact binary transport of the label mask, an alternative to base64 PNGs of the whole visualization.
+
+Instead of blending the mask into the image, encoding it to PNG and base64 on every click, the server sends
+only the part of the label mask that changed since the last response (its dirty rectangle), run-length encoded.
+The browser keeps the image it uploaded, applies the delta to its copy of the mask and does the blending.
+
+Payload layout (little-endian):
+
+    magic       4s   b'RMSK'
+    version     u8   1
+    flags       u8   bit 0: full mask (the rectangle covers the whole image and replaces the client's mask)
+    reserved    u16
+    width       u32  size of the whole mask
+    height      u32
+    x, y, w, h  u32  dirty rectangle, w = h = 0 if nothing changed
+    num_runs    u32
+    values      u16[num_runs]  label of every run (0 - background, i - object i)
+    lengths     u32[num_runs]  length of every run, the runs cover the rectangle row by row
+"""
+import struct
+
+import numpy as np
+
+MAGIC = b'RMSK'
+VERSION = 1
+FLAG_FULL = 1
+
+_HEADER = struct.Struct('<4sBBHIIIIIII')
+MIMETYPE = 'application/octet-stream'
+
+
+def rle_encode(values):
+    """Run-length encoding of a 1D array: (run values, run lengths)"""
+    if values.size == 0:
+        return values[:0], np.zeros(0, dtype=np.uint32)
+
+    starts = np.concatenate(([0], np.flatnonzero(values[1:] != values[:-1]) + 1))
+    lengths = np.diff(np.append(starts, values.size))
+    return values[starts], lengths.astype(np.uint32)
+
+
+def rle_decode(run_values, run_lengths):
+    return np.repeat(run_values, run_lengths)
+
+
+def dirty_rect(mask, prev_mask):
+    """Bounding box (x, y, w, h) of the pixels that differ, (0, 0, 0, 0) if none"""
+    changed = mask != prev_mask
+    rows = np.flatnonzero(changed.any(axis=1))
+    if rows.size == 0:
+        return 0, 0, 0, 0
+    cols = np.flatnonzero(changed.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1] - cols[0] + 1), int(rows[-1] - rows[0] + 1)
+
+
+def encode_mask_delta(mask, prev_mask=None):
+    """
+    Encode `mask` (H x W labels) as the change from `prev_mask`, the mask the client already has.
+    Without `prev_mask` (or if its size differs), the whole mask is sent.
+    """
+    height, width = mask.shape
+    if prev_mask is None or prev_mask.shape != mask.shape:
+        flags, (x, y, w, h) = FLAG_FULL, (0, 0, width, height)
+    else:
+        flags, (x, y, w, h) = 0, dirty_rect(mask, prev_mask)
+
+    run_values, run_lengths = rle_encode(np.ascontiguousarray(mask[y:y + h, x:x + w]).ravel())
+
+    header = _HEADER.pack(MAGIC, VERSION, flags, 0, width, height, x, y, w, h, len(run_values))
+    return b''.join((header, run_values.astype('<u2').tobytes(), run_lengths.astype('<u4').tobytes()))
+
+
+def decode_mask_delta(payload, prev_mask=None):
+    """Apply a payload from `encode_mask_delta` to `prev_mask`, returns the new mask (reference for the clients)"""
+    magic, version, flags, _, width, height, x, y, w, h, num_runs = _HEADER.unpack_from(payload)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('Not a mask payload')
+
+    offset = _HEADER.size
+    run_values = np.frombuffer(payload, dtype='<u2', count=num_runs, offset=offset)
+    run_lengths = np.frombuffer(payload, dtype='<u4', count=num_runs, offset=offset + 2 * num_runs)
+
+    if flags & FLAG_FULL or prev_mask is None:
+        mask = np.zeros((height, width), dtype=np.uint16)
+    else:
+        mask = prev_mask.copy()
+    if w and h:
+        mask[y:y + h, x:x + w] = rle_decode(run_values, run_lengths).reshape(h, w)
+
+    return mask
@@ -0,0 +1,93 @@
+"""
+Background writer for the masks saved after every click.
+
+Encoding a PNG takes long enough to be felt on every click, so the masks are written by a background thread.
+Writes are coalesced per file: if a newer mask for the same file arrives before the previous one was written,
+only the newest one is written. `flush` waits until the pending masks are on the disk (e.g. before converting them).
+"""
+import threading
+import traceback
+
+
+class CoalescingMaskWriter:
+    """
+    Parameters
+    ----------
+    write_fn : callable
+        `write_fn(path, mask)` writes one mask, it is only ever called from the writer thread.
+
+    Examples
+    --------
+    writer = CoalescingMaskWriter(lambda path, mask: cv2.imwrite(path, mask))
+    writer.submit('mask-ritm/frame_000001.png', mask)
+    ...
+    writer.flush('mask-ritm/frame_000001.png')  # the latest mask of frame_000001 is on the disk now
+    """
+
+    def __init__(self, write_fn):
+        self.write_fn = write_fn
+        self._pending = {}       # path -> newest mask not written yet
+        self._in_progress = None  # path being written right now
+        self._errors = {}        # path -> error of its last write
+        self._condition = threading.Condition()
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name='mask-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, path, mask):
+        """Queue `mask` to be written to `path`, replacing a not yet written mask for the same path"""
+        with self._condition:
+            if self._closed:
+                raise RuntimeError('The mask writer is closed')
+            self._pending[path] = mask
+            self._errors.pop(path, None)
+            self._condition.notify_all()
+
+    def flush(self, path=None, timeout=None):
+        """
+        Wait until the mask queued for `path` (all masks if None) is written.
+        Raises the error of the write, if it failed.
+        """
+        def is_done():
+            if path is None:
+                return not self._pending and self._in_progress is None
+            return path not in self._pending and self._in_progress != path
+
+        with self._condition:
+            if not self._condition.wait_for(is_done, timeout=timeout):
+                raise TimeoutError(f'Masks were not written in {timeout}s')
+            error = self._errors.pop(path, None) if path is not None else None
+
+        if error is not None:
+            raise error
+
+    def close(self):
+        """Write the remaining masks and stop the writer thread"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    return  # closed and everything is written
+                path = next(iter(self._pending))
+                mask = self._pending.pop(path)
+                self._in_progress = path
+
+            try:
+                self.write_fn(path, mask)
+                error = None
+            except Exception as e:
+                print(f"Error writing mask {path}: {e}\n{traceback.format_exc()}")
+                error = e
+
+            with self._condition:
+                self._in_progress = None
+                if error is not None and path not in self._pending:
+                    self._errors[path] = error
+                self._condition.notify_all()
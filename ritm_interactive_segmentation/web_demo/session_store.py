@@ -0,0 +1,125 @@
+"""
+Per-annotator state of the web demo.
+
+Every browser tab gets its own `AnnotationSession` (controller, image, file name), keyed by the session id
+it sends with the requests. All the controllers share the single loaded model, so an extra annotator only
+costs the memory of their image, masks and click history.
+"""
+import threading
+import time
+
+import numpy as np
+import torch
+
+
+def _estimate_nbytes(obj, seen):
+    # numpy arrays / torch tensors reachable from `obj`, each counted once
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes
+    if isinstance(obj, torch.Tensor):
+        return obj.element_size() * obj.nelement()
+    if isinstance(obj, dict):
+        return sum(_estimate_nbytes(value, seen) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(_estimate_nbytes(value, seen) for value in obj)
+    return 0
+
+
+class AnnotationSession:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.controller = None
+        self.image = None
+        self.filename = None
+        # label mask of the last binary response, the one the client has (see mask_transport.py)
+        self.sent_mask = None
+        # requests of one session are handled one at a time, different sessions run in parallel
+        self.lock = threading.RLock()
+        self.last_used = time.monotonic()
+
+    def memory_usage(self):
+        """Approximate size (in bytes) of the images, masks and click history held by the session"""
+        seen = set()
+        total = _estimate_nbytes([self.image, self.sent_mask], seen)
+        controller = self.controller
+        if controller is not None:
+            total += _estimate_nbytes([controller._result_mask, controller.probs_history, controller.states], seen)
+            predictor = controller.predictor
+            if predictor is not None:
+                dist_maps_cache = getattr(predictor, '_dist_maps_cache', None)
+                total += _estimate_nbytes([getattr(predictor, 'original_image', None),
+                                           getattr(predictor, 'prev_prediction', None),
+                                           getattr(predictor, '_image_features_cache', None),
+                                           dist_maps_cache._snapshots if dist_maps_cache is not None else None], seen)
+        return total
+
+
+class SessionStore:
+    """
+    Sessions by id, with an idle timeout and caps on their number and total memory.
+
+    Parameters
+    ----------
+    idle_timeout : float
+        Seconds after which an unused session is dropped.
+    max_sessions : int
+        Maximum number of sessions kept at once, the least recently used ones are dropped first.
+    max_memory_mb : float
+        Cap on the total `AnnotationSession.memory_usage` of the sessions, the least recently used ones are dropped first.
+    """
+
+    def __init__(self, idle_timeout=1800, max_sessions=16, max_memory_mb=2048):
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self.max_memory = max_memory_mb * 1024 * 1024
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def get(self, session_id):
+        """The session with `session_id`, a new one if it does not exist (or was evicted)"""
+        with self._lock:
+            self._evict(keep=session_id)
+            session = self.sessions.get(session_id)
+            if session is None:
+                session = AnnotationSession(session_id)
+                self.sessions[session_id] = session
+            session.last_used = time.monotonic()
+            return session
+
+    def remove(self, session_id):
+        with self._lock:
+            return self.sessions.pop(session_id, None) is not None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'sessions': len(self.sessions),
+                'memory_mb': sum(s.memory_usage() for s in self.sessions.values()) / (1024 * 1024),
+            }
+
+    def _evict(self, keep):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if session_id != keep and now - session.last_used > self.idle_timeout:
+                del self.sessions[session_id]
+
+        # Least recently used first
+        candidates = sorted((s for s in self.sessions.values() if s.session_id != keep), key=lambda s: s.last_used)
+        count = len(self.sessions) + (keep not in self.sessions)
+        memory = sum(s.memory_usage() for s in self.sessions.values())
+        for session in candidates:
+            if count <= self.max_sessions and memory <= self.max_memory:
+                break
+            # a session that is serving a request right now is not dropped under it
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                memory -= session.memory_usage()
+                count -= 1
+                del self.sessions[session.session_id]
+            finally:
+                session.lock.release()